@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+"""
+Concurrency Stress Benchmark
+Measures add_message throughput with and without dashboard readers running
+
+Usage: python benchmarks/bench_concurrency.py [--writers 8] [--readers 4] [--messages 200000]
+       [--users 5000] [--read-interval 0.01]
+
+Under the GIL every reader also takes CPU time from the writers, so readers
+are paced like dashboard requests; --read-interval 0 measures the worst case.
+"""
+
+import argparse
+import logging
+import os
+import sys
+import threading
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from simple_bot import SimpleConversationManager  # noqa: E402
+
+
+def writer(manager, anon_ids, first, count, errors):
+    try:
+        for i in range(first, first + count):
+            anon_id = anon_ids[i % len(anon_ids)]
+            manager.add_message(anon_id, {
+                'timestamp': datetime.now(),
+                'anon_id': anon_id,
+                'user_id': i % len(anon_ids),
+                'message': f"mensagem {i}",
+                'direction': 'incoming'
+            })
+    except Exception as e:
+        errors.append(e)
+
+
+def reader(manager, stop, interval, counter, errors):
+    """What a busy dashboard does: summaries, pages, deltas and full snapshots"""
+    version = manager.version
+    reads = 0
+    try:
+        while not stop.is_set():
+            manager.get_conversation_summary()
+            page, cursor = manager.get_conversations_page(limit=50)
+            if cursor:
+                manager.get_conversations_page(cursor, limit=50)
+            changes = manager.get_changes_since(version)
+            if changes is not None:
+                version = changes[2]
+            for anon_id, row in manager.get_active_conversations().items():
+                row['last_activity']
+            if page:
+                manager.get_conversation_page(page[0][0], limit=20)
+            reads += 1
+            stop.wait(interval)
+    except Exception as e:
+        errors.append(e)
+    counter.append(reads)
+
+
+def run(writers, readers, messages, users, read_interval):
+    manager = SimpleConversationManager()
+    anon_ids = [manager.register_user(user_id, f"user{user_id}", f"Nome {user_id}") for user_id in range(users)]
+    errors, read_counts = [], []
+    stop = threading.Event()
+
+    reader_threads = [threading.Thread(target=reader, args=(manager, stop, read_interval, read_counts, errors))
+                      for _ in range(readers)]
+    per_writer = messages // writers
+    writer_threads = [threading.Thread(target=writer, args=(manager, anon_ids, n * per_writer, per_writer, errors))
+                      for n in range(writers)]
+
+    for thread in reader_threads:
+        thread.start()
+    started = time.perf_counter()
+    for thread in writer_threads:
+        thread.start()
+    for thread in writer_threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    stop.set()
+    for thread in reader_threads:
+        thread.join()
+
+    written = per_writer * writers
+    consistent = (manager.total_messages == written == sum(manager.message_counts.values())
+                  and all(len(manager.conversations[a]) == manager.message_counts[a] for a in anon_ids))
+    print(f"{writers} writers, {readers} readers: {written / elapsed:10.0f} msg/s   "
+          f"{sum(read_counts) / elapsed:8.0f} dashboard reads/s   "
+          f"errors={len(errors)} consistent={consistent}")
+    for error in errors[:3]:
+        print(f"  {type(error).__name__}: {error}")
+    return not errors and consistent
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--writers', type=int, default=8)
+    parser.add_argument('--readers', type=int, default=4)
+    parser.add_argument('--messages', type=int, default=200000)
+    parser.add_argument('--users', type=int, default=5000)
+    parser.add_argument('--read-interval', type=float, default=0.01, help='seconds between dashboard reads')
+    args = parser.parse_args()
+
+    logging.disable(logging.INFO)
+    ok = run(args.writers, 0, args.messages, args.users, args.read_interval)
+    ok = run(args.writers, args.readers, args.messages, args.users, args.read_interval) and ok
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+"""
+Message Memory Benchmark
+Compares per-message dicts with MessageRecord at a given message count
+
+Usage: python benchmarks/bench_message_memory.py [--messages 1000000] [--users 10000]
+"""
+
+import argparse
+import gc
+import os
+import sys
+import tracemalloc
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from message_record import MessageRecord  # noqa: E402
+
+
+def generate(messages, users):
+    """Yield (anon_id, message_data) shaped like the dicts handlers pass to add_message"""
+    start = datetime(2025, 1, 1)
+    for i in range(messages):
+        user = i % users
+        anon_id = f"anon_{user:08x}"
+        if i % 4 == 3:
+            yield anon_id, {
+                'timestamp': start + timedelta(seconds=i),
+                'anon_id': anon_id,
+                'user_id': 100000 + user,
+                'message': f"resposta {i}",
+                'direction': 'outgoing'
+            }
+        else:
+            yield anon_id, {
+                'timestamp': start + timedelta(seconds=i),
+                'anon_id': anon_id,
+                'user_id': 100000 + user,
+                'username': f"user{user}",
+                'display_name': f"Nome {user}",
+                'message': f"mensagem anônima número {i}",
+                'direction': 'incoming'
+            }
+
+
+def measure(label, build, messages, users):
+    gc.collect()
+    tracemalloc.start()
+    conversations = {}
+    for anon_id, message_data in generate(messages, users):
+        conversations.setdefault(anon_id, []).append(build(message_data))
+    gc.collect()
+    used, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del conversations
+    gc.collect()
+    print(f"{label:<14} {used / 1024 / 1024:10.1f} MiB   {used / messages:8.1f} B/message")
+    return used
+
+
+def copy_dict(message_data):
+    # The generator's dict is what add_message used to keep, but copy it so
+    # both layouts pay for the same transient objects
+    return dict(message_data)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--messages', type=int, default=1000000)
+    parser.add_argument('--users', type=int, default=10000)
+    args = parser.parse_args()
+
+    print(f"{args.messages} messages across {args.users} users")
+    old = measure('dict', copy_dict, args.messages, args.users)
+    new = measure('MessageRecord', MessageRecord.from_dict, args.messages, args.users)
+    print(f"saving: {(old - new) / 1024 / 1024:.1f} MiB ({100 * (old - new) / old:.0f}%)")
+
+
+if __name__ == '__main__':
+    main()
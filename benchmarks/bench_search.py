@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+"""
+Search Index Benchmark
+Measures indexing throughput and query latency of SearchIndex at scale
+
+Usage: python benchmarks/bench_search.py [--messages 1000000] [--vocabulary 20000] [--conversations 5000]
+
+Every synthetic message has six rare words and one of a few very common ones,
+so the queries cover short lists, long lists and long lists that never meet.
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from search_index import SearchIndex  # noqa: E402
+
+COMMON = ['obrigado', 'pagamento', 'entrega', 'problema', 'pedido']
+
+
+def build(messages, vocabulary, conversations):
+    words = [f'palavra{i}' for i in range(vocabulary)]
+    rng = random.Random(1)
+    index = SearchIndex()
+    started = time.perf_counter()
+    for doc in range(messages):
+        text = ' '.join(rng.choices(words, k=6)) + ' ' + rng.choice(COMMON)
+        index.add(f'anon_{doc % conversations}', doc // conversations, text)
+    elapsed = time.perf_counter() - started
+    print(f"indexed {messages} messages in {elapsed:.1f}s ({messages / elapsed:.0f} msg/s)")
+    return index
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--messages', type=int, default=1000000)
+    parser.add_argument('--vocabulary', type=int, default=20000)
+    parser.add_argument('--conversations', type=int, default=5000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    index = build(args.messages, args.vocabulary, args.conversations)
+    queries = [
+        ('rare word', 'palavra17', None),
+        ('two rare words', 'palavra17 palavra99', None),
+        ('rare + common', 'palavra17 pagamento', None),
+        ('common word', 'pagamento', None),
+        ('two common, disjoint', 'obrigado entrega', None),
+        ('common, one conversation', 'pagamento', 'anon_7'),
+        ('unknown word', 'inexistente', None),
+    ]
+    for label, query, anon_id in queries:
+        best = float('inf')
+        for _ in range(args.repeat):
+            started = time.perf_counter()
+            hits, total, truncated = index.search(query, anon_id=anon_id)
+            best = min(best, time.perf_counter() - started)
+        print(f"{label:26} {total:6}{'+' if truncated else ' '} matches  {best * 1000:8.2f} ms")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,401 @@
+#!/usr/bin/env python3
+"""
+Update Handling Benchmark
+Replays synthetic Telegram update streams through the bot's UpdateEngine
+
+Usage: python benchmarks/bench_updates.py [--scenarios mixed,onboarding,chatty,admin] [--updates 50000]
+       [--users 2000] [--api-latency 0] [--output results.json] [--compare baseline.json]
+
+Each stream mixes new users (/start, then a display name), text messages,
+photos with captions, admin 'Name: reply' commands and messages from users
+the admin blocked, in proportions set by the scenario. The stream is served
+by a stubbed getUpdates to the engine's own poll loop, which dispatches it
+with per-chat ordering as in production; latencies run from getUpdates
+handing an update out to its handler returning. Bot API calls go to the same
+in-process stub behind the real outbound scheduler, with its rate limits
+lifted, so the numbers cover the bot's own work. Memory blocks and bytes an
+update leaves allocated, and the traced peak, come from a second pass under
+tracemalloc so tracing does not inflate the latencies. Peak RSS is the
+process high-water mark after each scenario.
+
+Results are written as JSON, by default to benchmarks/results/ named after
+the current commit; --compare prints the change against an earlier file and
+exits non-zero if throughput dropped by more than --max-regression percent.
+"""
+
+import argparse
+import gc
+import json
+import logging
+import os
+import platform
+import random
+import resource
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from collections import deque
+from datetime import datetime, timezone
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from message_config import MessageConfig  # noqa: E402
+from send_scheduler import OutboundScheduler  # noqa: E402
+from simple_bot import SimpleConversationManager, SimpleTelegramBot  # noqa: E402
+
+ADMIN_ID = 1000
+FIRST_USER_ID = 100000
+
+# Relative weight of each event kind per scenario
+SCENARIOS = {
+    'mixed': {'new_user': 5, 'text': 55, 'photo': 10, 'admin_reply': 20, 'blocked': 10},
+    'onboarding': {'new_user': 60, 'text': 30, 'photo': 5, 'admin_reply': 5, 'blocked': 0},
+    'chatty': {'new_user': 1, 'text': 85, 'photo': 10, 'admin_reply': 4, 'blocked': 0},
+    'admin': {'new_user': 2, 'text': 30, 'photo': 3, 'admin_reply': 65, 'blocked': 0},
+}
+
+WORDS = ('olá tudo bem queria saber sobre pedido entrega pagamento obrigado amanhã hoje ontem '
+         'problema ajuda conta senha foto produto loja horário atendimento resposta dúvida').split()
+
+# Compared by --compare; True when a higher value is better
+COMPARED_METRICS = {
+    'updates_per_sec': True,
+    'p50_ms': False,
+    'p99_ms': False,
+    'retained_blocks_per_update': False,
+    'retained_bytes_per_update': False,
+    'peak_rss_mib': False,
+}
+
+
+class StubTransport:
+    """Answers every Bot API call with ok, optionally after a fixed delay, and serves getUpdates from a feed"""
+
+    def __init__(self, latency=0.0, timed=False):
+        self.latency = latency
+        self.calls = {}
+        self.uploaded_bytes = 0
+        self.delivered = {} if timed else None  # update_id -> when getUpdates handed it out
+        self._lock = threading.Lock()
+        self._feed = deque()
+        self._fed = threading.Condition()
+        self._closed = False
+
+    def feed(self, updates):
+        with self._fed:
+            self._feed.extend(updates)
+            self._fed.notify_all()
+
+    def close(self):
+        """End any long poll waiting on the feed"""
+        with self._fed:
+            self._closed = True
+            self._fed.notify_all()
+
+    def post(self, url, data=None, read_timeout=None, files=None):
+        method = url.rsplit('/', 1)[-1]
+        with self._lock:
+            self.calls[method] = self.calls.get(method, 0) + 1
+            message_id = sum(self.calls.values())
+            for _, content in (files or {}).values():
+                self.uploaded_bytes += len(content)
+        if self.latency:
+            time.sleep(self.latency)
+        return {'ok': True, 'result': {'message_id': message_id}}
+
+    def get(self, url, params=None, read_timeout=None):
+        """getUpdates: up to 100 fed updates, waiting up to the long-poll timeout for the first"""
+        with self._fed:
+            self._fed.wait_for(lambda: self._feed or self._closed, (params or {}).get('timeout', 0))
+            batch = [self._feed.popleft() for _ in range(min(len(self._feed), 100))]
+        if self.delivered is not None:
+            now = time.perf_counter()
+            for update in batch:
+                self.delivered[update['update_id']] = now
+        return {'ok': True, 'result': batch}
+
+
+class BenchBot(SimpleTelegramBot):
+    """Records, when its transport is timed, how long each update took from getUpdates to its handler's end"""
+
+    def handle_update(self, update):
+        try:
+            super().handle_update(update)
+        finally:
+            delivered = self.transport.delivered
+            if delivered is not None:
+                self.latencies.append(time.perf_counter() - delivered.pop(update['update_id']))
+
+
+class StreamGenerator:
+    """Deterministic update stream following each synthetic user's state"""
+
+    def __init__(self, weights, users, seed=1):
+        self.kinds = list(weights)
+        self.weights = [weights[kind] for kind in self.kinds]
+        self.rng = random.Random(seed)
+        self.anon_id_of = SimpleConversationManager(search=False)._generate_anon_id
+        self.max_blocked = max(1, users // 20)
+        self.unregistered = list(range(FIRST_USER_ID, FIRST_USER_ID + users))
+        self.rng.shuffle(self.unregistered)
+        self.named = []      # users with a display name, not blocked
+        self.blocked = []
+        self.update_id = 0
+
+    def _update(self, user_id, **fields):
+        self.update_id += 1
+        return {
+            'update_id': self.update_id,
+            'message': {
+                'message_id': self.update_id,
+                'from': {'id': user_id, 'is_bot': False, 'first_name': f'U{user_id}', 'username': f'user{user_id}'},
+                'chat': {'id': user_id, 'type': 'private'},
+                'date': 1735689600 + self.update_id,
+                **fields
+            }
+        }
+
+    def _sentence(self, low=3, high=15):
+        return ' '.join(self.rng.choices(WORDS, k=self.rng.randint(low, high)))
+
+    def _name(self, user_id):
+        return f'Pessoa {user_id - FIRST_USER_ID}'
+
+    def _events(self, kind):
+        rng = self.rng
+        if kind == 'new_user' and self.unregistered or not self.named:
+            if not self.unregistered:
+                return []
+            user_id = self.unregistered.pop()
+            self.named.append(user_id)
+            return [self._update(user_id, text='/start'), self._update(user_id, text=self._name(user_id))]
+
+        user_id = rng.choice(self.named)
+        if kind == 'photo':
+            sizes = [{'file_id': f'photo{self.update_id}_{size}', 'file_unique_id': f'u{self.update_id}_{size}',
+                      'width': size, 'height': size, 'file_size': size * size // 10} for size in (90, 320, 800)]
+            return [self._update(user_id, photo=sizes, caption=self._sentence(1, 8))]
+        if kind == 'admin_reply':
+            # By display name most of the time, as admins type on a phone
+            identifier = self.anon_id_of(user_id) if rng.random() < 0.2 else self._name(user_id)
+            return [self._update(ADMIN_ID, text=f'{identifier}: {self._sentence()}')]
+        if kind == 'blocked':
+            if len(self.blocked) < self.max_blocked and len(self.named) > 1:
+                self.named.remove(user_id)
+                self.blocked.append(user_id)
+                return [self._update(ADMIN_ID, text=f'/block {self.anon_id_of(user_id)}'),
+                        self._update(user_id, text=self._sentence())]
+            if self.blocked:
+                return [self._update(rng.choice(self.blocked), text=self._sentence())]
+        return [self._update(user_id, text=self._sentence())]
+
+    def generate(self, count):
+        updates = []
+        while len(updates) < count:
+            kind = self.rng.choices(self.kinds, self.weights)[0]
+            updates.extend(self._events(kind))
+        return updates[:count]
+
+
+def create_bot(workdir, api_latency, send_workers, timed=False):
+    transport = StubTransport(api_latency, timed)
+    # Rate limits lifted: the benchmark measures the bot, not Telegram's flood control
+    scheduler = OutboundScheduler(global_rate=1e9, chat_rate=1e9, chat_burst=1e9, max_workers=send_workers)
+    message_config = MessageConfig(os.path.join(workdir, 'bot_messages.json'), save_delay=0, reload_interval=0)
+    bot = BenchBot('bench', ADMIN_ID, SimpleConversationManager(), transport, scheduler,
+                   message_config=message_config)
+    bot.latencies = []
+    consumer = threading.Thread(target=bot.engine.run, args=('polling',), name='bench-updates', daemon=True)
+    consumer.start()
+    return bot, transport, scheduler, consumer
+
+
+def stop_bot(bot, transport, consumer):
+    bot.engine.stop()
+    transport.close()
+    consumer.join(10)
+
+
+def replay(bot, transport, updates):
+    """Feed updates to the bot's poll loop and wait until the engine has handled all of them"""
+    engine = bot.engine
+    target = engine.handled + len(updates)
+    transport.feed(updates)
+    while engine.handled < target:
+        time.sleep(0.001)
+
+
+def wait_for_sends(scheduler, timeout=60):
+    """Block until the scheduler has delivered everything handlers queued, including follow-ups"""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        stats = scheduler.get_stats()
+        if not stats['queued'] and not stats['in_flight']:
+            return True
+        time.sleep(0.005)
+    return False
+
+
+def timed_pass(updates, workdir, args):
+    bot, transport, scheduler, consumer = create_bot(workdir, args.api_latency, args.send_workers, timed=True)
+    clock = time.perf_counter
+    started = clock()
+    replay(bot, transport, updates)
+    handled = clock() - started
+    drained = wait_for_sends(scheduler)
+    drain = clock() - started - handled
+    stop_bot(bot, transport, consumer)
+
+    latencies = bot.latencies
+    quantiles = statistics.quantiles(latencies, n=100)
+    manager = bot.conversation_manager
+    return {
+        'updates_per_sec': round(len(updates) / handled, 1),
+        'mean_ms': round(statistics.fmean(latencies) * 1000, 4),
+        'p50_ms': round(quantiles[49] * 1000, 4),
+        'p99_ms': round(quantiles[98] * 1000, 4),
+        'max_ms': round(max(latencies) * 1000, 4),
+        'send_drain_sec': round(drain, 3),
+        'sends_drained': drained,
+        'api_calls': dict(sorted(transport.calls.items())),
+        'uploaded_bytes': transport.uploaded_bytes,
+        'users': len(manager.anon_to_user),
+        'blocked_users': len(manager.blocked_users),
+        'messages_stored': manager.total_messages,
+    }
+
+
+def allocation_pass(updates, workdir, args):
+    """Memory blocks and bytes each update leaves allocated, measured under tracemalloc"""
+    bot, transport, scheduler, consumer = create_bot(workdir, args.api_latency, args.send_workers)
+    warmup = min(len(updates) // 10, 1000)
+    replay(bot, transport, updates[:warmup])
+    wait_for_sends(scheduler)
+    measured = updates[warmup:]
+
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    replay(bot, transport, measured)
+    wait_for_sends(scheduler)
+    gc.collect()
+    after = tracemalloc.take_snapshot()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    stop_bot(bot, transport, consumer)
+
+    diff = after.compare_to(before, 'filename')
+    blocks = sum(stat.count_diff for stat in diff)
+    size = sum(stat.size_diff for stat in diff)
+    return {
+        'retained_blocks_per_update': round(blocks / len(measured), 2),
+        'retained_bytes_per_update': round(size / len(measured), 1),
+        'traced_peak_mib': round(peak / 1024 / 1024, 1),
+    }
+
+
+def peak_rss_mib():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports KiB, macOS bytes
+    return round(peak / 1024 / (1024 if sys.platform == 'darwin' else 1), 1)
+
+
+def git_revision():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True,
+                                text=True, check=True).stdout.strip()
+        dirty = bool(subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], cwd=ROOT,
+                                    capture_output=True, text=True, check=True).stdout.strip())
+    except (OSError, subprocess.CalledProcessError):
+        return None, None
+    return commit, dirty
+
+
+def compare(results, baseline_path, max_regression):
+    """Print each metric against the baseline file; False if throughput regressed too far"""
+    with open(baseline_path, encoding='utf-8') as f:
+        baseline = json.load(f)
+    print(f"\nagainst {baseline_path} (commit {baseline.get('commit')}):")
+    ok = True
+    for scenario, metrics in results['scenarios'].items():
+        old = baseline.get('scenarios', {}).get(scenario)
+        if old is None:
+            print(f"  {scenario}: not in baseline")
+            continue
+        changes = []
+        for metric, higher_is_better in COMPARED_METRICS.items():
+            if not old.get(metric) or metric not in metrics:
+                continue
+            change = 100 * (metrics[metric] - old[metric]) / old[metric]
+            changes.append(f"{metric} {change:+.1f}%")
+            if metric == 'updates_per_sec' and max_regression is not None and -change > max_regression:
+                ok = False
+        print(f"  {scenario:11} " + '  '.join(changes))
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS), help='comma-separated, from: ' + ', '.join(SCENARIOS))
+    parser.add_argument('--updates', type=int, default=50000)
+    parser.add_argument('--users', type=int, default=2000)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--api-latency', type=float, default=0.0, help='seconds each stubbed Bot API call takes')
+    parser.add_argument('--send-workers', type=int, default=8)
+    parser.add_argument('--output', help='JSON results file (default: benchmarks/results/updates-<commit>.json)')
+    parser.add_argument('--compare', metavar='BASELINE', help='earlier JSON results to compare against')
+    parser.add_argument('--max-regression', type=float, help='fail if updates/sec dropped by more than this percent')
+    args = parser.parse_args()
+
+    scenarios = [name.strip() for name in args.scenarios.split(',') if name.strip()]
+    unknown = [name for name in scenarios if name not in SCENARIOS]
+    if unknown:
+        parser.error(f"unknown scenario(s): {', '.join(unknown)}")
+
+    logging.disable(logging.WARNING)
+    commit, dirty = git_revision()
+    results = {
+        'benchmark': 'updates',
+        'commit': commit,
+        'dirty': dirty,
+        'timestamp': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'parameters': {key: value for key, value in vars(args).items()
+                       if key not in ('output', 'compare', 'max_regression')},
+        'scenarios': {},
+    }
+
+    workdir = tempfile.mkdtemp(prefix='bench_updates_')
+    try:
+        for name in scenarios:
+            updates = StreamGenerator(SCENARIOS[name], args.users, args.seed).generate(args.updates)
+            metrics = timed_pass(updates, workdir, args)
+            metrics.update(allocation_pass(updates, workdir, args))
+            metrics['peak_rss_mib'] = peak_rss_mib()
+            results['scenarios'][name] = metrics
+            print(f"{name:11} {metrics['updates_per_sec']:9.0f} updates/s   p50 {metrics['p50_ms']:7.3f} ms   "
+                  f"p99 {metrics['p99_ms']:7.3f} ms   {metrics['retained_blocks_per_update']:6.1f} blocks/update   "
+                  f"{metrics['retained_bytes_per_update']:8.0f} B/update   peak RSS {metrics['peak_rss_mib']:.0f} MiB")
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    output = args.output or os.path.join(ROOT, 'benchmarks', 'results', f"updates-{commit or 'unknown'}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(results, f, indent=2)
+    print(f"results written to {output}")
+
+    if args.compare and not compare(results, args.compare, args.max_regression):
+        print(f"updates/sec regressed by more than {args.max_regression}%")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
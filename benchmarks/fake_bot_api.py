@@ -0,0 +1,462 @@
+#!/usr/bin/env python3
+"""
+Fake Telegram Bot API
+Local stand-in for api.telegram.org to load-test the whole bot offline
+
+Usage: python benchmarks/fake_bot_api.py [--port 8081] [--stream mixed --updates 20000 --rate 500]
+       [--script updates.jsonl] [--latency 0.05] [--jitter 0.02] [--rate-limit-ratio 0.01]
+       [--retry-after 1] [--error-ratio 0.01] [--output e2e.json] [--exit-when-done]
+
+Then run the bot against it, e.g. with the default stream's admin:
+    TELEGRAM_API_URL=http://127.0.0.1:8081 TELEGRAM_BOT_TOKEN=fake ADMIN_CHAT_ID=1000 \\
+    SEND_GLOBAL_RATE=100000 SEND_CHAT_RATE=1000 SEND_CHAT_BURST=1000 python simple_bot.py
+(leave the SEND_* settings at their defaults to measure within Telegram's flood limits).
+
+Implements getUpdates with long-poll semantics, sendMessage, sendPhoto,
+sendDocument (multipart uploads, of which only the size is kept) and
+sendChatAction, plus getMe, setWebhook and deleteWebhook. Every call can be
+delayed, and send calls can be answered with a 429 carrying retry_after or
+with a 5xx, at the given ratios. Updates come from a scripted stream: a JSON
+lines file, the synthetic streams of bench_updates.py, or POST /_updates.
+
+End-to-end latency is measured from the moment the bot receives an update in
+getUpdates to the bot's first message to that chat afterwards. Updates from
+the admin chat are not timed, since the admin is also sent a notification for
+every user message; replies the admin sends to users still count as answers,
+so admin-heavy streams read slightly low. GET /_stats returns the numbers
+while the server runs.
+"""
+
+import argparse
+import json
+import logging
+import random
+import statistics
+import threading
+import time
+from collections import deque
+from email.parser import BytesParser
+from email.policy import HTTP
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlsplit
+
+logger = logging.getLogger(__name__)
+
+SEND_METHODS = ('sendMessage', 'sendPhoto', 'sendDocument', 'sendChatAction')
+FAKE_BOT_USER = {'id': 1, 'is_bot': True, 'first_name': 'Fake Bot', 'username': 'fake_bot'}
+
+
+def parse_multipart(content_type, body):
+    """Fields of a multipart/form-data body; an uploaded file becomes {'file_name', 'file_size'}"""
+    message = BytesParser(policy=HTTP).parsebytes(
+        b'Content-Type: ' + content_type.encode('latin-1') + b'\r\n\r\n' + body)
+    if not message.is_multipart():
+        raise ValueError('malformed multipart body')
+    params = {}
+    for part in message.iter_parts():
+        name = part.get_param('name', header='content-disposition')
+        payload = part.get_payload(decode=True) or b''
+        if part.get_filename() is not None:
+            params[name] = {'file_name': part.get_filename(), 'file_size': len(payload)}
+        else:
+            params[name] = payload.decode('utf-8')
+    return params
+
+
+class FaultPlan:
+    """Per-call delay and injected failures for the fake server"""
+
+    def __init__(self, latency=0.0, jitter=0.0, rate_limit_ratio=0.0, retry_after=1, error_ratio=0.0,
+                 error_status=502, seed=None):
+        self.latency = latency
+        self.jitter = jitter
+        self.rate_limit_ratio = rate_limit_ratio
+        self.retry_after = retry_after
+        self.error_ratio = error_ratio
+        self.error_status = error_status
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def delay(self):
+        if not self.jitter:
+            return self.latency
+        with self._lock:
+            return max(0.0, self.latency + self._rng.uniform(-self.jitter, self.jitter))
+
+    def fault(self):
+        """(HTTP status, body) to answer a send call with instead of success, or None"""
+        with self._lock:
+            roll = self._rng.random()
+        if roll < self.rate_limit_ratio:
+            return 429, {
+                'ok': False,
+                'error_code': 429,
+                'description': f'Too Many Requests: retry after {self.retry_after}',
+                'parameters': {'retry_after': self.retry_after}
+            }
+        if roll < self.rate_limit_ratio + self.error_ratio:
+            return self.error_status, {'ok': False, 'error_code': self.error_status, 'description': 'Bad Gateway'}
+        return None
+
+
+class FakeBotAPI:
+    """Threaded HTTP server speaking enough of the Bot API for the bot's polling loop"""
+
+    def __init__(self, host='127.0.0.1', port=8081, faults=None, admin_chat_id=None):
+        self.faults = faults or FaultPlan()
+        self.admin_chat_id = admin_chat_id
+        self.webhook_url = ''
+        self._cond = threading.Condition()
+        self._queue = deque()        # updates not yet confirmed by a getUpdates offset
+        self._next_update_id = 1
+        self._delivered_at = {}      # update_id -> first time getUpdates returned it
+        self._unanswered = {}        # chat_id -> deque of delivery times awaiting the bot's answer
+        self._latencies = []
+        self._calls = {}
+        self._injected = {'rate_limited': 0, 'errors': 0}
+        self._message_id = 0
+        self.uploaded_bytes = 0
+        self.pushed = 0
+        self.answered = 0
+        self.first_delivery = None
+        self.last_answer = None
+        self.last_send = None
+        self.feeding = False
+        self._stopped = False
+        self._server = ThreadingHTTPServer((host, port), self._handler_class())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, name='fake-bot-api', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        with self._cond:
+            self._stopped = True
+            self._cond.notify_all()
+        self._server.shutdown()
+        self._server.server_close()
+
+    # Scripted updates
+
+    def push(self, update):
+        """Queue an update for getUpdates, numbering it if it has no update_id"""
+        with self._cond:
+            if 'update_id' in update:
+                self._next_update_id = max(self._next_update_id, update['update_id'] + 1)
+            else:
+                update = {'update_id': self._next_update_id, **update}
+                self._next_update_id += 1
+            self._queue.append(update)
+            self.pushed += 1
+            self._cond.notify_all()
+
+    def feed(self, updates, rate=0.0):
+        """Push updates from a background thread, rate per second (0: all at once)"""
+        self.feeding = True
+
+        def run():
+            started = time.monotonic()
+            try:
+                for count, update in enumerate(updates):
+                    if rate:
+                        wait = started + count / rate - time.monotonic()
+                        if wait > 0:
+                            time.sleep(wait)
+                    self.push(update)
+            finally:
+                self.feeding = False
+
+        threading.Thread(target=run, name='fake-bot-api-feed', daemon=True).start()
+
+    # Bot API methods
+
+    def get_updates(self, offset=0, limit=100, timeout=0):
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            if self.webhook_url:
+                return 409, {'ok': False, 'error_code': 409,
+                             'description': "Conflict: can't use getUpdates method while webhook is active"}
+            while True:
+                # An offset confirms every update before it
+                while self._queue and self._queue[0]['update_id'] < offset:
+                    self._queue.popleft()
+                remaining = deadline - time.monotonic()
+                if self._queue or remaining <= 0 or self._stopped:
+                    break
+                self._cond.wait(remaining)
+
+            batch = [self._queue[i] for i in range(min(limit, len(self._queue)))]
+            now = time.monotonic()
+            for update in batch:
+                if update['update_id'] in self._delivered_at:
+                    continue  # redelivered after a lost response; timed from the first delivery
+                self._delivered_at[update['update_id']] = now
+                if self.first_delivery is None:
+                    self.first_delivery = now
+                chat_id = self._chat_id(update)
+                if chat_id is not None and chat_id != self.admin_chat_id:
+                    self._unanswered.setdefault(chat_id, deque()).append(now)
+        return 200, {'ok': True, 'result': batch}
+
+    def send(self, method, params):
+        now = time.monotonic()
+        try:
+            chat_id = int(params.get('chat_id'))
+        except (TypeError, ValueError):
+            return 400, {'ok': False, 'error_code': 400, 'description': 'Bad Request: chat_id is empty'}
+        if method == 'sendDocument' and not isinstance(params.get('document'), dict):
+            # Only uploads; the bot never resends a document by file_id
+            return 400, {'ok': False, 'error_code': 400,
+                         'description': 'Bad Request: there is no document in the request'}
+
+        fault = self.faults.fault()
+        with self._cond:
+            if fault is not None:
+                self._injected['rate_limited' if fault[0] == 429 else 'errors'] += 1
+                return fault
+            self.last_send = now
+            self._message_id += 1
+            message_id = self._message_id
+            if method == 'sendChatAction':
+                return 200, {'ok': True, 'result': True}
+            waiting = self._unanswered.get(chat_id)
+            if waiting:
+                self._latencies.append(now - waiting.popleft())
+                self.answered += 1
+                self.last_answer = now
+                if not waiting:
+                    del self._unanswered[chat_id]
+
+        result = {'message_id': message_id, 'from': FAKE_BOT_USER, 'chat': {'id': chat_id, 'type': 'private'},
+                  'date': int(time.time())}
+        if method == 'sendPhoto':
+            result['photo'] = [{'file_id': params.get('photo'), 'file_unique_id': params.get('photo')}]
+            if params.get('caption'):
+                result['caption'] = params['caption']
+        elif method == 'sendDocument':
+            document = params['document']
+            with self._cond:
+                self.uploaded_bytes += document['file_size']
+            result['document'] = {'file_id': f'document{message_id}', 'file_unique_id': f'document{message_id}',
+                                  **document}
+            if params.get('caption'):
+                result['caption'] = params['caption']
+        else:
+            result['text'] = params.get('text', '')
+        return 200, {'ok': True, 'result': result}
+
+    def call(self, method, params):
+        """Answer one Bot API call as (HTTP status, JSON body)"""
+        with self._cond:
+            self._calls[method] = self._calls.get(method, 0) + 1
+        if method == 'getUpdates':
+            return self.get_updates(
+                offset=int(params.get('offset', 0)),
+                limit=min(max(int(params.get('limit', 100)), 1), 100),
+                timeout=float(params.get('timeout', 0))
+            )
+        delay = self.faults.delay()
+        if delay:
+            time.sleep(delay)
+        if method in SEND_METHODS:
+            return self.send(method, params)
+        if method == 'getMe':
+            return 200, {'ok': True, 'result': FAKE_BOT_USER}
+        if method in ('setWebhook', 'deleteWebhook'):
+            with self._cond:
+                self.webhook_url = params.get('url', '') if method == 'setWebhook' else ''
+                self._cond.notify_all()
+            return 200, {'ok': True, 'result': True}
+        return 404, {'ok': False, 'error_code': 404, 'description': 'Not Found'}
+
+    @staticmethod
+    def _chat_id(update):
+        for value in update.values():
+            if isinstance(value, dict) and 'chat' in value:
+                return value['chat'].get('id')
+        return None
+
+    def is_done(self, idle):
+        """All scripted updates were fetched and the bot has sent nothing for idle seconds"""
+        with self._cond:
+            if self.feeding or len(self._delivered_at) < self.pushed:
+                return False
+            last = self.last_send or self.first_delivery
+        return last is not None and time.monotonic() - last >= idle
+
+    def get_stats(self):
+        with self._cond:
+            latencies = sorted(self._latencies)
+            unanswered = sum(len(waiting) for waiting in self._unanswered.values())
+            stats = {
+                'updates_pushed': self.pushed,
+                'updates_delivered': len(self._delivered_at),
+                'updates_answered': self.answered,
+                'updates_unanswered': unanswered,
+                'calls': dict(sorted(self._calls.items())),
+                'injected': dict(self._injected),
+                'uploaded_bytes': self.uploaded_bytes,
+            }
+            span = (self.last_answer - self.first_delivery) if self.answered else 0.0
+        if span > 0:
+            stats['answers_per_sec'] = round(self.answered / span, 1)
+        if len(latencies) >= 2:
+            quantiles = statistics.quantiles(latencies, n=100)
+            stats['latency_ms'] = {
+                'mean': round(statistics.fmean(latencies) * 1000, 2),
+                'p50': round(quantiles[49] * 1000, 2),
+                'p90': round(quantiles[89] * 1000, 2),
+                'p99': round(quantiles[98] * 1000, 2),
+                'max': round(latencies[-1] * 1000, 2),
+            }
+        return stats
+
+    def _handler_class(self):
+        api = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'  # keep-alive, like api.telegram.org
+            # Headers and body go out in separate writes; with Nagle on, the
+            # body waits for the client's delayed ACK (~40 ms per call)
+            disable_nagle_algorithm = True
+
+            def do_GET(self):
+                self._dispatch()
+
+            def do_POST(self):
+                self._dispatch()
+
+            def _params(self, query):
+                params = dict(parse_qsl(query))
+                length = int(self.headers.get('Content-Length') or 0)
+                if length:
+                    body = self.rfile.read(length)
+                    content_type = self.headers.get('Content-Type', '')
+                    if content_type.startswith('multipart/form-data'):
+                        params.update(parse_multipart(content_type, body))
+                    elif content_type.startswith('application/json'):
+                        data = json.loads(body)
+                        if isinstance(data, list):
+                            return data
+                        params.update(data)
+                    else:
+                        params.update(parse_qsl(body.decode('utf-8')))
+                return params
+
+            def _dispatch(self):
+                parts = urlsplit(self.path)
+                try:
+                    params = self._params(parts.query)
+                except (ValueError, UnicodeDecodeError):
+                    self._reply(400, {'ok': False, 'error_code': 400, 'description': 'Bad Request'})
+                    return
+
+                segments = parts.path.strip('/').split('/')
+                if segments == ['_stats']:
+                    self._reply(200, api.get_stats())
+                elif segments == ['_updates'] and self.command == 'POST':
+                    updates = params if isinstance(params, list) else params.get('updates', [params])
+                    for update in updates:
+                        api.push(update)
+                    self._reply(200, {'ok': True, 'result': len(updates)})
+                elif len(segments) == 2 and segments[0].startswith('bot'):
+                    try:
+                        status, body = api.call(segments[1], params)
+                    except (TypeError, ValueError) as e:
+                        status, body = 400, {'ok': False, 'error_code': 400, 'description': f'Bad Request: {e}'}
+                    self._reply(status, body)
+                else:
+                    self._reply(404, {'ok': False, 'error_code': 404, 'description': 'Not Found'})
+
+            def _reply(self, status, body):
+                data = json.dumps(body).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, format, *args):
+                logger.debug(format % args)
+
+        return Handler
+
+
+def load_script(path):
+    """Updates from a JSON lines file, one Telegram update per line"""
+    with open(path, encoding='utf-8') as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def synthetic_stream(scenario, updates, users, seed):
+    # Shares the replay benchmark's streams, so both measure the same traffic
+    from bench_updates import SCENARIOS, StreamGenerator
+    return StreamGenerator(SCENARIOS[scenario], users, seed).generate(updates)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8081)
+    parser.add_argument('--admin-chat-id', type=int, default=1000, help="the bot's ADMIN_CHAT_ID")
+    parser.add_argument('--script', help='JSON lines file of updates to serve')
+    parser.add_argument('--stream', help='synthetic stream from bench_updates.py: mixed, onboarding, chatty, admin')
+    parser.add_argument('--updates', type=int, default=20000, help='length of the synthetic stream')
+    parser.add_argument('--users', type=int, default=2000)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--rate', type=float, default=0.0, help='updates per second to release (0: all at once)')
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds every call takes')
+    parser.add_argument('--jitter', type=float, default=0.0, help='uniform +/- seconds added to --latency')
+    parser.add_argument('--rate-limit-ratio', type=float, default=0.0, help='share of sends answered with 429')
+    parser.add_argument('--retry-after', type=int, default=1, help='retry_after of injected 429s')
+    parser.add_argument('--error-ratio', type=float, default=0.0, help='share of sends answered with a 5xx')
+    parser.add_argument('--error-status', type=int, default=502)
+    parser.add_argument('--output', help='write the final stats as JSON here')
+    parser.add_argument('--exit-when-done', action='store_true',
+                        help='stop once the stream was fetched and the bot went quiet for --idle seconds')
+    parser.add_argument('--idle', type=float, default=3.0)
+    args = parser.parse_args()
+
+    logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s', level=logging.INFO)
+    faults = FaultPlan(args.latency, args.jitter, args.rate_limit_ratio, args.retry_after, args.error_ratio,
+                       args.error_status, seed=args.seed)
+    api = FakeBotAPI(args.host, args.port, faults, args.admin_chat_id).start()
+    logger.info(f"Fake Bot API listening on {api.url}")
+
+    updates = []
+    if args.script:
+        updates.extend(load_script(args.script))
+    if args.stream:
+        updates.extend(synthetic_stream(args.stream, args.updates, args.users, args.seed))
+    if updates:
+        api.feed(updates, args.rate)
+        logger.info(f"Serving {len(updates)} scripted updates" + (f" at {args.rate:g}/s" if args.rate else ""))
+
+    try:
+        while not (args.exit_when_done and api.is_done(args.idle)):
+            time.sleep(1)
+            stats = api.get_stats()
+            logger.info(f"delivered {stats['updates_delivered']}/{stats['updates_pushed']}, "
+                        f"answered {stats['updates_answered']}, p99 {stats.get('latency_ms', {}).get('p99', '-')} ms")
+    except KeyboardInterrupt:
+        pass
+    finally:
+        stats = api.get_stats()
+        api.stop()
+
+    print(json.dumps(stats, indent=2))
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump({'parameters': vars(args), **stats}, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -2,7 +2,24 @@
 Configuration settings for the Anonymous Telegram Bot
 """
 
+import json
 import os
+import re
+
+BOT_ID_PATTERN = re.compile(r'^[A-Za-z0-9_-]{1,32}$')
+
+def namespaced_path(path, namespace):
+    """Per-bot variant of a data path: bot_data.db -> bot_data_<id>.db, dir -> dir/<id>
+
+    The default bot (namespace None) keeps the original path, so single-bot
+    installs find their existing data.
+    """
+    if not namespace:
+        return path
+    root, ext = os.path.splitext(path)
+    if ext:
+        return f"{root}_{namespace}{ext}"
+    return os.path.join(path, namespace)
 
 class Config:
     """Base configuration class"""
@@ -10,6 +27,9 @@ class Config:
     # Bot settings
     TELEGRAM_BOT_TOKEN = os.getenv('TELEGRAM_BOT_TOKEN')
     ADMIN_CHAT_ID = os.getenv('ADMIN_CHAT_ID')
+    # Several bots in one process: a JSON list of {"id", "token", "admin_chat_id"}.
+    # When unset the process hosts one bot, "default", from the two settings above.
+    BOTS_FILE = os.getenv('BOTS_FILE')
     
     # Flask settings
     SECRET_KEY = os.getenv('SECRET_KEY', 'anonymous_bot_secret_key_2025')
@@ -35,7 +55,67 @@ class Config:
     # Auto-cleanup settings (in seconds)
     CONVERSATION_TIMEOUT = 7 * 24 * 3600  # 7 days
     CLEANUP_INTERVAL = 3600  # 1 hour
-    
+    EVICTION_POLICY = os.getenv('EVICTION_POLICY', 'spill').lower()  # 'spill' to disk or 'evict' (drop)
+    SPILL_DIR = os.getenv('SPILL_DIR', 'spill_data')
+
+    # Admin dashboard
+    DASHBOARD_PAGE_SIZE = int(os.getenv('DASHBOARD_PAGE_SIZE', '50'))  # conversations per page
+    HISTORY_PAGE_SIZE = int(os.getenv('HISTORY_PAGE_SIZE', '50'))  # messages per history page
+
+    # Editable bot texts (bot_messages.json)
+    MESSAGES_SAVE_DELAY = float(os.getenv('MESSAGES_SAVE_DELAY', '0.5'))  # seconds to batch edits before writing
+    MESSAGES_RELOAD_INTERVAL = float(os.getenv('MESSAGES_RELOAD_INTERVAL', '2'))  # seconds between mtime checks
+
+    # Bot API HTTP transport settings
+    # Point at a local stand-in (benchmarks/fake_bot_api.py) for offline load tests
+    TELEGRAM_API_URL = os.getenv('TELEGRAM_API_URL', 'https://api.telegram.org').rstrip('/')
+    HTTP_POOL_SIZE = int(os.getenv('HTTP_POOL_SIZE', '16'))
+    HTTP_CONNECT_TIMEOUT = float(os.getenv('HTTP_CONNECT_TIMEOUT', '5'))
+    HTTP_READ_TIMEOUT = float(os.getenv('HTTP_READ_TIMEOUT', '15'))
+    HTTP_MAX_RETRIES = int(os.getenv('HTTP_MAX_RETRIES', '3'))
+    HTTP_BACKOFF_FACTOR = float(os.getenv('HTTP_BACKOFF_FACTOR', '0.5'))
+    POLL_TIMEOUT = 30  # getUpdates long-poll timeout
+
+    # Update dispatch settings
+    MAX_CONCURRENT_UPDATES = int(os.getenv('MAX_CONCURRENT_UPDATES', '32'))
+    MAX_PENDING_PER_CHAT = int(os.getenv('MAX_PENDING_PER_CHAT', '100'))
+
+    # Update ingestion: 'polling' (getUpdates) or 'webhook'
+    UPDATE_MODE = os.getenv('UPDATE_MODE', 'polling').lower()
+    WEBHOOK_URL = os.getenv('WEBHOOK_URL')  # public base URL, e.g. https://bot.example.com
+    WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET')  # derived from the bot token when unset
+
+    # Outbound flood control (Telegram allows ~30 msg/s overall, ~1 msg/s per chat)
+    SEND_GLOBAL_RATE = float(os.getenv('SEND_GLOBAL_RATE', '30'))
+    SEND_CHAT_RATE = float(os.getenv('SEND_CHAT_RATE', '1'))
+    SEND_CHAT_BURST = int(os.getenv('SEND_CHAT_BURST', '3'))
+    SEND_WORKERS = int(os.getenv('SEND_WORKERS', '8'))
+    SEND_MAX_RETRIES = int(os.getenv('SEND_MAX_RETRIES', '3'))  # reschedules after a 429
+
+    # Process model: 'single' (one process does everything) or 'multi' (several
+    # processes share the SQLite database; the leader-lease holder consumes updates)
+    PROCESS_MODE = os.getenv('PROCESS_MODE', 'single').lower()
+    LEADER_LEASE_TTL = float(os.getenv('LEADER_LEASE_TTL', '15'))  # seconds before a dead leader is replaced
+    STATE_REFRESH_INTERVAL = float(os.getenv('STATE_REFRESH_INTERVAL', '1'))  # seconds between data_version checks
+
+    # Conversation storage: 'memory' (lost on restart), 'sqlite' or 'journal'
+    STORAGE_BACKEND = os.getenv('STORAGE_BACKEND', 'memory').lower()
+    SQLITE_PATH = os.getenv('SQLITE_PATH', 'bot_data.db')
+    STORAGE_FLUSH_INTERVAL = float(os.getenv('STORAGE_FLUSH_INTERVAL', '0.5'))  # seconds between batched commits
+    STORAGE_BATCH_SIZE = int(os.getenv('STORAGE_BATCH_SIZE', '500'))
+    JOURNAL_DIR = os.getenv('JOURNAL_DIR', 'journal_data')
+    JOURNAL_COMMIT_INTERVAL = float(os.getenv('JOURNAL_COMMIT_INTERVAL', '0.05'))  # group-commit window
+    SNAPSHOT_INTERVAL = int(os.getenv('SNAPSHOT_INTERVAL', '300'))  # seconds between compactions
+    SNAPSHOT_RECORDS = int(os.getenv('SNAPSHOT_RECORDS', '50000'))  # or sooner after this many records
+
+    # On-demand profiling (admin /profile command, /api/profile) and the slow-update log
+    PROFILE_DIR = os.getenv('PROFILE_DIR', 'profiles')
+    PROFILE_MAX_SECONDS = int(os.getenv('PROFILE_MAX_SECONDS', '300'))
+    PROFILE_SAMPLE_INTERVAL = float(os.getenv('PROFILE_SAMPLE_INTERVAL', '0.005'))  # seconds between stack samples
+    PROFILE_MEMORY_FRAMES = int(os.getenv('PROFILE_MEMORY_FRAMES', '1'))  # traceback depth kept by tracemalloc
+    PROFILE_TOKEN = os.getenv('PROFILE_TOKEN')  # required by the web endpoints; unset disables them
+    SLOW_UPDATE_THRESHOLD = float(os.getenv('SLOW_UPDATE_THRESHOLD', '1'))  # seconds; 0 turns the log off
+
     @classmethod
     def validate(cls):
         """Validate required configuration"""
@@ -52,6 +132,38 @@ class Config:
         
         return True
 
+    @classmethod
+    def get_bots(cls):
+        """The bots to host, as dicts with id, token and admin_chat_id
+
+        Entries from BOTS_FILE are validated here; the single default bot is
+        checked by validate() before it starts.
+        """
+        if not cls.BOTS_FILE:
+            return [{'id': 'default', 'token': cls.TELEGRAM_BOT_TOKEN, 'admin_chat_id': cls.ADMIN_CHAT_ID}]
+
+        with open(cls.BOTS_FILE, 'r', encoding='utf-8') as f:
+            entries = json.load(f)
+        if not isinstance(entries, list) or not entries:
+            raise ValueError(f"{cls.BOTS_FILE} must contain a non-empty list of bots")
+
+        bots, seen = [], set()
+        for entry in entries:
+            bot_id = str(entry.get('id', ''))
+            if not BOT_ID_PATTERN.match(bot_id):
+                raise ValueError(f"Invalid bot id '{bot_id}': use up to 32 letters, digits, '-' or '_'")
+            if bot_id in seen:
+                raise ValueError(f"Duplicate bot id '{bot_id}'")
+            if not entry.get('token'):
+                raise ValueError(f"Bot '{bot_id}' has no token")
+            try:
+                admin_chat_id = int(entry.get('admin_chat_id'))
+            except (TypeError, ValueError):
+                raise ValueError(f"Bot '{bot_id}' needs an integer admin_chat_id")
+            seen.add(bot_id)
+            bots.append({'id': bot_id, 'token': entry['token'], 'admin_chat_id': admin_chat_id})
+        return bots
+
 class DevelopmentConfig(Config):
     """Development configuration"""
     DEBUG = True
@@ -0,0 +1,247 @@
+"""
+Conversation Indexes
+Secondary lookup structures maintained by SimpleConversationManager
+"""
+
+import bisect
+import threading
+import unicodedata
+
+
+def normalize_name(name):
+    """Case- and width-insensitive form used to match display names"""
+    return ' '.join(unicodedata.normalize('NFKC', name).casefold().split())
+
+
+class DisplayNameIndex:
+    """Reverse index from normalized display name to anon_ids"""
+
+    def __init__(self):
+        self._by_name = {}   # normalized name -> set of anon_ids
+        self._by_anon = {}   # anon_id -> normalized name
+        self._sorted = []    # normalized names, sorted, for prefix lookups
+        self._lock = threading.RLock()
+
+    def set(self, anon_id, display_name):
+        key = normalize_name(display_name) if display_name else None
+        with self._lock:
+            if self._by_anon.get(anon_id) == key:
+                return
+            self.remove(anon_id)
+            if not key:
+                return
+
+            anon_ids = self._by_name.get(key)
+            if anon_ids is None:
+                anon_ids = self._by_name[key] = set()
+                bisect.insort(self._sorted, key)
+            anon_ids.add(anon_id)
+            self._by_anon[anon_id] = key
+
+    def remove(self, anon_id):
+        with self._lock:
+            key = self._by_anon.pop(anon_id, None)
+            if key is None:
+                return
+            anon_ids = self._by_name[key]
+            anon_ids.discard(anon_id)
+            if not anon_ids:
+                del self._by_name[key]
+                del self._sorted[bisect.bisect_left(self._sorted, key)]
+
+    def lookup(self, name):
+        """anon_ids whose display name matches exactly (after normalization)"""
+        key = normalize_name(name)
+        with self._lock:
+            return sorted(self._by_name.get(key, ()))
+
+    def prefix_lookup(self, prefix, limit=10):
+        """anon_ids whose display name starts with prefix, at most limit of them"""
+        prefix = normalize_name(prefix)
+        if not prefix:
+            return []
+        results = []
+        with self._lock:
+            position = bisect.bisect_left(self._sorted, prefix)
+            while position < len(self._sorted) and self._sorted[position].startswith(prefix):
+                results.extend(sorted(self._by_name[self._sorted[position]]))
+                if len(results) >= limit:
+                    return results[:limit]
+                position += 1
+        return results
+
+    def clear(self):
+        with self._lock:
+            self._by_name.clear()
+            self._by_anon.clear()
+            self._sorted.clear()
+
+
+class ActivityRing:
+    """Count of conversations active within a sliding window, in O(1) per call
+
+    Time is cut into fixed buckets kept in a ring. Each conversation is counted
+    once, in the bucket of its latest activity; buckets that slide out of the
+    window are subtracted from a running total as the ring advances.
+    """
+
+    def __init__(self, window=86400, bucket_seconds=60):
+        self.bucket_seconds = bucket_seconds
+        self.size = max(1, window // bucket_seconds)
+        self._counts = [0] * self.size
+        self._total = 0
+        self._head = None  # newest absolute bucket number
+        self._bucket_of = {}  # anon_id -> absolute bucket of its latest activity
+        self._lock = threading.Lock()
+
+    def _advance(self, bucket):
+        if self._head is None:
+            self._head = bucket
+            return
+        if bucket <= self._head:
+            return
+        for step in range(1, min(bucket - self._head, self.size) + 1):
+            index = (self._head + step) % self.size
+            self._total -= self._counts[index]
+            self._counts[index] = 0
+        self._head = bucket
+
+    def _in_window(self, bucket):
+        return self._head - self.size < bucket <= self._head
+
+    def _discard(self, anon_id):
+        old = self._bucket_of.pop(anon_id, None)
+        if old is not None and self._in_window(old):
+            self._counts[old % self.size] -= 1
+            self._total -= 1
+
+    def touch(self, anon_id, epoch):
+        with self._lock:
+            bucket = int(epoch // self.bucket_seconds)
+            self._advance(bucket)
+            self._discard(anon_id)
+            self._bucket_of[anon_id] = bucket
+            if self._in_window(bucket):
+                self._counts[bucket % self.size] += 1
+                self._total += 1
+
+    def remove(self, anon_id):
+        with self._lock:
+            if self._head is not None:
+                self._discard(anon_id)
+
+    def count(self, now):
+        with self._lock:
+            self._advance(int(now // self.bucket_seconds))
+            return self._total
+
+
+class ActivityIndex:
+    """Conversations ordered by latest activity, newest first
+
+    Keys are kept in a list of sorted chunks (a small B-tree with one level),
+    so moving a conversation to the front costs O(log n) searches plus a
+    chunk-sized shift instead of re-sorting everything. Pages are read by
+    keyset: a cursor names the last conversation of the previous page.
+    """
+
+    CHUNK_SIZE = 512
+
+    def __init__(self):
+        self._chunks = []  # sorted lists of (-timestamp, anon_id)
+        self._maxes = []   # last key of each chunk
+        self._keys = {}    # anon_id -> its current key
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._keys)
+
+    def _locate(self, key):
+        """Index of the chunk that key belongs in"""
+        position = bisect.bisect_left(self._maxes, key)
+        return min(position, len(self._chunks) - 1)
+
+    def _insert(self, key):
+        if not self._chunks:
+            self._chunks.append([key])
+            self._maxes.append(key)
+            return
+        position = self._locate(key)
+        chunk = self._chunks[position]
+        bisect.insort(chunk, key)
+        self._maxes[position] = chunk[-1]
+        if len(chunk) > 2 * self.CHUNK_SIZE:
+            self._chunks[position:position + 1] = [chunk[:self.CHUNK_SIZE], chunk[self.CHUNK_SIZE:]]
+            self._maxes[position:position + 1] = [chunk[self.CHUNK_SIZE - 1], chunk[-1]]
+
+    def _delete(self, key):
+        position = self._locate(key)
+        chunk = self._chunks[position]
+        del chunk[bisect.bisect_left(chunk, key)]
+        if chunk:
+            self._maxes[position] = chunk[-1]
+        else:
+            del self._chunks[position]
+            del self._maxes[position]
+
+    def set(self, anon_id, timestamp):
+        key = (-timestamp, anon_id)
+        with self._lock:
+            old = self._keys.get(anon_id)
+            if old == key:
+                return
+            if old is not None:
+                self._delete(old)
+            self._insert(key)
+            self._keys[anon_id] = key
+
+    def remove(self, anon_id):
+        with self._lock:
+            old = self._keys.pop(anon_id, None)
+            if old is not None:
+                self._delete(old)
+
+    def page(self, cursor=None, limit=50):
+        """Up to limit anon_ids after cursor, plus the cursor for the next page"""
+        with self._lock:
+            if not self._chunks:
+                return [], None
+            if cursor is None:
+                position, offset = 0, 0
+            else:
+                position = bisect.bisect_right(self._maxes, cursor)
+                if position == len(self._chunks):
+                    return [], None
+                offset = bisect.bisect_right(self._chunks[position], cursor)
+
+            keys = []
+            while position < len(self._chunks) and len(keys) < limit:
+                chunk = self._chunks[position]
+                keys.extend(chunk[offset:offset + limit - len(keys)])
+                position, offset = position + 1, 0
+            more = position < len(self._chunks) or (keys and keys[-1] != self._maxes[-1])
+
+        next_cursor = keys[-1] if keys and more else None
+        return [anon_id for _, anon_id in keys], next_cursor
+
+    def clear(self):
+        with self._lock:
+            self._chunks.clear()
+            self._maxes.clear()
+            self._keys.clear()
+
+
+def encode_cursor(key):
+    """Opaque query-string form of an ActivityIndex key"""
+    return f"{-key[0]!r}:{key[1]}"
+
+
+def decode_cursor(cursor):
+    """Inverse of encode_cursor; None for a missing or malformed cursor"""
+    if not cursor:
+        return None
+    timestamp, _, anon_id = cursor.partition(':')
+    try:
+        return (-float(timestamp), anon_id)
+    except ValueError:
+        return None
@@ -0,0 +1,292 @@
+"""
+Conversation Journal
+Append-only mutation log with periodic binary snapshots for fast recovery
+"""
+
+import atexit
+import glob
+import json
+import logging
+import os
+import pickle
+import threading
+import time
+from datetime import datetime
+from message_record import MessageRecord
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_FILE = 'snapshot.bin'
+SEGMENT_PATTERN = 'journal-*.log'
+SNAPSHOT_VERSION = 1
+
+
+def _epoch(value):
+    return value.timestamp() if isinstance(value, datetime) else value
+
+
+def _datetime(value):
+    return datetime.fromtimestamp(value) if value is not None else None
+
+
+def _encode(data):
+    return {k: _epoch(v) for k, v in data.items()}
+
+
+def _decode_user(data):
+    user_data = dict(data)
+    user_data['registered_at'] = _datetime(data.get('registered_at'))
+    user_data['last_activity'] = _datetime(data.get('last_activity'))
+    return user_data
+
+
+class JournalStorage:
+    """Keeps conversations in memory and logs every mutation to disk
+
+    Records are JSON lines tagged with a sequence number. Replay is idempotent
+    (users upsert, blocks set, messages carry their position in the
+    conversation), so a snapshot taken while writes continue can safely
+    overlap the journal tail it is paired with.
+    """
+
+    holds_messages = False
+
+    def __init__(self, directory, commit_interval=0.05, snapshot_interval=300, snapshot_records=50000):
+        self.directory = directory
+        self.commit_interval = commit_interval
+        self.snapshot_interval = snapshot_interval
+        self.snapshot_records = snapshot_records
+        os.makedirs(directory, exist_ok=True)
+
+        self.manager = None
+        self.seq = 0
+        self._lock = threading.Lock()  # guards seq and the pending buffer
+        self._io_lock = threading.RLock()  # guards the open segment file
+        self._buffer = []
+        self._file = None
+        self._records_since_snapshot = 0
+        self._last_snapshot = time.monotonic()
+        self._snapshot_thread = None
+
+        self._wake = threading.Event()
+        self._closed = False
+        self._committer = None
+
+    def _segment_path(self, first_seq):
+        return os.path.join(self.directory, f'journal-{first_seq:012d}.log')
+
+    def _segments(self):
+        return sorted(glob.glob(os.path.join(self.directory, SEGMENT_PATTERN)))
+
+    # Recovery
+
+    def load(self, manager):
+        self.manager = manager
+        started = time.monotonic()
+        snapshot_seq = self._load_snapshot(manager)
+        self.seq = snapshot_seq
+
+        replayed = 0
+        for path in self._segments():
+            with open(path, 'r+b') as f:
+                good_offset = 0
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        # A torn final write from a crash; nothing after it was
+                        # committed. Cut it off so the segment can be appended to.
+                        logger.warning(f"Truncating torn record at byte {good_offset} of {path}")
+                        f.truncate(good_offset)
+                        break
+                    good_offset += len(line)
+                    if record['s'] <= snapshot_seq:
+                        continue
+                    self._apply(manager, record)
+                    self.seq = max(self.seq, record['s'])
+                    replayed += 1
+
+        manager._rebuild_summaries()
+        self._records_since_snapshot = replayed
+
+        self._file = open(self._segment_path(self.seq + 1), 'a', encoding='utf-8')
+        self._committer = threading.Thread(target=self._commit_loop, name='journal-commit', daemon=True)
+        self._committer.start()
+        atexit.register(self.close)
+
+        logger.info(f"Recovered {len(manager.anon_to_user)} users from snapshot #{snapshot_seq} "
+                    f"+ {replayed} journal records in {time.monotonic() - started:.2f}s")
+
+    def _load_snapshot(self, manager):
+        path = os.path.join(self.directory, SNAPSHOT_FILE)
+        if not os.path.exists(path):
+            return 0
+
+        with open(path, 'rb') as f:
+            header = pickle.load(f)
+            if header.get('version') != SNAPSHOT_VERSION:
+                raise ValueError(f"Unsupported snapshot version {header.get('version')}")
+            manager.anon_to_user = pickle.load(f)
+            manager.user_to_anon = {data['user_id']: anon_id for anon_id, data in manager.anon_to_user.items()}
+            manager.blocked_users = pickle.load(f)
+            while True:
+                entry = pickle.load(f)
+                if entry is None:
+                    break
+                anon_id, messages = entry
+                if messages and isinstance(messages[0], dict):
+                    # Written before messages were stored as records
+                    messages = [MessageRecord.from_dict(m) for m in messages]
+                manager.conversations[anon_id] = messages
+        return header['seq']
+
+    @staticmethod
+    def _apply(manager, record):
+        op = record['o']
+        anon_id = record['a']
+        if op == 'u':
+            user_data = _decode_user(record['d'])
+            manager.anon_to_user[anon_id] = user_data
+            manager.user_to_anon[user_data['user_id']] = anon_id
+        elif op == 'm':
+            conversation = manager.conversations.setdefault(anon_id, [])
+            if record['n'] == len(conversation):
+                conversation.append(MessageRecord.from_dict(record['d']))
+        elif op == 'x':
+            manager.conversations.pop(anon_id, None)
+        elif op == 'b':
+            if record['v']:
+                manager.blocked_users.add(anon_id)
+            else:
+                manager.blocked_users.discard(anon_id)
+
+    # Logging
+
+    def _append(self, record):
+        with self._lock:
+            self.seq += 1
+            record['s'] = self.seq
+            self._buffer.append(json.dumps(record, ensure_ascii=False, separators=(',', ':')) + '\n')
+            self._records_since_snapshot += 1
+
+    def save_user(self, anon_id, user_data):
+        self._append({'o': 'u', 'a': anon_id, 'd': _encode(user_data)})
+
+    def save_message(self, anon_id, message_data):
+        # Called after the manager appended the message but before it bumped
+        # its count, so the count is this message's index in the conversation
+        position = self.manager.message_counts.get(anon_id, 0)
+        self._append({'o': 'm', 'a': anon_id, 'n': position, 'd': _encode(message_data)})
+
+    def set_blocked(self, anon_id, blocked):
+        self._append({'o': 'b', 'a': anon_id, 'v': blocked})
+
+    def drop_conversation(self, anon_id):
+        self._append({'o': 'x', 'a': anon_id})
+
+    def _commit(self):
+        """Group commit: one write and one fsync for everything buffered"""
+        with self._io_lock:
+            with self._lock:
+                lines, self._buffer = self._buffer, []
+            if lines:
+                self._file.write(''.join(lines))
+                self._file.flush()
+                os.fsync(self._file.fileno())
+
+    def _commit_loop(self):
+        while not self._closed:
+            self._wake.wait(self.commit_interval)
+            self._wake.clear()
+            try:
+                self._commit()
+                if self._snapshot_due():
+                    self.snapshot()
+            except Exception as e:
+                logger.error(f"Error committing journal: {e}")
+
+    # Compaction
+
+    def _snapshot_due(self):
+        if self._snapshot_thread is not None and self._snapshot_thread.is_alive():
+            return False
+        if self._records_since_snapshot >= self.snapshot_records:
+            return True
+        return (self._records_since_snapshot > 0
+                and time.monotonic() - self._last_snapshot >= self.snapshot_interval)
+
+    def snapshot(self):
+        """Rotate the journal and write a snapshot covering everything before it"""
+        with self._io_lock:
+            self._commit()
+            with self._lock:
+                covered_seq = self.seq
+                old_file = self._file
+                self._file = open(self._segment_path(covered_seq + 1), 'a', encoding='utf-8')
+                self._records_since_snapshot = 0
+            old_file.close()
+        self._last_snapshot = time.monotonic()
+
+        # Every record up to covered_seq was applied to the manager before it
+        # was logged, so a copy taken now contains at least that much state.
+        # Top-level copies are single C calls and safe against concurrent writers.
+        manager = self.manager
+        users = {anon_id: dict(data) for anon_id, data in dict(manager.anon_to_user).items()}
+        blocked = set(manager.blocked_users)
+        conversations = [(anon_id, list(messages)) for anon_id, messages in dict(manager.conversations).items()]
+        # Spilled conversations are streamed from their spill files by the writer
+        resident = {anon_id for anon_id, _ in conversations}
+        conversations.extend((anon_id, None) for anon_id in set(manager.spilled) - resident)
+
+        self._snapshot_thread = threading.Thread(
+            target=self._write_snapshot,
+            args=(covered_seq, users, blocked, conversations),
+            name='journal-snapshot',
+            daemon=True
+        )
+        self._snapshot_thread.start()
+
+    def _write_snapshot(self, covered_seq, users, blocked, conversations):
+        started = time.monotonic()
+        path = os.path.join(self.directory, SNAPSHOT_FILE)
+        tmp_path = path + '.tmp'
+        try:
+            with open(tmp_path, 'wb') as f:
+                pickle.dump({'version': SNAPSHOT_VERSION, 'seq': covered_seq}, f, pickle.HIGHEST_PROTOCOL)
+                pickle.dump(users, f, pickle.HIGHEST_PROTOCOL)
+                pickle.dump(blocked, f, pickle.HIGHEST_PROTOCOL)
+                # One pickle per conversation keeps peak memory near a single conversation
+                for anon_id, messages in conversations:
+                    if messages is None:
+                        # Spill files are replaced, never edited, so this is at
+                        # least as new as the state at rotation time
+                        messages = self.manager.spill_store.read(anon_id)
+                        if messages is None:
+                            continue
+                    pickle.dump((anon_id, messages), f, pickle.HIGHEST_PROTOCOL)
+                pickle.dump(None, f, pickle.HIGHEST_PROTOCOL)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, path)
+        except Exception as e:
+            logger.error(f"Error writing snapshot: {e}")
+            return
+
+        # Segments that end at or before covered_seq are now redundant
+        current = self._segment_path(covered_seq + 1)
+        for segment in self._segments():
+            if segment < current:
+                os.remove(segment)
+        logger.info(f"Snapshot #{covered_seq} written in {time.monotonic() - started:.2f}s")
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        self._wake.set()
+        try:
+            with self._io_lock:
+                self._commit()
+                self._file.close()
+        except Exception as e:
+            logger.error(f"Error closing journal: {e}")
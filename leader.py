@@ -0,0 +1,117 @@
+"""
+Leader Lease
+Elects the one process that consumes Telegram updates in multi-process mode
+"""
+
+import logging
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+
+logger = logging.getLogger(__name__)
+
+CREATE_LEASES = (
+    "CREATE TABLE IF NOT EXISTS leases ("
+    "name TEXT PRIMARY KEY, holder TEXT NOT NULL, expires_at REAL NOT NULL)"
+)
+# Take the lease if it is free, expired or already ours; one atomic statement
+ACQUIRE_LEASE = (
+    "INSERT INTO leases (name, holder, expires_at) VALUES (?, ?, ?) "
+    "ON CONFLICT(name) DO UPDATE SET holder = excluded.holder, expires_at = excluded.expires_at "
+    "WHERE leases.holder = excluded.holder OR leases.expires_at < ?"
+)
+SELECT_HOLDER = "SELECT holder, expires_at FROM leases WHERE name = ?"
+RELEASE_LEASE = "DELETE FROM leases WHERE name = ? AND holder = ?"
+
+
+class LeaderLease:
+    """A time-limited lease row in the shared SQLite database
+
+    The holder renews it every ttl/3 seconds. If the holder dies, the row
+    expires and the next process to try takes over, so failover needs no
+    coordinator. A holder that cannot renew in time steps down before its
+    lease can have passed to someone else.
+    """
+
+    def __init__(self, path, name='updates', ttl=15.0, holder=None):
+        self.path = path
+        self.name = name
+        self.ttl = ttl
+        self.holder = holder or f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.is_leader = False
+        self._expires_at = 0.0
+        self._conn = sqlite3.connect(path, timeout=5, isolation_level=None, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(CREATE_LEASES)
+        self._thread = None
+        self._stopped = threading.Event()
+
+    def try_acquire(self):
+        """Take or renew the lease; True if this process holds it afterwards"""
+        now = time.time()
+        expires_at = now + self.ttl
+        self._conn.execute(ACQUIRE_LEASE, (self.name, self.holder, expires_at, now))
+        row = self._conn.execute(SELECT_HOLDER, (self.name,)).fetchone()
+        if row is not None and row[0] == self.holder:
+            self._expires_at = expires_at
+            return True
+        return False
+
+    def release(self):
+        self._conn.execute(RELEASE_LEASE, (self.name, self.holder))
+
+    def current_holder(self):
+        row = self._conn.execute(SELECT_HOLDER, (self.name,)).fetchone()
+        if row is None or row[1] < time.time():
+            return None
+        return row[0]
+
+    def start(self, on_elected, on_demoted):
+        """Campaign from a background thread, calling back on every change of role"""
+        if self._thread is None:
+            self._thread = threading.Thread(
+                target=self._campaign, args=(on_elected, on_demoted), name='leader-lease', daemon=True
+            )
+            self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+
+    def _campaign(self, on_elected, on_demoted):
+        interval = self.ttl / 3
+        while not self._stopped.is_set():
+            try:
+                leading = self.try_acquire()
+            except sqlite3.Error as e:
+                logger.warning(f"Could not renew leader lease: {e}")
+                # Keep leading only while the last successful renewal is valid
+                leading = self.is_leader and time.time() < self._expires_at - interval
+
+            if leading and not self.is_leader:
+                self.is_leader = True
+                logger.info(f"Elected update consumer ({self.holder})")
+                on_elected()
+            elif not leading and self.is_leader:
+                self.is_leader = False
+                logger.warning(f"Lost leader lease ({self.holder})")
+                on_demoted()
+            self._stopped.wait(interval)
+
+        if self.is_leader:
+            self.is_leader = False
+            on_demoted()
+            try:
+                self.release()
+            except sqlite3.Error:
+                pass
+
+    def get_stats(self):
+        return {
+            'holder': self.holder,
+            'is_leader': self.is_leader,
+            'leader': self.current_holder(),
+            'ttl': self.ttl
+        }
@@ -0,0 +1,86 @@
+"""
+Live Events
+Fan-out of conversation changes to Server-Sent Events subscribers
+"""
+
+import json
+import logging
+import queue
+import threading
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+
+def _json_default(value):
+    if isinstance(value, datetime):
+        return value.strftime('%Y-%m-%d %H:%M:%S')
+    if hasattr(value, 'to_dict'):
+        return value.to_dict()
+    raise TypeError(f"Cannot serialize {type(value).__name__}")
+
+
+def format_event(event, data):
+    """One SSE frame: an event name and a single-line JSON payload"""
+    payload = json.dumps(data, default=_json_default, ensure_ascii=False, separators=(',', ':'))
+    return f"event: {event}\ndata: {payload}\n\n"
+
+
+class Subscription:
+    """Pending frames for one connected dashboard tab"""
+
+    def __init__(self, max_pending):
+        self._queue = queue.Queue(max_pending)
+        self.overflowed = False
+
+    def push(self, frame):
+        try:
+            self._queue.put_nowait(frame)
+        except queue.Full:
+            # The tab stopped reading; it gets a resync instead of a partial feed
+            self.overflowed = True
+
+    def next(self, timeout):
+        """The next frame, or None if nothing arrived within timeout seconds"""
+        try:
+            return self._queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+
+class EventBroker:
+    """Publishes each event once, as a preformatted frame, to every subscriber"""
+
+    def __init__(self, max_pending=1000):
+        self.max_pending = max_pending
+        self._subscribers = set()
+        self._lock = threading.Lock()
+        self.published = 0
+
+    def subscribe(self):
+        subscription = Subscription(self.max_pending)
+        with self._lock:
+            self._subscribers.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            self._subscribers.discard(subscription)
+
+    def active(self):
+        """True when at least one tab is listening, so payloads are worth building"""
+        return bool(self._subscribers)
+
+    def publish(self, event, data):
+        with self._lock:
+            subscribers = list(self._subscribers)
+        if not subscribers:
+            return
+        frame = format_event(event, data)
+        for subscription in subscribers:
+            subscription.push(frame)
+        self.published += 1
+
+    def get_stats(self):
+        with self._lock:
+            return {'subscribers': len(self._subscribers), 'published': self.published}
@@ -0,0 +1,137 @@
+"""
+Conversation Maintenance
+Background enforcement of conversation memory limits
+"""
+
+import logging
+import os
+import pickle
+import sys
+import threading
+import time
+
+from config import namespaced_path
+
+logger = logging.getLogger(__name__)
+
+
+def estimate_size(obj, _seen=None):
+    """Approximate bytes held by obj and everything it references"""
+    if _seen is None:
+        _seen = set()
+    if id(obj) in _seen:
+        return 0
+    _seen.add(id(obj))
+
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(estimate_size(k, _seen) + estimate_size(v, _seen) for k, v in obj.items())
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        size += sum(estimate_size(item, _seen) for item in obj)
+    elif hasattr(obj, '__slots__'):
+        size += sum(estimate_size(getattr(obj, name), _seen)
+                    for name in obj.__slots__ if hasattr(obj, name))
+    return size
+
+
+class SpillStore:
+    """One pickle file per spilled conversation"""
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, anon_id):
+        return os.path.join(self.directory, f'{anon_id}.pkl')
+
+    def write(self, anon_id, messages):
+        path = self._path(anon_id)
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            pickle.dump(messages, f, pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)
+
+    def read(self, anon_id):
+        try:
+            with open(self._path(anon_id), 'rb') as f:
+                return pickle.load(f)
+        except FileNotFoundError:
+            return None
+
+    def clear(self):
+        """Spill files only mirror the running process; drop leftovers at startup"""
+        for name in os.listdir(self.directory):
+            if name.endswith('.pkl') or name.endswith('.tmp'):
+                os.remove(os.path.join(self.directory, name))
+
+
+class ConversationMaintenance:
+    def __init__(self, manager, max_conversations=1000, timeout=7 * 24 * 3600,
+                 interval=3600, policy='spill', spill_dir='spill_data'):
+        self.manager = manager
+        self.max_conversations = max_conversations
+        self.timeout = timeout
+        self.interval = interval
+        self.policy = policy
+        self.last_cycle = None
+        self._thread = None
+
+        if policy == 'spill' and not manager._stores_messages():
+            manager.spill_store = SpillStore(spill_dir)
+            manager.spill_store.clear()
+
+    @classmethod
+    def from_config(cls, manager, config, namespace=None):
+        return cls(
+            manager,
+            max_conversations=config.MAX_CONVERSATIONS,
+            timeout=config.CONVERSATION_TIMEOUT,
+            interval=config.CLEANUP_INTERVAL,
+            policy=config.EVICTION_POLICY,
+            spill_dir=namespaced_path(config.SPILL_DIR, namespace)
+        )
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._loop, name='maintenance', daemon=True)
+            self._thread.start()
+
+    def _loop(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.run_cycle()
+            except Exception as e:
+                logger.error(f"Error in maintenance cycle: {e}")
+
+    def run_cycle(self):
+        """Spill or evict idle conversations, then trim to max_conversations (LRU)"""
+        started = time.monotonic()
+        stats = {'spilled': 0, 'evicted': 0, 'bytes_freed': 0, 'resident': 0}
+        manager = self.manager
+
+        if not manager._stores_messages():
+            cutoff = time.time() - self.timeout
+            for anon_id in manager.idle_conversations(cutoff):
+                self._release(anon_id, stats)
+
+            for anon_id in manager.least_recently_used(manager.resident_count() - self.max_conversations):
+                self._release(anon_id, stats)
+            stats['resident'] = manager.resident_count()
+
+        stats['duration'] = round(time.monotonic() - started, 3)
+        self.last_cycle = stats
+        logger.info(f"Maintenance freed ~{stats['bytes_freed']} bytes "
+                    f"(spilled {stats['spilled']}, evicted {stats['evicted']}, resident {stats['resident']})")
+        return stats
+
+    def _release(self, anon_id, stats):
+        if self.policy == 'spill':
+            freed = self.manager.spill_conversation(anon_id)
+            key = 'spilled'
+        else:
+            freed = self.manager.evict_conversation(anon_id)
+            key = 'evicted'
+        if freed is not None:
+            stats[key] += 1
+            stats['bytes_freed'] += freed
@@ -3,18 +3,109 @@ Message Configuration System
 Manages editable bot messages with admin controls
 """
 
+import atexit
 import json
 import os
 import logging
+import stat
+import tempfile
+import threading
+import time
+from string import Formatter
 
 logger = logging.getLogger(__name__)
 
+# Placeholders the bot passes to get_message for each key; any other field
+# in a template could never be filled in
+MESSAGE_FIELDS = {
+    'welcome_back': frozenset({'display_name'}),
+    'name_set_success': frozenset({'display_name'}),
+    'user_blocked': frozenset({'anon_id'}),
+    'user_unblocked': frozenset({'anon_id'}),
+    'reply_sent': frozenset({'display_name'}),
+    'reply_failed': frozenset({'identifier'}),
+    'user_not_found': frozenset({'identifier'}),
+    'user_ambiguous': frozenset({'identifier', 'candidates'}),
+    'user_suggestions': frozenset({'identifier', 'candidates'}),
+    'new_message_notification': frozenset({'display_name', 'anon_id', 'timestamp', 'message'}),
+    'new_photo_notification': frozenset({'display_name', 'anon_id', 'timestamp', 'caption_text'}),
+}
+
+_formatter = Formatter()
+
+
+class TemplateError(ValueError):
+    """A message text that cannot be rendered with the placeholders its key receives"""
+
+
+class MessageTemplate:
+    """A message text parsed once, when it is loaded or edited
+
+    Texts without placeholders are kept as the final string. The others keep
+    their literal pieces with a slot for each field, so rendering only
+    stringifies the values and joins.
+    """
+
+    __slots__ = ('key', 'text', 'fields', 'static', '_parts', '_slots')
+
+    def __init__(self, key, text, allowed=frozenset()):
+        try:
+            parsed = list(_formatter.parse(text))
+        except ValueError as e:
+            raise TemplateError(f"Chaves {{ }} mal formadas: {e}. Use {{{{ e }}}} para chaves literais.")
+
+        parts, slots = [], []
+        for literal, field, format_spec, conversion in parsed:
+            if literal:
+                parts.append(literal)
+            if field is None:
+                continue
+            if not field.isidentifier():
+                raise TemplateError(f"Variável inválida: {{{field}}}")
+            if field not in allowed:
+                available = ', '.join(f"{{{name}}}" for name in sorted(allowed)) or 'nenhuma'
+                raise TemplateError(f"Variável {{{field}}} não existe nesta mensagem (disponíveis: {available})")
+            if format_spec or conversion:
+                raise TemplateError(f"Use apenas {{{field}}}, sem formatação")
+            slots.append((len(parts), field))
+            parts.append(None)
+
+        self.key = key
+        self.text = text
+        self.fields = frozenset(field for _, field in slots)
+        self.static = ''.join(parts) if not slots else None
+        self._parts = parts
+        self._slots = slots
+
+    def render(self, values):
+        if self.static is not None:
+            return self.static
+        parts = self._parts.copy()
+        try:
+            for position, field in self._slots:
+                parts[position] = str(values[field])
+        except KeyError as e:
+            logger.warning(f"Missing format parameter for message '{self.key}': {e}")
+            return self.text
+        return ''.join(parts)
+
+
 class MessageConfig:
-    def __init__(self):
-        self.config_file = "bot_messages.json"
+    """Editable bot texts, persisted to a JSON file shared with other processes
+
+    Edits are saved in the background, coalesced over save_delay seconds,
+    by writing a temporary file and renaming it over the old one, so the
+    file is never seen half-written. A watcher thread checks the file's
+    mtime every reload_interval seconds and reloads edits made elsewhere.
+    """
+
+    def __init__(self, config_file="bot_messages.json", save_delay=0.5, reload_interval=2.0):
+        self.config_file = config_file
+        self.save_delay = save_delay
+        self.reload_interval = reload_interval
         self.default_messages = {
             "welcome_admin": {
-                "text": "🔧 <b>Painel do Administrador</b>\n\nVocê é o administrador do bot. As mensagens dos usuários serão encaminhadas para você aqui.\n\nPara responder a uma mensagem, use a interface web na URL configurada.\n\nComandos:\n/help - Mostrar esta mensagem de ajuda\n/block anon_12345678 - Bloquear um usuário\n/unblock anon_12345678 - Bloquear um usuário\n/editmsg - Editar mensagens do bot\n\n💻 <b>Interface Web:</b> Acesse para ver todas as conversas e gerenciar usuários\n📱 <b>Responder pelo celular:</b> Use o formato 'NomeUsuario: sua resposta'",
+                "text": "🔧 <b>Painel do Administrador</b>\n\nVocê é o administrador do bot. As mensagens dos usuários serão encaminhadas para você aqui.\n\nPara responder a uma mensagem, use a interface web na URL configurada.\n\nComandos:\n/help - Mostrar esta mensagem de ajuda\n/block anon_12345678 - Bloquear um usuário\n/unblock anon_12345678 - Bloquear um usuário\n/editmsg - Editar mensagens do bot\n/search palavras - Buscar nas conversas\n/profile - Perfilar o bot (cpu, memória, updates lentos)\n\n💻 <b>Interface Web:</b> Acesse para ver todas as conversas e gerenciar usuários\n📱 <b>Responder pelo celular:</b> Use o formato 'NomeUsuario: sua resposta'",
                 "description": "Mensagem de boas-vindas para o administrador"
             },
             "welcome_user": {
@@ -89,6 +180,14 @@ class MessageConfig:
                 "text": "❌ Usuário {identifier} não encontrado",
                 "description": "Usuário não encontrado para resposta"
             },
+            "user_ambiguous": {
+                "text": "⚠️ Mais de um usuário corresponde a <b>{identifier}</b>:\n{candidates}\n\nResponda usando o ID anônimo, por exemplo:\n<code>anon_12345678: sua resposta</code>",
+                "description": "Aviso quando o nome informado corresponde a vários usuários"
+            },
+            "user_suggestions": {
+                "text": "❓ Nenhum usuário se chama <b>{identifier}</b>. Você quis dizer:\n{candidates}\n\nResponda usando o nome completo ou o ID anônimo, por exemplo:\n<code>anon_12345678: sua resposta</code>",
+                "description": "Sugestões quando o nome informado só corresponde ao início de outros nomes"
+            },
             "reply_format_help": {
                 "text": "📱 Para responder pelo Telegram, use este formato:\n<code>NomeExibição: Sua mensagem de resposta aqui</code>\nou\n<code>anon_12345678: Sua mensagem de resposta aqui</code>\n\nVocê pode copiar o nome/ID das mensagens que eu encaminho para você.",
                 "description": "Ajuda sobre formato de resposta"
@@ -102,58 +201,171 @@ class MessageConfig:
                 "description": "Notificação de nova foto para admin"
             }
         }
+        self.templates = {}  # key -> MessageTemplate for every entry of self.messages
+        self._lock = threading.RLock()
+        self._dirty = False
+        self._save_timer = None
+        self._file_state = None  # (mtime_ns, size) of the file as last read or written
         self.load_messages()
+        atexit.register(self.flush)
+        if reload_interval:
+            threading.Thread(target=self._watch, name='message-config-watch', daemon=True).start()
 
-    def load_messages(self):
-        """Load messages from file or create default"""
+    @staticmethod
+    def compile_message(key, text):
+        """Parse and validate a text for key; raises TemplateError if it cannot be rendered"""
+        return MessageTemplate(key, text, MESSAGE_FIELDS.get(key, frozenset()))
+
+    def _compile_all(self, messages):
+        """Templates for messages; an invalid text is served as its default but kept as stored"""
+        templates = {}
+        for key, data in messages.items():
+            try:
+                templates[key] = self.compile_message(key, data['text'])
+            except TemplateError as e:
+                if key not in self.default_messages:
+                    logger.warning(f"Ignoring invalid message '{key}': {e}")
+                    continue
+                # The stored text stays in self.messages (and on disk) for the admin to fix
+                logger.warning(f"Invalid message '{key}', sending the default until it is fixed: {e}")
+                templates[key] = self.compile_message(key, self.default_messages[key]['text'])
+        return templates
+
+    def _stat(self):
         try:
-            if os.path.exists(self.config_file):
-                with open(self.config_file, 'r', encoding='utf-8') as f:
-                    self.messages = json.load(f)
-                    # Add any new default messages that don't exist
-                    for key, value in self.default_messages.items():
-                        if key not in self.messages:
-                            self.messages[key] = value
-            else:
-                self.messages = self.default_messages.copy()
+            st = os.stat(self.config_file)
+        except FileNotFoundError:
+            return None
+        return st.st_mtime_ns, st.st_size
 
-            self.save_messages()
-            logger.info("Messages loaded successfully")
+    def _read_file(self):
+        """Messages from the file, completed with defaults, and whether defaults were added"""
+        state = self._stat()
+        if state is None:
+            return {key: value.copy() for key, value in self.default_messages.items()}, True
+
+        with open(self.config_file, 'r', encoding='utf-8') as f:
+            messages = json.load(f)
+        # Add any new default messages that don't exist
+        added = False
+        for key, value in self.default_messages.items():
+            if key not in messages:
+                messages[key] = value.copy()
+                added = True
+        self._file_state = state
+        return messages, added
+
+    def load_messages(self):
+        """Load messages from file or create default; the file is only written to add missing defaults"""
+        try:
+            messages, changed = self._read_file()
         except Exception as e:
             logger.error(f"Error loading messages: {e}")
-            self.messages = self.default_messages.copy()
+            messages, changed = {key: value.copy() for key, value in self.default_messages.items()}, False
+
+        templates = self._compile_all(messages)
+        with self._lock:
+            self.messages, self.templates = messages, templates
+        if changed:
+            self.save_messages()
+        logger.info("Messages loaded successfully")
+
+    def reload_if_changed(self):
+        """Pick up the file if something else replaced it; True if it was reloaded"""
+        state = self._stat()
+        if state is None or state == self._file_state:
+            return False
+        with self._lock:
+            if self._dirty:
+                return False  # a local edit is about to be written over it
+            try:
+                messages, _ = self._read_file()
+            except (OSError, ValueError) as e:
+                # Wait for the next change rather than retrying a broken file
+                self._file_state = state
+                logger.warning(f"Not reloading {self.config_file}: {e}")
+                return False
+            self.templates = self._compile_all(messages)
+            self.messages = messages
+        logger.info(f"Reloaded messages from {self.config_file}")
+        return True
+
+    def _watch(self):
+        while True:
+            time.sleep(self.reload_interval)
+            try:
+                self.reload_if_changed()
+            except Exception as e:
+                logger.error(f"Error checking {self.config_file}: {e}")
 
     def save_messages(self):
-        """Save messages to file"""
-        try:
-            with open(self.config_file, 'w', encoding='utf-8') as f:
-                json.dump(self.messages, f, ensure_ascii=False, indent=2)
-            logger.info("Messages saved successfully")
-        except Exception as e:
-            logger.error(f"Error saving messages: {e}")
+        """Save messages to file, batching edits made within save_delay seconds"""
+        with self._lock:
+            self._dirty = True
+            if not self.save_delay:
+                self.flush()
+            elif self._save_timer is None:
+                self._save_timer = threading.Timer(self.save_delay, self.flush)
+                self._save_timer.daemon = True
+                self._save_timer.start()
+
+    def flush(self):
+        """Write pending edits now, atomically: a temporary file renamed over the old one"""
+        with self._lock:
+            if self._save_timer is not None:
+                self._save_timer.cancel()
+                self._save_timer = None
+            if not self._dirty:
+                return
+            self._dirty = False
+
+            directory = os.path.dirname(os.path.abspath(self.config_file))
+            temp_path = None
+            try:
+                fd, temp_path = tempfile.mkstemp(prefix='.messages-', suffix='.tmp', dir=directory)
+                with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                    json.dump(self.messages, f, ensure_ascii=False, indent=2)
+                    f.flush()
+                    os.fsync(f.fileno())
+                previous = self._stat()
+                os.chmod(temp_path, stat.S_IMODE(os.stat(self.config_file).st_mode) if previous else 0o644)
+                os.replace(temp_path, self.config_file)
+                temp_path = None
+                self._file_state = self._stat()
+                logger.info("Messages saved successfully")
+            except Exception as e:
+                self._dirty = True  # retried by the next save
+                logger.error(f"Error saving messages: {e}")
+            finally:
+                if temp_path is not None:
+                    try:
+                        os.unlink(temp_path)
+                    except OSError:
+                        pass
 
     def get_message(self, key, **kwargs):
         """Get a message with optional formatting"""
-        if key not in self.messages:
+        template = self.templates.get(key)
+        if template is None:
             logger.warning(f"Message key '{key}' not found")
             return f"Message '{key}' not configured"
+        return template.render(kwargs)
 
-        message = self.messages[key]['text']
-
-        # Format message with provided kwargs
-        try:
-            return message.format(**kwargs)
-        except KeyError as e:
-            logger.warning(f"Missing format parameter for message '{key}': {e}")
-            return message
+    def get_placeholders(self, key):
+        """Placeholders a text for key may use"""
+        return sorted(MESSAGE_FIELDS.get(key, ()))
 
     def set_message(self, key, text):
-        """Set a message text"""
-        if key in self.messages:
-            self.messages[key]['text'] = text
+        """Set a message text; raises TemplateError if the text is invalid"""
+        with self._lock:
+            if key not in self.messages:
+                return False
+            template = self.compile_message(key, text)
+            # A new entry dict: after a reset the old one may be a default
+            self.messages[key] = dict(self.messages[key], text=text)
+            self.templates[key] = template
             self.save_messages()
-            return True
-        return False
+        return True
 
     def list_messages(self):
         """List all available messages"""
@@ -168,16 +380,21 @@ class MessageConfig:
     def reset_message(self, key):
         """Reset a message to default"""
         if key in self.default_messages:
-            self.messages[key] = self.default_messages[key].copy()
-            self.save_messages()
+            with self._lock:
+                self.messages[key] = self.default_messages[key].copy()
+                self.templates[key] = self.compile_message(key, self.messages[key]['text'])
+                self.save_messages()
             return True
         return False
 
     def reset_all_messages(self):
         """Reset all messages to default values"""
         try:
-            self.messages = self.default_messages.copy()
-            self.save_messages()
+            messages = {key: value.copy() for key, value in self.default_messages.items()}
+            templates = self._compile_all(messages)
+            with self._lock:
+                self.messages, self.templates = messages, templates
+                self.save_messages()
             logger.info("All messages reset to default")
             return True
         except Exception as e:
@@ -0,0 +1,155 @@
+"""
+Message Records
+Compact storage for conversation messages with a read-only dict view
+"""
+
+import sys
+import threading
+import weakref
+from datetime import datetime
+
+
+class Sender:
+    """The sender fields shared by all of a user's messages; weakly referenceable, unlike a tuple"""
+
+    __slots__ = ('anon_id', 'user_id', 'username', 'display_name', '__weakref__')
+
+    def __init__(self, anon_id, user_id, username, display_name):
+        self.anon_id = anon_id
+        self.user_id = user_id
+        self.username = username
+        self.display_name = display_name
+
+    def fields(self):
+        return (self.anon_id, self.user_id, self.username, self.display_name)
+
+
+# One shared Sender per (anon_id, user_id, username, display_name) combination,
+# so a user's thousands of messages reference a single copy of those fields.
+# Entries go away with the last record using them (evicted conversations,
+# display names since changed).
+_senders = weakref.WeakValueDictionary()
+_senders_lock = threading.Lock()
+
+
+def intern_sender(anon_id, user_id, username, display_name):
+    key = (anon_id, user_id, username, display_name)
+    sender = _senders.get(key)
+    if sender is None:
+        with _senders_lock:
+            sender = _senders.get(key)
+            if sender is None:
+                sender = _senders[key] = Sender(*key)
+    return sender
+
+
+def _epoch(value):
+    if isinstance(value, datetime):
+        return int(value.timestamp())
+    return int(value)
+
+
+class MessageRecord:
+    """One stored message: ~100 bytes of slots instead of a 9-key dict
+
+    Reads like the dicts add_message used to store (``record['message']``,
+    ``record.get('caption')``, attribute access from Jinja), so templates and
+    JSON endpoints do not care which layout they get. Fields that are None
+    are reported as absent, matching the dicts, which simply omitted them.
+    """
+
+    __slots__ = ('ts', 'sender', 'message', 'direction', 'photo_file_id', 'caption')
+
+    KEYS = ('timestamp', 'anon_id', 'user_id', 'username', 'display_name',
+            'message', 'direction', 'photo_file_id', 'caption')
+
+    def __init__(self, ts, sender, message, direction, photo_file_id=None, caption=None):
+        self.ts = ts
+        self.sender = sender
+        self.message = message
+        self.direction = sys.intern(direction)
+        self.photo_file_id = photo_file_id
+        self.caption = caption
+
+    @classmethod
+    def from_dict(cls, message_data):
+        return cls(
+            _epoch(message_data['timestamp']),
+            intern_sender(
+                message_data.get('anon_id'),
+                message_data.get('user_id'),
+                message_data.get('username'),
+                message_data.get('display_name')
+            ),
+            message_data['message'],
+            message_data['direction'],
+            message_data.get('photo_file_id'),
+            message_data.get('caption')
+        )
+
+    @property
+    def timestamp(self):
+        return datetime.fromtimestamp(self.ts)
+
+    @property
+    def anon_id(self):
+        return self.sender.anon_id
+
+    @property
+    def user_id(self):
+        return self.sender.user_id
+
+    @property
+    def username(self):
+        return self.sender.username
+
+    @property
+    def display_name(self):
+        return self.sender.display_name
+
+    # Read-only mapping protocol
+
+    def get(self, key, default=None):
+        if key not in self.KEYS:
+            return default
+        value = getattr(self, key)
+        return default if value is None else value
+
+    def __getitem__(self, key):
+        value = self.get(key)
+        if value is None:
+            raise KeyError(key)
+        return value
+
+    def __contains__(self, key):
+        return self.get(key) is not None
+
+    def keys(self):
+        return [key for key in self.KEYS if self.get(key) is not None]
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __len__(self):
+        return len(self.keys())
+
+    def items(self):
+        return [(key, getattr(self, key)) for key in self.keys()]
+
+    def values(self):
+        return [getattr(self, key) for key in self.keys()]
+
+    def to_dict(self):
+        return dict(self.items())
+
+    # Pickling (journal snapshots, spill files) re-interns the sender on load
+
+    def __getstate__(self):
+        return (self.ts, self.sender.fields(), self.message, self.direction, self.photo_file_id, self.caption)
+
+    def __setstate__(self, state):
+        ts, sender, message, direction, photo_file_id, caption = state
+        self.__init__(ts, intern_sender(*sender), message, direction, photo_file_id, caption)
+
+    def __repr__(self):
+        return f"MessageRecord({self.to_dict()!r})"
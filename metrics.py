@@ -0,0 +1,211 @@
+"""
+Metrics
+In-process counters and histograms exposed in the Prometheus text format
+"""
+
+import bisect
+import logging
+import os
+import resource
+import sys
+import threading
+
+logger = logging.getLogger(__name__)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Seconds, from a fast in-memory handler up to a slow Bot API round trip
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _labels(names, values):
+    if not names:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in zip(names, values)) + '}'
+
+
+def _number(value):
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children = {}
+        self._lock = threading.Lock()
+
+    def labels(self, *values):
+        """The child for one combination of label values, created on first use"""
+        child = self._children.get(values)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(values, self._new_child())
+        return child
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for values, child in sorted(self._children.items()):
+            lines.extend(child.render(self.name, _labels(self.labelnames, values), self.labelnames, values))
+        return lines
+
+
+class _CounterChild:
+    __slots__ = ('value', '_lock')
+
+    def __init__(self):
+        self.value = 0
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+    def render(self, name, labels, labelnames, values):
+        return [f"{name}{labels} {_number(self.value)}"]
+
+
+class _HistogramChild:
+    __slots__ = ('bounds', 'counts', 'sum', '_lock')
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)  # the last slot is +Inf
+        self.sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        position = bisect.bisect_left(self.bounds, value)
+        with self._lock:
+            self.counts[position] += 1
+            self.sum += value
+
+    def render(self, name, labels, labelnames, values):
+        with self._lock:
+            counts, total = list(self.counts), self.sum
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.bounds + (float('inf'),), counts):
+            cumulative += count
+            bucket_labels = _labels(labelnames + ('le',), values + (_number(float(bound)),))
+            lines.append(f"{name}_bucket{bucket_labels} {cumulative}")
+        lines.append(f"{name}_sum{labels} {_number(total)}")
+        lines.append(f"{name}_count{labels} {cumulative}")
+        return lines
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def _new_child(self):
+        return _CounterChild()
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def _new_child(self):
+        return _HistogramChild(self.buckets)
+
+
+class Registry:
+    """Metrics updated on the hot paths, plus collectors read only at scrape time
+
+    A collector is a callable returning (name, kind, documentation, samples)
+    tuples, samples being (labels dict, value) pairs. Figures the code already
+    keeps, such as queue depths and conversation counts, are reported this way
+    so they cost nothing until /metrics is requested.
+    """
+
+    def __init__(self):
+        self._metrics = {}
+        self._collectors = []
+        self._lock = threading.Lock()
+
+    def _add(self, metric):
+        with self._lock:
+            existing = self._metrics.get(metric.name)
+            if existing is not None:
+                return existing
+            self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._add(Counter(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        return self._add(Histogram(name, documentation, labelnames, buckets))
+
+    def register_collector(self, collector):
+        with self._lock:
+            if collector not in self._collectors:
+                self._collectors.append(collector)
+
+    def render(self):
+        """Every metric in the Prometheus text exposition format"""
+        with self._lock:
+            metrics = list(self._metrics.values())
+            collectors = list(self._collectors)
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        for collector in collectors:
+            try:
+                families = list(collector())
+            except Exception as e:
+                logger.error(f"Metrics collector {getattr(collector, '__name__', collector)} failed: {e}")
+                continue
+            for name, kind, documentation, samples in families:
+                lines.append(f"# HELP {name} {documentation}")
+                lines.append(f"# TYPE {name} {kind}")
+                for labels, value in samples:
+                    names = tuple(labels)
+                    lines.append(f"{name}{_labels(names, (labels[n] for n in names))} {_number(value)}")
+        return '\n'.join(lines) + '\n'
+
+
+def collect_process():
+    """Memory and CPU of this process"""
+    families = []
+    try:
+        with open('/proc/self/statm') as f:
+            size, resident = (int(field) for field in f.read().split()[:2])
+        page = os.sysconf('SC_PAGE_SIZE')
+        families.append(('process_resident_memory_bytes', 'gauge', 'Resident memory size in bytes.',
+                         [({}, resident * page)]))
+        families.append(('process_virtual_memory_bytes', 'gauge', 'Virtual memory size in bytes.',
+                         [({}, size * page)]))
+    except (OSError, ValueError):
+        pass  # no procfs (e.g. macOS); the peak below is still reported
+
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    # Linux reports KiB, macOS bytes
+    peak = usage.ru_maxrss * (1 if sys.platform == 'darwin' else 1024)
+    families.append(('process_max_resident_memory_bytes', 'gauge', 'Peak resident memory size in bytes.',
+                     [({}, peak)]))
+    families.append(('process_cpu_seconds_total', 'counter', 'Total user and system CPU time spent in seconds.',
+                     [({}, usage.ru_utime + usage.ru_stime)]))
+    families.append(('process_threads', 'gauge', 'Number of Python threads.', [({}, threading.active_count())]))
+    return families
+
+
+REGISTRY = Registry()
+REGISTRY.register_collector(collect_process)
@@ -0,0 +1,452 @@
+"""
+Profiling
+On-demand CPU, sampling and memory profiles, and a log of slow updates
+"""
+
+import cProfile
+import functools
+import io
+import itertools
+import logging
+import marshal
+import os
+import pstats
+import re
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter, deque
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+MODES = ('cpu', 'sample', 'memory')
+EXTENSIONS = {'cpu': 'prof', 'sample': 'folded', 'memory': 'txt'}
+
+_local = threading.local()  # phases of the update the current thread is handling
+
+
+class ProfilerError(ValueError):
+    pass
+
+
+class _Noop:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NOOP = _Noop()
+
+
+def timed_phase(name):
+    """Charge a function's time to the named phase of the update the calling thread is handling
+
+    Outside update handling (dashboard requests, maintenance) the function
+    runs untimed.
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            phases = getattr(_local, 'phases', None)
+            if phases is None:
+                return func(*args, **kwargs)
+            started = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                spent = phases.get(name)
+                elapsed = time.perf_counter() - started
+                phases[name] = (spent[0] + elapsed, spent[1] + 1) if spent else (elapsed, 1)
+        return wrapper
+    return decorator
+
+
+class SlowUpdateLog:
+    """Updates whose handling took longer than threshold seconds, with a phase breakdown
+
+    start() and finish() bracket one update on the handling thread; calls
+    decorated with timed_phase in between are added up by phase.
+    """
+
+    def __init__(self, threshold=1.0, keep=100):
+        self.threshold = threshold
+        self.recorded = 0
+        self._entries = deque(maxlen=keep)
+        self._lock = threading.Lock()
+
+    def start(self):
+        if self.threshold:
+            _local.phases = {}
+
+    def finish(self, bot_id, update_type, update_id, elapsed):
+        phases = getattr(_local, 'phases', None)
+        _local.phases = None
+        if phases is None or elapsed < self.threshold:
+            return
+
+        accounted = sum(seconds for seconds, _ in phases.values())
+        entry = {
+            'time': datetime.now().isoformat(timespec='seconds'),
+            'bot': bot_id,
+            'type': update_type,
+            'update_id': update_id,
+            'total_ms': round(elapsed * 1000, 1),
+            'phases': {name: {'ms': round(seconds * 1000, 1), 'calls': calls}
+                       for name, (seconds, calls) in sorted(phases.items(), key=lambda item: -item[1][0])},
+            'other_ms': round(max(elapsed - accounted, 0.0) * 1000, 1)
+        }
+        with self._lock:
+            self._entries.append(entry)
+            self.recorded += 1
+
+        breakdown = ', '.join(f"{name} {phase['ms']:.0f} ms x{phase['calls']}" for name, phase in entry['phases'].items())
+        logger.warning(f"Slow update {update_id} ({update_type}, bot {bot_id}): {entry['total_ms']:.0f} ms"
+                       f" - {breakdown + ', ' if breakdown else ''}other {entry['other_ms']:.0f} ms")
+
+    def get_recent(self, limit=None):
+        """Most recent slow updates, newest first"""
+        with self._lock:
+            entries = list(self._entries)
+        entries.reverse()
+        return entries[:limit] if limit else entries
+
+    def get_stats(self):
+        return {'threshold': self.threshold, 'recorded': self.recorded, 'kept': len(self._entries)}
+
+
+class _ProfileSession:
+    def __init__(self, mode, seconds, on_done):
+        self.mode = mode
+        self.seconds = seconds
+        self.on_done = on_done
+        self.started = time.time()
+        self.ended = None
+        self.closed = False
+        self.profiles = {}  # thread ident -> [cProfile.Profile, active, ever enabled]
+        self.active = 0
+        self.skipped = 0  # sections another profiler kept us from recording
+        self.samples = Counter()  # folded stack -> samples
+        self.ticks = 0
+        self.snapshot = None
+        self.was_tracing = False
+        self.sampler = None  # the sample mode's thread
+        self.done = threading.Event()
+        self.cond = threading.Condition()
+
+    def acquire_profile(self):
+        """This thread's profiler, or None if it is already inside a section or the session ended"""
+        ident = threading.get_ident()
+        with self.cond:
+            if self.closed:
+                return None
+            entry = self.profiles.get(ident)
+            if entry is None:
+                entry = self.profiles[ident] = [cProfile.Profile(), False, False]
+            elif entry[1]:
+                return None
+            entry[1] = True
+            self.active += 1
+            return entry
+
+    def release_profile(self, entry, skipped=False):
+        with self.cond:
+            entry[1] = False
+            self.active -= 1
+            if skipped:
+                self.skipped += 1
+            self.cond.notify_all()
+
+
+class _Section:
+    """Profiles the enclosed code on the current thread while a cpu session runs"""
+
+    __slots__ = ('session', 'entry')
+
+    def __init__(self, session):
+        self.session = session
+        self.entry = None
+
+    def __enter__(self):
+        entry = self.session.acquire_profile()
+        if entry is not None:
+            try:
+                entry[0].enable()
+            except ValueError:
+                # Another profiler owns this interpreter: a debugger, or on
+                # Python 3.12+ (sys.monitoring) a section on another thread
+                self.session.release_profile(entry, skipped=True)
+                return self
+            entry[2] = True
+            self.entry = entry
+        return self
+
+    def __exit__(self, *exc):
+        if self.entry is not None:
+            self.entry[0].disable()
+            self.session.release_profile(self.entry)
+        return False
+
+
+class Profiler:
+    """One profiling session at a time for the whole process, written to directory
+
+    cpu runs cProfile around each update handler and dashboard request while
+    the session lasts (see section()); sample reads every thread's stack at a
+    fixed interval and writes folded stacks for flame graph tools; memory
+    compares tracemalloc snapshots taken at the start and the end.
+    """
+
+    def __init__(self, directory='profiles', max_seconds=300, sample_interval=0.005, memory_frames=1, keep=20):
+        self.directory = directory
+        self.max_seconds = max_seconds
+        self.sample_interval = sample_interval
+        self.memory_frames = memory_frames
+        self._session = None
+        self._results = deque(maxlen=keep)
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, config):
+        return cls(
+            directory=config.PROFILE_DIR,
+            max_seconds=config.PROFILE_MAX_SECONDS,
+            sample_interval=config.PROFILE_SAMPLE_INTERVAL,
+            memory_frames=config.PROFILE_MEMORY_FRAMES
+        )
+
+    @property
+    def running(self):
+        return self._session is not None
+
+    def section(self):
+        """Context manager for one update or request: profiled during a cpu session, free otherwise"""
+        session = self._session
+        if session is None or session.mode != 'cpu':
+            return _NOOP
+        return _Section(session)
+
+    def start(self, mode, seconds, on_done=None):
+        """Begin a session that ends by itself after seconds; on_done(result) is called then"""
+        if mode not in MODES:
+            raise ProfilerError(f"Unknown profile mode '{mode}' (use {', '.join(MODES)})")
+        if not 0 < seconds <= self.max_seconds:
+            raise ProfilerError(f"Duration must be between 1 and {self.max_seconds} seconds")
+
+        session = _ProfileSession(mode, seconds, on_done)
+        with self._lock:
+            if self._session is not None:
+                raise ProfilerError(f"A {self._session.mode} profile is already running")
+            if mode == 'memory':
+                session.was_tracing = tracemalloc.is_tracing()
+                if not session.was_tracing:
+                    tracemalloc.start(self.memory_frames)
+                session.snapshot = self._memory_snapshot()
+            self._session = session
+
+        if mode == 'sample':
+            session.sampler = threading.Thread(target=self._sample, args=(session,), name='profiler-sample', daemon=True)
+            session.sampler.start()
+        timer = threading.Timer(seconds, self._finish, args=(session,))
+        timer.daemon = True
+        timer.start()
+        logger.info(f"Started {mode} profile for {seconds}s")
+        return self._describe(session)
+
+    def stop(self, on_done=None):
+        """End the running session early; returns what was running, or None if nothing was
+
+        The result is collected on a thread of its own, as when the timer
+        fires, and goes to on_done (if given, instead of the one passed to
+        start()) and get_status(). Callers are usually inside a section()
+        themselves, which the collection waits for.
+        """
+        session = self._session
+        if session is None or not self._end(session):
+            return None
+        if on_done is not None:
+            session.on_done = on_done
+        threading.Thread(target=self._complete, args=(session,), name='profiler-finish', daemon=True).start()
+        return self._describe(session)
+
+    def _end(self, session):
+        """Detach session so no new work is profiled; False if it had already ended"""
+        with self._lock:
+            if self._session is not session:
+                return False  # stopped early, or the timer fired after stop()
+            self._session = None
+        session.done.set()
+        session.ended = time.time()
+        return True
+
+    def _finish(self, session):
+        if self._end(session):
+            self._complete(session)
+
+    def _complete(self, session):
+        elapsed = session.ended - session.started
+        try:
+            if session.mode == 'cpu':
+                content, summary = self._collect_cpu(session)
+            elif session.mode == 'sample':
+                content, summary = self._collect_samples(session)
+            else:
+                content, summary = self._collect_memory(session)
+            result = self._write(session, elapsed, content, summary)
+        except Exception as e:
+            logger.error(f"Could not finish {session.mode} profile: {e}")
+            return
+
+        logger.info(f"Wrote {session.mode} profile {result['name']} ({elapsed:.1f}s)")
+        if session.on_done is not None:
+            try:
+                session.on_done(result)
+            except Exception as e:
+                logger.error(f"Error delivering profile {result['name']}: {e}")
+
+    def _collect_cpu(self, session):
+        # A profile can only be stopped by its own thread (disable() from here
+        # would leave it recording), so wait for running sections to exit
+        with session.cond:
+            session.closed = True
+            if not session.cond.wait_for(lambda: session.active == 0, timeout=5):
+                logger.info(f"Waiting for {session.active} running handler(s) to finish the cpu profile")
+                session.cond.wait_for(lambda: session.active == 0, timeout=self.max_seconds)
+            entries = list(session.profiles.values())
+            profiles = [profile for profile, active, enabled in entries if enabled and not active]
+            stuck = sum(1 for _, active, _ in entries if active)
+            skipped = session.skipped
+
+        note = f"\n{stuck} handler(s) still running after {self.max_seconds} s were left out." if stuck else ""
+        if skipped:
+            note += (f"\n{skipped} handler(s) were not profiled: another profiler was active"
+                     f"{' (Python 3.12+ profiles one thread at a time)' if sys.version_info >= (3, 12) else ''}.")
+        if not profiles:
+            return b'', "No update or request was handled during the profile." + note
+        stats = pstats.Stats(profiles[0])
+        for profile in profiles[1:]:
+            stats.add(profile)
+        text = io.StringIO()
+        stats.stream = text
+        stats.sort_stats('cumulative').print_stats(25)
+        # Same bytes as Stats.dump_stats, readable by pstats and snakeviz
+        return marshal.dumps(stats.stats), text.getvalue().strip() + note
+
+    def _sample(self, session):
+        own = threading.get_ident()
+        names = {}
+        refreshed = 0.0
+        while not session.done.wait(self.sample_interval):
+            now = time.monotonic()
+            if now - refreshed > 1.0:
+                # Pool threads are numbered (update_3, send_0); sample them as one
+                names = {thread.ident: re.sub(r'[-_]\d+$', '', thread.name) for thread in threading.enumerate()}
+                refreshed = now
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                    frame = frame.f_back
+                stack.append(names.get(ident, 'thread'))
+                session.samples[';'.join(reversed(stack))] += 1
+            session.ticks += 1
+
+    def _collect_samples(self, session):
+        session.sampler.join()  # done is set; let the tick in progress finish
+        lines = [f"{stack} {count}" for stack, count in session.samples.most_common()]
+        leaves = Counter()
+        for stack, count in session.samples.items():
+            leaves[stack.rsplit(';', 1)[-1]] += count
+        total = sum(leaves.values()) or 1
+        summary = [f"{session.ticks} samples, {total} thread stacks; busiest frames:"]
+        summary.extend(f"{100 * count / total:5.1f}%  {leaf}" for leaf, count in leaves.most_common(15))
+        return ('\n'.join(lines) + '\n').encode('utf-8'), '\n'.join(summary)
+
+    @staticmethod
+    def _memory_snapshot():
+        return tracemalloc.take_snapshot().filter_traces((
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, __file__),
+        ))
+
+    def _collect_memory(self, session):
+        after = self._memory_snapshot()
+        current, peak = tracemalloc.get_traced_memory()
+        if not session.was_tracing:
+            tracemalloc.stop()
+
+        diff = after.compare_to(session.snapshot, 'lineno')
+        growth = sum(stat.size_diff for stat in diff)
+        header = (f"Allocated and still alive since the start: {growth / 1024:+.1f} KiB "
+                  f"in {sum(stat.count_diff for stat in diff):+d} blocks; traced now {current / 1024:.1f} KiB, "
+                  f"peak {peak / 1024:.1f} KiB")
+        lines = [header, ''] + [str(stat) for stat in diff[:100]]
+        summary = '\n'.join([header, ''] + [str(stat) for stat in diff[:10]])
+        return ('\n'.join(lines) + '\n').encode('utf-8'), summary
+
+    def _path(self, session, extension, attempt=1):
+        stamp = datetime.fromtimestamp(session.started).strftime('%Y%m%d-%H%M%S')
+        suffix = f"-{attempt}" if attempt > 1 else ""
+        return os.path.join(self.directory, f"{session.mode}-{stamp}{suffix}.{extension}")
+
+    def _write(self, session, elapsed, content, summary):
+        os.makedirs(self.directory, exist_ok=True)
+        # Two profiles of a mode started in the same second get a numbered name
+        # instead of overwriting one another (or one from before a restart)
+        for attempt in itertools.count(1):
+            path = self._path(session, EXTENSIONS[session.mode], attempt)
+            try:
+                f = open(path, 'xb')
+            except FileExistsError:
+                continue
+            break
+        with f:
+            f.write(content)
+        result = {
+            'name': os.path.basename(path),
+            'mode': session.mode,
+            'started_at': datetime.fromtimestamp(session.started).isoformat(timespec='seconds'),
+            'seconds': round(elapsed, 1),
+            'size': len(content),
+            'summary': summary
+        }
+        with self._lock:
+            if len(self._results) == self._results.maxlen:
+                self._remove_file(self._results[0]['name'])
+            self._results.append(result)
+        return result
+
+    def _remove_file(self, name):
+        try:
+            os.remove(os.path.join(self.directory, name))
+        except OSError:
+            pass
+
+    def result_path(self, name):
+        """Path of a finished profile by name, or None if it is not one of ours"""
+        with self._lock:
+            known = any(result['name'] == name for result in self._results)
+        return os.path.join(self.directory, name) if known else None
+
+    def _describe(self, session):
+        return {
+            'mode': session.mode,
+            'seconds': session.seconds,
+            'started_at': datetime.fromtimestamp(session.started).isoformat(timespec='seconds'),
+            'remaining': 0.0 if session.ended else round(max(session.started + session.seconds - time.time(), 0.0), 1)
+        }
+
+    def get_status(self):
+        session = self._session
+        with self._lock:
+            results = [{key: value for key, value in result.items() if key != 'summary'}
+                       for result in reversed(self._results)]
+        return {'running': self._describe(session) if session else None, 'results': results}
@@ -0,0 +1,210 @@
+"""
+Search Index
+Incremental, accent-insensitive full-text index over conversation messages
+"""
+
+import bisect
+import math
+import re
+import threading
+import unicodedata
+from array import array
+
+_WORD = re.compile(r'\w+')
+
+
+def _build_fold_table():
+    """str.translate table mapping accented Latin letters to their base letter
+
+    Covers Latin-1 and Latin Extended-A/B, where Portuguese accents live, and
+    drops stray combining marks, so text needs no per-character normalization.
+    """
+    table = {}
+    for code in range(0xC0, 0x250):
+        char = chr(code)
+        base = ''.join(c for c in unicodedata.normalize('NFKD', char) if not unicodedata.combining(c))
+        if base != char:
+            table[code] = base
+    for code in range(0x300, 0x370):
+        table[code] = None
+    return table
+
+
+_FOLD = _build_fold_table()
+
+# Common Portuguese words, accent-folded; they match nearly every message and
+# would only make posting lists long
+STOPWORDS = frozenset("""
+    ao aos as ate com como da das de dela dele deles do dos ela elas ele eles em entre era essa esse
+    esta este eu foi ha isso isto ja lhe mais mas me meu minha muito na nao nas nem no nos num numa
+    os ou para pela pelo por qual que quem se sem seu sua so ta te tem tu um uma voce
+""".split())
+
+
+def fold(text):
+    """Lowercase text without accents: 'Não É' -> 'nao e'"""
+    return text.casefold().translate(_FOLD)
+
+
+def tokenize(text):
+    """Searchable words of text, folded, in order; stopwords and single characters are skipped"""
+    return [word for word in _WORD.findall(fold(text)) if len(word) > 1 and word not in STOPWORDS]
+
+
+def snippet(text, query, width=120):
+    """About width characters of text around the first query word it contains"""
+    if len(text) <= width:
+        return text
+    folded = fold(text)
+    starts = [folded.find(word) for word in tokenize(query)]
+    start = min((position for position in starts if position >= 0), default=0)
+    begin = max(0, min(start - width // 3, len(text) - width))
+    excerpt = text[begin:begin + width]
+    return ('…' if begin else '') + excerpt + ('…' if begin + width < len(text) else '')
+
+
+class SearchIndex:
+    """Inverted index from folded words to the messages containing them
+
+    Each indexed message is a document numbered in arrival order, so every
+    posting list is an array of ascending document numbers with a parallel
+    array of term counts. Queries intersect the lists from the newest end and
+    rank the newest max_candidates matches with BM25, so the cost depends on
+    the shortest list and that cap, not on the size of the history.
+    """
+
+    K1 = 1.2
+    B = 0.75
+    WINDOW = 4096  # posting entries intersected per step
+
+    def __init__(self, max_candidates=2000):
+        self.max_candidates = max_candidates
+        self._postings = {}            # word -> (array of doc numbers, array of counts)
+        self._anon_ids = []            # doc -> anon_id
+        self._positions = array('I')   # doc -> position of the message in its conversation
+        self._lengths = array('H')     # doc -> number of indexed words
+        self._total_length = 0
+        self._dropped = {}             # anon_id -> docs up to this number belong to an evicted conversation
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._anon_ids)
+
+    def add(self, anon_id, position, text):
+        """Index the message at position in anon_id's conversation"""
+        words = tokenize(text) if text else []
+        counts = {}
+        for word in words:
+            counts[word] = counts.get(word, 0) + 1
+
+        with self._lock:
+            doc = len(self._anon_ids)
+            self._anon_ids.append(anon_id)
+            self._positions.append(position)
+            self._lengths.append(min(len(words), 0xFFFF))
+            self._total_length += len(words)
+            for word, count in counts.items():
+                posting = self._postings.get(word)
+                if posting is None:
+                    posting = self._postings[word] = (array('I'), array('B'))
+                posting[0].append(doc)
+                posting[1].append(min(count, 255))
+
+    def remove_conversation(self, anon_id):
+        """Hide every message indexed so far for anon_id (its history was dropped)"""
+        with self._lock:
+            self._dropped[anon_id] = len(self._anon_ids) - 1
+
+    def clear(self):
+        # New containers rather than emptied ones: a search running outside
+        # the lock keeps reading the ones it snapshotted
+        with self._lock:
+            self._postings = {}
+            self._anon_ids = []
+            self._positions = array('I')
+            self._lengths = array('H')
+            self._total_length = 0
+            self._dropped = {}
+
+    def search(self, query, offset=0, limit=20, anon_id=None):
+        """Ranked (anon_id, position, score) hits for messages containing every query word
+
+        Returns (hits, total, truncated): total counts the matches that were
+        ranked, and truncated says older matches were left out.
+        """
+        words = list(dict.fromkeys(tokenize(query)))
+        if not words:
+            return [], 0, False
+
+        # Every array is append-only and clear() swaps in new ones, so the
+        # first `size` entries of each snapshotted list stay as they are; the
+        # lock is held only for the snapshot and add() can go on while we score
+        with self._lock:
+            postings = [self._postings.get(word) for word in words]
+            if any(posting is None for posting in postings):
+                return [], 0, False
+            postings = [(docs, doc_counts, len(docs)) for docs, doc_counts in postings]
+            anon_ids, positions, lengths, dropped = self._anon_ids, self._positions, self._lengths, self._dropped
+            documents = len(anon_ids)
+            average_length = self._total_length / documents if documents else 1.0
+
+        weights = [self._idf(size, documents) for _, _, size in postings]
+        # Intersect the lists a window of the shortest one at a time, newest
+        # first: each window is one C-level set intersection, and the walk
+        # stops once max_candidates matches are found
+        order = sorted(range(len(postings)), key=lambda i: postings[i][2])
+        base_docs, _, high = postings[order[0]]
+        scored = []
+        truncated = False
+        while high > 0 and not truncated:
+            low = max(0, high - self.WINDOW)
+            window = base_docs[low:high]
+            common = set(window)
+            for i in order[1:]:
+                docs, _, size = postings[i]
+                first = bisect.bisect_left(docs, window[0], 0, size)
+                last = bisect.bisect_right(docs, window[-1], first, size)
+                if last - first > 16 * len(common):
+                    # Few candidates against a dense range: probe instead of copying it
+                    common = {doc for doc in common if self._contains(docs, doc, first, last)}
+                else:
+                    common.intersection_update(docs[first:last])
+                if not common:
+                    break
+            for doc in sorted(common, reverse=True):
+                owner = anon_ids[doc]
+                if (anon_id is not None and owner != anon_id) or doc <= dropped.get(owner, -1):
+                    continue
+                if len(scored) == self.max_candidates:
+                    truncated = True
+                    break
+                counts = []
+                for (docs, doc_counts, size), weight in zip(postings, weights):
+                    counts.append((doc_counts[bisect.bisect_left(docs, doc, 0, size)], weight))
+                scored.append((self._bm25(counts, lengths[doc], average_length), doc))
+            high = low
+
+        scored.sort(reverse=True)
+        hits = [(anon_ids[doc], positions[doc], score) for score, doc in scored[offset:offset + limit]]
+        return hits, len(scored), truncated
+
+    @staticmethod
+    def _contains(docs, doc, low, high):
+        position = bisect.bisect_left(docs, doc, low, high)
+        return position < high and docs[position] == doc
+
+    @staticmethod
+    def _idf(frequency, documents):
+        return math.log(1 + (documents - frequency + 0.5) / (frequency + 0.5))
+
+    def _bm25(self, counts, length, average_length):
+        norm = self.K1 * (1 - self.B + self.B * length / average_length)
+        return sum(weight * count * (self.K1 + 1) / (count + norm) for count, weight in counts)
+
+    def get_stats(self):
+        with self._lock:
+            return {
+                'documents': len(self._anon_ids),
+                'words': len(self._postings),
+                'dropped_conversations': len(self._dropped)
+            }
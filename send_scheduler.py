@@ -0,0 +1,281 @@
+"""
+Outbound Send Scheduler
+Keeps Bot API sends inside Telegram's flood limits with priority lanes
+"""
+
+import heapq
+import itertools
+import logging
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+# Lanes are drained in this order
+PRIORITY_HIGH = 0    # admin notifications, replies to users
+PRIORITY_NORMAL = 1  # confirmations, prompts, command answers
+PRIORITY_LOW = 2     # chat actions such as typing
+LANE_NAMES = ('high', 'normal', 'low')
+
+
+class TokenBucket:
+    __slots__ = ('rate', 'capacity', 'tokens', 'updated', 'blocked_until')
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+
+    def _refill(self, now):
+        if now > self.updated:
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+
+    def wait_time(self, now):
+        """Seconds until a token can be taken (0 when one is available)"""
+        if now < self.blocked_until:
+            return self.blocked_until - now
+        self._refill(now)
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def consume(self, now):
+        self._refill(now)
+        self.tokens -= 1
+
+    def block(self, until):
+        self.blocked_until = max(self.blocked_until, until)
+
+    def is_idle(self, now):
+        self._refill(now)
+        return self.tokens >= self.capacity and now >= self.blocked_until
+
+
+class SendJob:
+    __slots__ = ('sender', 'chat_id', 'func', 'priority', 'rate_limited', 'future', 'attempts')
+
+    def __init__(self, sender, chat_id, func, priority, rate_limited):
+        self.sender = sender
+        self.chat_id = chat_id
+        self.func = func
+        self.priority = priority
+        self.rate_limited = rate_limited
+        self.future = Future()
+        self.attempts = 0
+
+
+class _ChatQueue:
+    """Jobs for one (sender, chat_id), sent one at a time in submission order"""
+
+    __slots__ = ('jobs', 'busy', 'ticket', 'lane')
+
+    def __init__(self):
+        self.jobs = deque()
+        self.busy = False  # a job of this chat is with a worker
+        self.ticket = None  # the chat's current entry in a lane or the waiting heap
+        self.lane = None
+
+
+class OutboundScheduler:
+    """One send queue for every hosted bot
+
+    Telegram's limits apply per bot token, so each sender gets its own global
+    bucket and chat buckets are keyed by (sender, chat_id).
+
+    Each chat has a FIFO queue and at most one job in flight, so messages
+    (and a typing action before its reply) arrive in the order they were
+    submitted, 429 retries included. Lanes and the waiting heap hold chats,
+    not jobs: a chat is listed in the lane of its most urgent pending job,
+    and a chat held back by its buckets waits in a heap keyed by the time it
+    can send, so picking the next job never rescans blocked ones.
+    """
+
+    def __init__(self, global_rate=30, chat_rate=1, chat_burst=3, max_workers=8, max_retries=3):
+        self.global_rate = global_rate
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.max_retries = max_retries
+        self._global_buckets = {}  # sender -> TokenBucket
+        self._chat_buckets = {}    # (sender, chat_id) -> TokenBucket
+        self._chats = {}           # (sender, chat_id) -> _ChatQueue, while it has work
+        self._lanes = tuple(deque() for _ in LANE_NAMES)  # (key, ticket) of chats ready to send
+        self._waiting = []         # heap of (ready_at, ticket, key) for chats held back by a bucket
+        self._tickets = itertools.count()
+        self._queued = [0] * len(LANE_NAMES)  # pending jobs by priority
+        self._cond = threading.Condition()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='send')
+        self._thread = None
+
+        self.in_flight = 0
+        self.sent = 0
+        self.failed = 0
+        self.rate_limited = 0
+
+    @classmethod
+    def from_config(cls, config):
+        return cls(
+            global_rate=config.SEND_GLOBAL_RATE,
+            chat_rate=config.SEND_CHAT_RATE,
+            chat_burst=config.SEND_CHAT_BURST,
+            max_workers=config.SEND_WORKERS,
+            max_retries=config.SEND_MAX_RETRIES
+        )
+
+    def submit(self, chat_id, func, priority=PRIORITY_NORMAL, rate_limited=True, sender=None):
+        """Queue func (a Bot API call returning the decoded response) for chat_id
+
+        Returns a Future resolved with the response. rate_limited=False skips the
+        per-chat bucket, for calls such as chat actions that are not messages.
+        sender identifies the bot making the call when several share the scheduler.
+        """
+        job = SendJob(sender, chat_id, func, priority, rate_limited)
+        key = (sender, chat_id)
+        with self._cond:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='send-scheduler', daemon=True)
+                self._thread.start()
+            chat = self._chats.get(key)
+            if chat is None:
+                chat = self._chats[key] = _ChatQueue()
+            chat.jobs.append(job)
+            self._queued[priority] += 1
+            if not chat.busy and (chat.ticket is None or priority < chat.lane):
+                # Newly ready, or now more urgent: (re)list it; the old entry goes stale
+                self._enqueue(key, chat)
+            self._cond.notify()
+        return job.future
+
+    def _enqueue(self, key, chat):
+        """List a chat with pending jobs in the lane of its most urgent one; caller holds the lock"""
+        chat.ticket = next(self._tickets)
+        chat.lane = min(job.priority for job in chat.jobs)
+        self._lanes[chat.lane].append((key, chat.ticket))
+
+    def _global_bucket(self, sender):
+        bucket = self._global_buckets.get(sender)
+        if bucket is None:
+            bucket = self._global_buckets[sender] = TokenBucket(self.global_rate, self.global_rate)
+        return bucket
+
+    def _chat_bucket(self, sender, chat_id):
+        key = (sender, chat_id)
+        bucket = self._chat_buckets.get(key)
+        if bucket is None:
+            if len(self._chat_buckets) > 10000:
+                self._prune_buckets()
+            bucket = TokenBucket(self.chat_rate, self.chat_burst)
+            self._chat_buckets[key] = bucket
+        return bucket
+
+    def _prune_buckets(self):
+        now = time.monotonic()
+        for key in [k for k, b in self._chat_buckets.items() if b.is_idle(now)]:
+            del self._chat_buckets[key]
+
+    def _next_job(self, now):
+        """Pick the next job of the first ready chat, highest lane first; caller holds the lock"""
+        while self._waiting and self._waiting[0][0] <= now:
+            _, ticket, key = heapq.heappop(self._waiting)
+            chat = self._chats.get(key)
+            if chat is not None and chat.ticket == ticket:
+                self._enqueue(key, chat)
+
+        for lane in self._lanes:
+            while lane:
+                key, ticket = lane.popleft()
+                chat = self._chats.get(key)
+                if chat is None or chat.ticket != ticket:
+                    continue  # stale: relisted in a more urgent lane meanwhile
+                job = chat.jobs[0]
+                global_bucket = self._global_bucket(job.sender)
+                bucket = self._chat_bucket(job.sender, job.chat_id)
+                if job.rate_limited:
+                    job_wait = bucket.wait_time(now)
+                else:
+                    job_wait = max(bucket.blocked_until - now, 0.0)
+                job_wait = max(job_wait, global_bucket.wait_time(now))
+                if job_wait > 0:
+                    heapq.heappush(self._waiting, (now + job_wait, ticket, key))
+                    continue
+
+                chat.jobs.popleft()
+                chat.busy = True
+                chat.ticket = None
+                self._queued[job.priority] -= 1
+                if job.rate_limited:
+                    bucket.consume(now)
+                global_bucket.consume(now)
+                return job, 0.0
+        return None, (self._waiting[0][0] - now if self._waiting else None)
+
+    def _release(self, job, retry=False):
+        """The chat's job is back from its worker; let the chat's next one go. Caller holds the lock"""
+        key = (job.sender, job.chat_id)
+        chat = self._chats[key]
+        chat.busy = False
+        if retry:
+            # Ahead of the chat's later jobs, which have not been sent
+            chat.jobs.appendleft(job)
+            self._queued[job.priority] += 1
+        if chat.jobs:
+            self._enqueue(key, chat)
+            self._cond.notify()
+        else:
+            del self._chats[key]
+
+    def _run(self):
+        while True:
+            with self._cond:
+                job, wait = self._next_job(time.monotonic())
+                while job is None:
+                    self._cond.wait(timeout=wait)
+                    job, wait = self._next_job(time.monotonic())
+                self.in_flight += 1
+            self._executor.submit(self._execute, job)
+
+    def _execute(self, job):
+        try:
+            result = job.func()
+        except Exception as e:
+            with self._cond:
+                self.in_flight -= 1
+                self.failed += 1
+                self._release(job)
+            job.future.set_exception(e)
+            return
+
+        if isinstance(result, dict) and result.get('error_code') == 429 and job.attempts < self.max_retries:
+            retry_after = (result.get('parameters') or {}).get('retry_after', 1)
+            job.attempts += 1
+            with self._cond:
+                self.in_flight -= 1
+                self.rate_limited += 1
+                self._chat_bucket(job.sender, job.chat_id).block(time.monotonic() + retry_after)
+                self._release(job, retry=True)
+            logger.warning(f"Flood limit hit for chat {job.chat_id}, retrying in {retry_after}s")
+            return
+
+        with self._cond:
+            self.in_flight -= 1
+            self.sent += 1
+            self._release(job)
+        job.future.set_result(result)
+
+    def get_stats(self):
+        with self._cond:
+            depths = dict(zip(LANE_NAMES, self._queued))
+            return {
+                'queue_depth': depths,
+                'queued': sum(depths.values()),
+                'in_flight': self.in_flight,
+                'sent': self.sent,
+                'failed': self.failed,
+                'rate_limited': self.rate_limited,
+                'tracked_chats': len(self._chat_buckets),
+                'senders': len(self._global_buckets)
+            }
@@ -0,0 +1,23 @@
+"""
+Sharded Locks
+Per-key mutual exclusion from a fixed pool of locks
+"""
+
+import threading
+
+
+class ShardedLock:
+    """Maps each key to one of a fixed number of re-entrant locks
+
+    Writers to different conversations rarely share a shard, so they proceed
+    in parallel, while two writers to the same conversation always serialize.
+    """
+
+    def __init__(self, shards=64):
+        self._locks = [threading.RLock() for _ in range(shards)]
+
+    def for_key(self, key):
+        return self._locks[hash(key) % len(self._locks)]
+
+    def __len__(self):
+        return len(self._locks)
@@ -9,12 +9,29 @@ import logging
 import threading
 import time
 import asyncio
+import heapq
+from collections import OrderedDict
 from datetime import datetime
-from flask import Flask, render_template, request, jsonify
+from types import MappingProxyType
+from flask import Flask, Response, abort, g, render_template, request, jsonify, send_file
 import json
 import hashlib
-import requests
-from message_config import MessageConfig
+import hmac
+import html
+from config import get_config, namespaced_path
+from conversation_index import ActivityIndex, ActivityRing, DisplayNameIndex, decode_cursor, encode_cursor
+from maintenance import ConversationMaintenance, estimate_size
+from message_record import MessageRecord
+from live_events import EventBroker
+from message_config import MessageConfig, TemplateError
+from metrics import CONTENT_TYPE, REGISTRY
+from profiling import MODES as PROFILE_MODES, Profiler, ProfilerError, SlowUpdateLog, timed_phase
+from search_index import SearchIndex, snippet
+from sharded_lock import ShardedLock
+from storage import create_storage
+from send_scheduler import OutboundScheduler, PRIORITY_HIGH, PRIORITY_NORMAL, PRIORITY_LOW
+from telegram_transport import TelegramTransport
+from update_engine import PollError, UpdateEngine
 
 # Configure logging
 logging.basicConfig(
@@ -23,13 +40,104 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+UPDATE_DURATION = REGISTRY.histogram(
+    'bot_update_duration_seconds', 'Time spent in handle_update, by bot and update type.', ['bot', 'type'])
+UPDATE_ERRORS = REGISTRY.counter(
+    'bot_update_errors_total', 'Updates whose handler raised, by bot and update type.', ['bot', 'type'])
+POLL_BATCH_SIZE = REGISTRY.histogram(
+    'bot_poll_batch_size', 'Updates returned by one getUpdates call.', ['bot'],
+    buckets=(0, 1, 2, 5, 10, 25, 50, 100))
+POLL_LAG = REGISTRY.histogram(
+    'bot_poll_lag_seconds', 'Age of the oldest update in each getUpdates batch (1 s resolution).', ['bot'],
+    buckets=(1, 2, 5, 10, 30, 60, 120, 300, 600, 1800))
+
+# Process-wide diagnostics: on-demand profiles and the slow-update log
+profiler = Profiler.from_config(get_config())
+slow_updates = SlowUpdateLog(get_config().SLOW_UPDATE_THRESHOLD)
+
 class SimpleConversationManager:
-    def __init__(self):
+    """Users, conversations and dashboard summaries, shared by the bot and Flask threads
+
+    Writes to a conversation happen under that conversation's shard lock, so
+    ingestion for different users runs in parallel. Summary rows are replaced,
+    never mutated, and readers get them through key lookups or versioned
+    snapshots, so dashboard reads take no conversation lock.
+    """
+
+    def __init__(self, storage=None, lock_shards=64, search=True):
         self.anon_to_user = {}
         self.user_to_anon = {}
         self.conversations = {}
         self.active_conversations = {}
         self.blocked_users = set()  # Store blocked anonymous IDs
+        self.message_counts = {}  # Messages per conversation, wherever they are stored
+        self.storage = storage  # Optional persistence backend (see storage.py)
+        self.name_index = DisplayNameIndex()  # Display name -> anon_ids for admin replies
+        self.recent_activity = ActivityRing(window=86400)  # Conversations active in the last 24h
+        self.activity_index = ActivityIndex()  # Dashboard order, newest activity first
+        self.events = EventBroker()  # Live feed for open dashboard tabs
+        self.search_index = SearchIndex() if search else None  # Full-text search over message history
+        self.total_messages = 0
+        self.spill_store = None  # Set by ConversationMaintenance when spilling is enabled
+        self.spilled = set()  # anon_ids whose messages currently live in spill_store
+        self._access = OrderedDict()  # anon_id -> last access time, least recent first
+        self._shard_locks = ShardedLock(lock_shards)  # per-conversation writer locks
+        self._totals_lock = threading.Lock()
+        self._snapshot = None  # (revision, read-only copy of active_conversations)
+        self._revision = 0  # bumped on every summary change, for the snapshot
+        # Change version for delta sync. Seeded from the clock so it keeps
+        # increasing across restarts; versions below _base_version predate
+        # this process and can only be answered with a full listing.
+        self.version = time.time_ns() // 1000
+        self._changes = OrderedDict()  # anon_id -> (version, removed), oldest change first
+        self._changes_lock = threading.Lock()
+        self._shared_versions = False  # see use_shared_versions()
+
+        if self.storage is not None:
+            self.storage.load(self)
+        self._rebuild_indexes()
+        self._base_version = self.version
+
+    def _rebuild_indexes(self):
+        """Rebuild lookup structures from anon_to_user after a backend loaded it"""
+        self.name_index.clear()
+        for anon_id, user_data in self.anon_to_user.items():
+            self.name_index.set(anon_id, user_data.get('display_name'))
+        self.total_messages = sum(self.message_counts.values())
+        if self.search_index is not None:
+            self._rebuild_search_index()
+
+    def _rebuild_search_index(self):
+        """Index the history a backend loaded, oldest message first"""
+        started = time.perf_counter()
+        self.search_index.clear()
+        if self._stores_messages():
+            messages = self.storage.iter_message_text()
+        else:
+            # Merge the conversations by time so document order follows arrival order
+            messages = (
+                (anon_id, position, record.message, record.caption)
+                for _, anon_id, position, record in heapq.merge(*(
+                    ((record.ts, anon_id, position, record) for position, record in enumerate(conversation))
+                    for anon_id, conversation in self.conversations.items()
+                ), key=lambda item: item[0])
+            )
+        for anon_id, position, message, caption in messages:
+            self.search_index.add(anon_id, position, self._searchable_text(message, caption))
+        if len(self.search_index):
+            logger.info(f"Indexed {len(self.search_index)} messages for search "
+                        f"in {time.perf_counter() - started:.1f}s")
+
+    @staticmethod
+    def _searchable_text(message, caption):
+        # Photo messages already carry their caption ("[FOTO] - caption")
+        if caption and caption not in message:
+            return f"{message} {caption}"
+        return message
+
+    def _stores_messages(self):
+        """True when the backend, not self.conversations, owns message history"""
+        return self.storage is not None and self.storage.holds_messages
 
     def _generate_anon_id(self, user_id):
         salt = "anonymous_bot_salt_2025"
@@ -37,15 +145,25 @@ class SimpleConversationManager:
         hash_digest = hashlib.md5(hash_input).hexdigest()
         return f"anon_{hash_digest[:8]}"
 
+    @timed_phase('register')
     def register_user(self, user_id, username=None, display_name=None):
+        anon_id = self.user_to_anon.get(user_id) or self._generate_anon_id(user_id)
+        with self._shard_locks.for_key(anon_id):
+            return self._register_user_locked(anon_id, user_id, username, display_name)
+
+    def _register_user_locked(self, anon_id, user_id, username, display_name):
         if user_id in self.user_to_anon:
             # Update display name if provided
-            anon_id = self.user_to_anon[user_id]
             if display_name and anon_id in self.anon_to_user:
                 self.anon_to_user[anon_id]['display_name'] = display_name
+                # Other processes pick up user rows by last_activity (storage.refresh),
+                # so a rename has to move it for them to see the new name
+                self.anon_to_user[anon_id]['last_activity'] = datetime.now()
+                self.name_index.set(anon_id, display_name)
+                if self.storage is not None:
+                    self.storage.save_user(anon_id, self.anon_to_user[anon_id])
             return anon_id
 
-        anon_id = self._generate_anon_id(user_id)
         user_data = {
             'user_id': user_id,
             'username': username,
@@ -56,8 +174,12 @@ class SimpleConversationManager:
 
         self.anon_to_user[anon_id] = user_data
         self.user_to_anon[user_id] = anon_id
+        self.name_index.set(anon_id, display_name)
 
-        if anon_id not in self.conversations:
+        if self.storage is not None:
+            self.storage.save_user(anon_id, user_data)
+
+        if anon_id not in self.conversations and not self._stores_messages():
             self.conversations[anon_id] = []
 
         logger.info(f"Registered new user: {anon_id} (user_id: {user_id})")
@@ -69,48 +191,335 @@ class SimpleConversationManager:
             return user_data['display_name']
         return anon_id
 
+    def find_users_by_name(self, name):
+        """anon_ids whose display name matches exactly (after normalization)"""
+        return self.name_index.lookup(name)
+
+    def suggest_users_by_name(self, prefix):
+        """anon_ids whose display name starts with prefix, offered when nothing matches exactly"""
+        return self.name_index.prefix_lookup(prefix)
+
     def get_user_id(self, anon_id):
         user_data = self.anon_to_user.get(anon_id)
         return user_data['user_id'] if user_data else None
 
+    def _touch(self, anon_id, when=None):
+        # Callers hold anon_id's shard lock, and each OrderedDict call is a
+        # single C operation, so _access needs no lock of its own
+        self._access[anon_id] = when if when is not None else time.time()
+        self._access.move_to_end(anon_id)
+
+    def _resident_conversation(self, anon_id):
+        """The in-memory message list, transparently reloaded if it was spilled
+
+        Callers hold the conversation's shard lock.
+        """
+        conversation = self.conversations.get(anon_id)
+        if conversation is None and anon_id in self.spilled:
+            conversation = self.spill_store.read(anon_id) or []
+            self.conversations[anon_id] = conversation
+            self.spilled.discard(anon_id)
+        return conversation
+
+    @timed_phase('store')
     def add_message(self, anon_id, message_data):
-        if anon_id not in self.conversations:
-            self.conversations[anon_id] = []
-
-        self.conversations[anon_id].append(message_data)
-
-        if anon_id in self.anon_to_user:
-            self.anon_to_user[anon_id]['last_activity'] = datetime.now()
+        with self._shard_locks.for_key(anon_id):
+            if not self._stores_messages():
+                conversation = self._resident_conversation(anon_id)
+                if conversation is None:
+                    conversation = self.conversations[anon_id] = []
+
+                conversation.append(MessageRecord.from_dict(message_data))
+                self._touch(anon_id)
+            if self.storage is not None:
+                self.storage.save_message(anon_id, message_data)
+            position = self.message_counts.get(anon_id, 0)
+            if self.search_index is not None:
+                self.search_index.add(anon_id, position, self._searchable_text(
+                    message_data['message'], message_data.get('caption')))
+            self.message_counts[anon_id] = position + 1
+            with self._totals_lock:
+                self.total_messages += 1
+
+            if anon_id in self.anon_to_user:
+                self.anon_to_user[anon_id]['last_activity'] = datetime.now()
+                if self.storage is not None:
+                    self.storage.save_user(anon_id, self.anon_to_user[anon_id])
+
+            is_new = anon_id not in self.active_conversations
+            self._update_active(anon_id, message_data)
+            row = self.active_conversations[anon_id]
+
+        self._publish_activity(anon_id, is_new, row)
+
+    def _publish_activity(self, anon_id, is_new, row):
+        if self.events.active():
+            self.events.publish('new_conversation' if is_new else 'new_message', {
+                'anon_id': anon_id,
+                'conversation': row,
+                'summary': self.get_conversation_summary()
+            })
 
+    # Changes committed by other processes sharing the storage (see SQLiteStorage.refresh)
+
+    def apply_remote_user(self, anon_id, user_data):
+        with self._shard_locks.for_key(anon_id):
+            self.anon_to_user[anon_id] = user_data
+            self.user_to_anon[user_data['user_id']] = anon_id
+            self.name_index.set(anon_id, user_data.get('display_name'))
+
+    def apply_remote_blocked(self, blocked):
+        blocked_now, unblocked_now = blocked - self.blocked_users, self.blocked_users - blocked
+        self.blocked_users = blocked
+        for event, anon_ids in (('block', blocked_now), ('unblock', unblocked_now)):
+            for anon_id in anon_ids:
+                if self.events.active():
+                    self.events.publish(event, {'anon_id': anon_id, 'summary': self.get_conversation_summary()})
+
+    def apply_remote_message(self, anon_id, count, last_message, version=None):
+        """Catch a conversation up to count messages ending in last_message
+
+        version is last_message's id in the shared database, used as the
+        change version when versions are shared (see use_shared_versions).
+        """
+        with self._shard_locks.for_key(anon_id):
+            previous = self.message_counts.get(anon_id, 0)
+            if count <= previous:
+                # Already applied, usually this process's own write, which
+                # only gets its shared version now
+                if version is not None:
+                    self._record_change(anon_id, version=version)
+                return
+            if self.search_index is not None:
+                for position, (_, message) in enumerate(self.storage.get_messages_from(anon_id, previous), previous):
+                    self.search_index.add(anon_id, position, self._searchable_text(message.message, message.caption))
+            self.message_counts[anon_id] = count
+            with self._totals_lock:
+                self.total_messages += count - previous
+            is_new = anon_id not in self.active_conversations
+            self._update_active(anon_id, last_message, version)
+            row = self.active_conversations[anon_id]
+
+        self._publish_activity(anon_id, is_new, row)
+
+    def _update_active(self, anon_id, message_data, version=None):
+        """Refresh the dashboard summary row for a conversation's latest message
+
+        The row is always a new dict: readers may hold the previous one.
+        """
         self.active_conversations[anon_id] = {
             'last_message': message_data['message'][:100] + ('...' if len(message_data['message']) > 100 else ''),
             'last_activity': message_data['timestamp'],
             'direction': message_data['direction'],
             'username': self.anon_to_user.get(anon_id, {}).get('username', 'Unknown'),
             'display_name': message_data.get('display_name', self.anon_to_user.get(anon_id, {}).get('display_name', anon_id)),
-            'message_count': len(self.conversations[anon_id])
+            'message_count': self.message_counts.get(anon_id, 0)
         }
+        timestamp = message_data['timestamp'].timestamp()
+        self.recent_activity.touch(anon_id, timestamp)
+        self.activity_index.set(anon_id, timestamp)
+        self._record_change(anon_id, version=version)
+
+    def _record_change(self, anon_id, removed=False, version=None):
+        """Bump the version and move anon_id to the newest end of the change log
+
+        With shared versions a change is logged only once storage.refresh
+        reports it with its message id; until then just the snapshot moves.
+        """
+        with self._changes_lock:
+            self._revision += 1
+            if self._shared_versions:
+                if version is None:
+                    return
+                self.version = max(self.version, version)
+            else:
+                self.version += 1
+                version = self.version
+            self._changes.pop(anon_id, None)
+            self._changes[anon_id] = (version, removed)
+
+    def use_shared_versions(self, watermark):
+        """Number changes by message id in the shared database (multi-process mode)
+
+        Every process then gives the same change the same version, so a
+        ?since= cursor handed out by one process means the same to all of
+        them. watermark is the newest message id already loaded.
+        """
+        with self._changes_lock:
+            self._shared_versions = True
+            self.version = self._base_version = watermark
+            self._changes.clear()
+
+    def get_changes_since(self, since):
+        """(changed summary rows, removed anon_ids, version) after since, or None if since is too old
+
+        Walks the change log from the newest end, so the cost is proportional
+        to the number of changes, not the number of conversations.
+        """
+        if since < self._base_version:
+            return None
+        changed, removed = [], []
+        with self._changes_lock:
+            version = self.version
+            for anon_id, (changed_at, is_removed) in reversed(self._changes.items()):
+                if changed_at <= since:
+                    break
+                (removed if is_removed else changed).append(anon_id)
+        rows = [(anon_id, self.active_conversations[anon_id])
+                for anon_id in changed if anon_id in self.active_conversations]
+        return rows, removed, version
+
+    def _rebuild_summaries(self):
+        """Recompute counts and summary rows after a backend restored self.conversations"""
+        loaded = []
+        for anon_id, conversation in self.conversations.items():
+            self.message_counts[anon_id] = len(conversation)
+            if conversation:
+                self._update_active(anon_id, conversation[-1])
+                loaded.append((conversation[-1]['timestamp'].timestamp(), anon_id))
+        # Seed LRU order from message times so long-idle history is released first
+        for last_activity, anon_id in sorted(loaded):
+            self._touch(anon_id, last_activity)
 
     def get_conversation(self, anon_id):
-        return self.conversations.get(anon_id, [])
+        if self._stores_messages():
+            return self.storage.get_messages(anon_id)
+        with self._shard_locks.for_key(anon_id):
+            conversation = self._resident_conversation(anon_id)
+            if conversation is None:
+                return []
+            self._touch(anon_id)
+            return conversation
+
+    def get_conversation_page(self, anon_id, before=None, after=None, limit=50):
+        """Up to limit (cursor, message) pairs older than before or newer than after, oldest first
+
+        Without either cursor this is the newest page. Cursors are message
+        positions in memory and row ids in SQLite; callers treat them as opaque.
+        """
+        if self._stores_messages():
+            return self.storage.get_messages_page(anon_id, before, after, limit)
+        with self._shard_locks.for_key(anon_id):
+            conversation = self._resident_conversation(anon_id)
+            if conversation is None:
+                return []
+            self._touch(anon_id)
+            if after is not None:
+                start = max(after + 1, 0)
+                end = min(start + limit, len(conversation))
+            else:
+                end = len(conversation) if before is None else max(min(before, len(conversation)), 0)
+                start = max(end - limit, 0)
+            return [(position, conversation[position]) for position in range(start, end)]
+
+    @timed_phase('search')
+    def search_messages(self, query, offset=0, limit=20, anon_id=None):
+        """Ranked (anon_id, cursor, message, score) matches for query, with the total and a truncated flag
+
+        Cursors are those of get_conversation_page, so a hit can be opened
+        in the history viewer.
+        """
+        if self.search_index is None:
+            return [], 0, False
+        hits, total, truncated = self.search_index.search(query, offset, limit, anon_id)
+        spilled = {}  # spilled conversations read for this query, left on disk
+        results = []
+        for hit_anon_id, position, score in hits:
+            found = self._message_at(hit_anon_id, position, spilled)
+            if found is not None:
+                results.append((hit_anon_id, found[0], found[1], score))
+        return results, total, truncated
+
+    def _message_at(self, anon_id, position, spilled):
+        if self._stores_messages():
+            page = self.storage.get_messages_from(anon_id, position, 1)
+            return page[0] if page else None
+        with self._shard_locks.for_key(anon_id):
+            conversation = self.conversations.get(anon_id)
+            if conversation is None and anon_id in self.spilled:
+                if anon_id not in spilled:
+                    spilled[anon_id] = self.spill_store.read(anon_id) or []
+                conversation = spilled[anon_id]
+            if conversation is None or position >= len(conversation):
+                return None
+            return position, conversation[position]
+
+    def resident_count(self):
+        """Conversations with messages currently held in memory"""
+        return len(self._access)
+
+    def idle_conversations(self, cutoff):
+        """Resident anon_ids not accessed since the epoch time cutoff"""
+        idle = []
+        # Iterate a copy: writers keep reordering _access meanwhile
+        for anon_id, last_access in list(self._access.items()):
+            if last_access >= cutoff:
+                break
+            idle.append(anon_id)
+        return idle
+
+    def least_recently_used(self, count):
+        if count <= 0:
+            return []
+        return list(self._access)[:count]
+
+    def spill_conversation(self, anon_id):
+        """Move a conversation's messages to disk; returns the bytes released"""
+        with self._shard_locks.for_key(anon_id):
+            conversation = self.conversations.get(anon_id)
+            if conversation is None or self.spill_store is None:
+                return None
+            self.spill_store.write(anon_id, conversation)
+            self.spilled.add(anon_id)
+            del self.conversations[anon_id]
+            self._access.pop(anon_id, None)
+        return estimate_size(conversation)
+
+    def evict_conversation(self, anon_id):
+        """Drop a conversation's messages and summary; returns the bytes released"""
+        with self._shard_locks.for_key(anon_id):
+            conversation = self.conversations.pop(anon_id, None)
+            if conversation is None:
+                return None
+            self._access.pop(anon_id, None)
+            self.active_conversations.pop(anon_id, None)
+            self.recent_activity.remove(anon_id)
+            if self.search_index is not None:
+                self.search_index.remove_conversation(anon_id)
+            self.activity_index.remove(anon_id)
+            with self._totals_lock:
+                self.total_messages -= self.message_counts.pop(anon_id, 0)
+            self._record_change(anon_id, removed=True)
+            if self.storage is not None:
+                self.storage.drop_conversation(anon_id)
+        logger.info(f"Evicted idle conversation: {anon_id}")
+        return estimate_size(conversation)
 
     def get_active_conversations(self):
-        return self.active_conversations
+        """Read-only snapshot of the summary rows, copied again only after a change
+
+        Safe to iterate while messages keep arriving; the live dict is not.
+        """
+        snapshot = self._snapshot
+        if snapshot is None or snapshot[0] != self._revision:
+            revision = self._revision
+            # dict(d) is a single C-level copy, atomic with respect to writers
+            snapshot = self._snapshot = (revision, MappingProxyType(dict(self.active_conversations)))
+        return snapshot[1]
+
+    def get_conversations_page(self, cursor=None, limit=50):
+        """One page of (anon_id, summary row) by latest activity, and the next page's cursor"""
+        anon_ids, next_key = self.activity_index.page(decode_cursor(cursor), limit)
+        page = [(anon_id, self.active_conversations[anon_id])
+                for anon_id in anon_ids if anon_id in self.active_conversations]
+        return page, encode_cursor(next_key) if next_key else None
 
     def get_conversation_summary(self):
-        total_conversations = len(self.active_conversations)
-        total_messages = sum(len(conv) for conv in self.conversations.values())
-
-        recent_activity = 0
-        for conv_data in self.active_conversations.values():
-            time_diff = datetime.now() - conv_data['last_activity']
-            if time_diff.total_seconds() < 86400:
-                recent_activity += 1
-
+        # Every figure is maintained incrementally, so this is O(1)
         return {
-            'total_conversations': total_conversations,
-            'total_messages': total_messages,
-            'recent_activity': recent_activity,
+            'total_conversations': len(self.active_conversations),
+            'total_messages': self.total_messages,
+            'recent_activity': self.recent_activity.count(time.time()),
             'registered_users': len(self.anon_to_user),
             'blocked_users': len(self.blocked_users)
         }
@@ -118,12 +527,20 @@ class SimpleConversationManager:
     def block_user(self, anon_id):
         """Block a user by their anonymous ID"""
         self.blocked_users.add(anon_id)
+        if self.storage is not None:
+            self.storage.set_blocked(anon_id, True)
+        if self.events.active():
+            self.events.publish('block', {'anon_id': anon_id, 'summary': self.get_conversation_summary()})
         logger.info(f"Blocked user: {anon_id}")
         return True
 
     def unblock_user(self, anon_id):
         """Unblock a user by their anonymous ID"""
         self.blocked_users.discard(anon_id)
+        if self.storage is not None:
+            self.storage.set_blocked(anon_id, False)
+        if self.events.active():
+            self.events.publish('unblock', {'anon_id': anon_id, 'summary': self.get_conversation_summary()})
         logger.info(f"Unblocked user: {anon_id}")
         return True
 
@@ -132,47 +549,94 @@ class SimpleConversationManager:
         return anon_id in self.blocked_users
 
 class SimpleTelegramBot:
-    def __init__(self, bot_token, admin_chat_id, conversation_manager):
+    def __init__(self, bot_token, admin_chat_id, conversation_manager, transport=None, scheduler=None,
+                 bot_id='default', message_config=None):
+        self.config = get_config()
+        self.bot_id = bot_id
         self.bot_token = bot_token
         self.admin_chat_id = admin_chat_id
         self.conversation_manager = conversation_manager
-        self.base_url = f"https://api.telegram.org/bot{bot_token}"
+        self.base_url = f"{self.config.TELEGRAM_API_URL}/bot{bot_token}"
         self.last_update_id = 0
+        self.poll_timeout = self.config.POLL_TIMEOUT  # shortened in multi-process mode
         self.pending_replies = []
         self.waiting_for_name = {}  # Track users setting their display name
         self.admin_typing_for = {}  # Track when admin is typing to specific users
-        self.message_config = MessageConfig()  # Initialize message configuration
+        self.message_config = message_config or MessageConfig()  # Initialize message configuration
         self.admin_editing_message = {}  # Track admin editing messages
+        self.transport = transport or TelegramTransport.from_config(self.config)
+        self.scheduler = scheduler or OutboundScheduler.from_config(self.config)
+        self.update_mode = None
+        self.engine = UpdateEngine(
+            self,
+            max_concurrent=self.config.MAX_CONCURRENT_UPDATES,
+            max_pending_per_chat=self.config.MAX_PENDING_PER_CHAT
+        )
 
-    def send_typing_action(self, chat_id):
-        """Send typing action to show the bot is typing"""
+    def _schedule(self, method, data, priority, rate_limited=True, files=None):
+        """Queue a Bot API call on the outbound scheduler and return its Future"""
+        url = f"{self.base_url}/{method}"
+        if files:
+            call = lambda: self.transport.post(url, data=data, files=files)
+        else:
+            call = lambda: self.transport.post(url, data=data)
+        return self.scheduler.submit(
+            data['chat_id'],
+            call,
+            priority=priority,
+            rate_limited=rate_limited,
+            sender=self.bot_id
+        )
+
+    @staticmethod
+    @timed_phase('api_wait')
+    def _delivered(future, error_label):
+        """Block on a scheduled call and reduce it to the Bot API 'ok' flag"""
         try:
-            response = requests.post(f"{self.base_url}/sendChatAction", {
-                'chat_id': chat_id,
-                'action': 'typing'
-            })
-            return response.json().get('ok', False)
+            return future.result().get('ok', False)
         except Exception as e:
-            logger.error(f"Error sending typing action: {e}")
+            logger.error(f"{error_label}: {e}")
             return False
 
-    def send_message(self, chat_id, text, parse_mode='HTML'):
-        url = f"{self.base_url}/sendMessage"
+    def _after_delivery(self, future, on_success, on_failure):
+        """Run one of two callbacks once a scheduled call completes, without blocking"""
+        def done(f):
+            try:
+                ok = f.result().get('ok', False)
+            except Exception as e:
+                logger.error(f"Delivery failed: {e}")
+                ok = False
+            try:
+                (on_success if ok else on_failure)()
+            except Exception as e:
+                logger.error(f"Error in delivery callback: {e}")
+        future.add_done_callback(done)
+
+    def send_typing_action_async(self, chat_id, priority=PRIORITY_LOW):
+        return self._schedule('sendChatAction', {
+            'chat_id': chat_id,
+            'action': 'typing'
+        }, priority, rate_limited=False)
+
+    def send_typing_action(self, chat_id):
+        """Send typing action to show the bot is typing"""
+        return self._delivered(self.send_typing_action_async(chat_id), "Error sending typing action")
+
+    def send_message_async(self, chat_id, text, parse_mode='HTML', priority=None):
+        """Queue a message without waiting; returns a Future of the API response"""
         data = {
             'chat_id': chat_id,
             'text': text,
             'parse_mode': parse_mode
         }
-        try:
-            response = requests.post(url, data=data)
-            return response.json().get('ok', False)
-        except Exception as e:
-            logger.error(f"Error sending message: {e}")
-            return False
+        if priority is None:
+            priority = PRIORITY_HIGH if chat_id == self.admin_chat_id else PRIORITY_NORMAL
+        return self._schedule('sendMessage', data, priority)
 
-    def send_photo(self, chat_id, photo_file_id, caption=None):
-        """Send a photo using file_id"""
-        url = f"{self.base_url}/sendPhoto"
+    def send_message(self, chat_id, text, parse_mode='HTML', priority=None):
+        return self._delivered(self.send_message_async(chat_id, text, parse_mode, priority), "Error sending message")
+
+    def send_photo_async(self, chat_id, photo_file_id, caption=None):
         data = {
             'chat_id': chat_id,
             'photo': photo_file_id
@@ -180,26 +644,106 @@ class SimpleTelegramBot:
         if caption:
             data['caption'] = caption
 
-        try:
-            response = requests.post(url, data=data)
-            return response.json().get('ok', False)
-        except Exception as e:
-            logger.error(f"Error sending photo: {e}")
-            return False
+        priority = PRIORITY_HIGH if chat_id == self.admin_chat_id else PRIORITY_NORMAL
+        return self._schedule('sendPhoto', data, priority)
+
+    def send_document_async(self, chat_id, filename, content, caption=None):
+        """Upload bytes as a file attachment"""
+        data = {'chat_id': chat_id}
+        if caption:
+            data['caption'] = caption
+        return self._schedule('sendDocument', data, PRIORITY_NORMAL, files={'document': (filename, content)})
+
+    def send_photo(self, chat_id, photo_file_id, caption=None):
+        """Send a photo using file_id"""
+        return self._delivered(self.send_photo_async(chat_id, photo_file_id, caption), "Error sending photo")
 
     def get_updates(self):
         url = f"{self.base_url}/getUpdates"
-        params = {'offset': self.last_update_id + 1, 'timeout': 30}
+        params = {'offset': self.last_update_id + 1, 'timeout': self.poll_timeout}
+        try:
+            # The read timeout must outlast the long poll itself
+            data = self.transport.get(url, params=params, read_timeout=self.poll_timeout + 10)
+        except Exception as e:
+            raise PollError(f"getUpdates failed: {e}") from e
+        if not data.get('ok'):
+            # The engine backs off; 401 (bad token) and 409 (a webhook or another
+            # poller) come back instantly and would otherwise be retried in a loop
+            raise PollError(f"getUpdates failed: {data.get('error_code')} {data.get('description', '')}".rstrip(),
+                            (data.get('parameters') or {}).get('retry_after'))
+
+        updates = data.get('result', [])
+        POLL_BATCH_SIZE.labels(self.bot_id).observe(len(updates))
+        if updates:
+            sent_at = (updates[0].get('message') or {}).get('date')
+            if sent_at:
+                POLL_LAG.labels(self.bot_id).observe(max(time.time() - sent_at, 0.0))
+        return updates
+
+    def get_webhook_secret(self):
+        """Secret for the webhook path and header; stable across restarts and unique per bot"""
+        if self.config.WEBHOOK_SECRET:
+            if self.bot_id == 'default':
+                return self.config.WEBHOOK_SECRET
+            return hmac.new(self.config.WEBHOOK_SECRET.encode('utf-8'), self.bot_id.encode('utf-8'),
+                            hashlib.sha256).hexdigest()[:32]
+        return hashlib.sha256(f"webhook_{self.bot_token}".encode('utf-8')).hexdigest()[:32]
+
+    def set_webhook(self, public_url):
+        url = f"{public_url.rstrip('/')}/telegram/webhook/{self.get_webhook_secret()}"
+        try:
+            response = self.transport.post(f"{self.base_url}/setWebhook", {
+                'url': url,
+                'secret_token': self.get_webhook_secret(),
+                'allowed_updates': json.dumps(['message'])
+            })
+            if response.get('ok'):
+                logger.info("Webhook registered")
+                return True
+            logger.error(f"Error setting webhook: {response.get('description')}")
+        except Exception as e:
+            logger.error(f"Error setting webhook: {e}")
+        return False
+
+    def delete_webhook(self):
+        """Remove any webhook so getUpdates is allowed again"""
         try:
-            response = requests.get(url, params=params)
-            data = response.json()
-            if data.get('ok'):
-                return data.get('result', [])
+            response = self.transport.post(f"{self.base_url}/deleteWebhook", {})
+            return response.get('ok', False)
         except Exception as e:
-            logger.error(f"Error getting updates: {e}")
-        return []
+            logger.error(f"Error deleting webhook: {e}")
+            return False
+
+    def update_type(self, update):
+        """Metrics label for an update: admin, command, photo, text or other"""
+        message = update.get('message')
+        if message is None:
+            return 'other'
+        if message.get('from', {}).get('id') == self.admin_chat_id:
+            return 'admin'
+        if message.get('photo'):
+            return 'photo'
+        text = message.get('text')
+        if not text:
+            return 'other'
+        return 'command' if text.startswith('/') else 'text'
 
     def handle_update(self, update):
+        started = time.perf_counter()
+        slow_updates.start()
+        try:
+            with profiler.section():
+                self._handle_update(update)
+        except Exception:
+            UPDATE_ERRORS.labels(self.bot_id, self.update_type(update)).inc()
+            raise
+        finally:
+            elapsed = time.perf_counter() - started
+            update_type = self.update_type(update)
+            UPDATE_DURATION.labels(self.bot_id, update_type).observe(elapsed)
+            slow_updates.finish(self.bot_id, update_type, update.get('update_id'), elapsed)
+
+    def _handle_update(self, update):
         if 'message' not in update:
             return
 
@@ -220,6 +764,12 @@ class SimpleTelegramBot:
             if self.conversation_manager.unblock_user(anon_id):
                 self.send_message(user_id, self.message_config.get_message('user_unblocked', anon_id=anon_id))
             return
+        elif user_id == self.admin_chat_id and (text == '/search' or text.startswith('/search ')):
+            self.handle_admin_search(user_id, text[len('/search'):].strip())
+            return
+        elif user_id == self.admin_chat_id and (text == '/profile' or text.startswith('/profile ')):
+            self.handle_admin_profile(user_id, text[len('/profile'):].split())
+            return
         elif user_id == self.admin_chat_id and text.startswith('/editmsg'):
             self.handle_admin_edit_message(user_id, text)
             return
@@ -330,10 +880,108 @@ Use sempre a URL automática do Replit."""
             caption_text=caption_text
         )
 
-        if self.send_photo(self.admin_chat_id, file_id, admin_caption):
-            self.send_message(user_id, self.message_config.get_message('photo_sent'))
-        else:
-            self.send_message(user_id, self.message_config.get_message('photo_error'))
+        # The confirmation goes out as soon as the admin copy is accepted;
+        # the handler itself does not wait for either call
+        self._after_delivery(
+            self.send_photo_async(self.admin_chat_id, file_id, admin_caption),
+            lambda: self.send_message_async(user_id, self.message_config.get_message('photo_sent')),
+            lambda: self.send_message_async(user_id, self.message_config.get_message('photo_error'))
+        )
+
+    def _send_name_candidates(self, user_id, message_key, identifier, anon_ids):
+        """List users the admin may have meant by identifier, with their anon_ids"""
+        candidates = '\n'.join(
+            f"• {html.escape(self.conversation_manager.get_display_name(anon_id))} (<code>{anon_id}</code>)"
+            for anon_id in anon_ids
+        )
+        self.send_message(user_id, self.message_config.get_message(message_key,
+            identifier=html.escape(identifier), candidates=candidates))
+
+    def handle_admin_search(self, user_id, query, limit=10):
+        """Reply with the best matches for query across all conversations"""
+        if not query:
+            self.send_message(user_id, "🔍 Uso: <code>/search palavras</code>")
+            return
+
+        results, total, truncated = self.conversation_manager.search_messages(query, limit=limit)
+        if not results:
+            self.send_message(user_id, f"🔍 Nenhuma mensagem encontrada para <b>{html.escape(query)}</b>.")
+            return
+
+        lines = [f"🔍 <b>{total}{'+' if truncated else ''} resultado(s) para</b> <i>{html.escape(query)}</i>\n"]
+        for anon_id, _, message, _ in results:
+            lines.append(
+                f"• <b>{html.escape(self.conversation_manager.get_display_name(anon_id))}</b> "
+                f"(<code>{anon_id}</code>) {message.timestamp.strftime('%d/%m/%Y %H:%M')}\n"
+                f"{html.escape(snippet(message['message'], query))}"
+            )
+        if total > len(results):
+            lines.append(f"\n… e mais {total - len(results)}. Use a busca do painel web para ver todos.")
+        self.send_message(user_id, '\n'.join(lines))
+
+    def handle_admin_profile(self, user_id, args):
+        """Start, stop or show on-demand profiling; the profile file is sent when it ends"""
+        command = args[0].lower() if args else ''
+
+        if command == 'stop':
+            # Also delivers profiles started from /api/profile/start
+            stopped = profiler.stop(on_done=lambda result: self._send_profile(user_id, result))
+            if not stopped:
+                self.send_message(user_id, "ℹ️ Nenhum perfil em andamento.")
+            else:
+                self.send_message(user_id, f"⏹️ Perfil <b>{stopped['mode']}</b> encerrado. O arquivo será enviado aqui.")
+            return
+
+        if command == 'slow':
+            entries = slow_updates.get_recent(10)
+            if not entries:
+                self.send_message(user_id, f"🐢 Nenhum update acima de {slow_updates.threshold:g} s registrado.")
+                return
+            lines = [f"🐢 <b>Updates lentos</b> (limite {slow_updates.threshold:g} s)\n"]
+            for entry in entries:
+                phases = ', '.join(f"{name} {phase['ms']:.0f} ms" for name, phase in entry['phases'].items())
+                lines.append(f"• {entry['time'][11:]} {entry['type']} ({entry['bot']}): <b>{entry['total_ms']:.0f} ms</b>"
+                             f" — {phases + ', ' if phases else ''}outros {entry['other_ms']:.0f} ms")
+            self.send_message(user_id, '\n'.join(lines))
+            return
+
+        if command not in PROFILE_MODES:
+            status = profiler.get_status()['running']
+            running = (f"⏳ Perfil <b>{status['mode']}</b> em andamento, faltam {status['remaining']:.0f} s.\n\n"
+                       if status else "")
+            self.send_message(user_id, running +
+                "🧪 <b>Perfilamento</b>\n\n"
+                "<code>/profile cpu 30</code> - cProfile dos handlers por 30 s\n"
+                "<code>/profile sample 30</code> - amostragem de pilhas de todas as threads\n"
+                "<code>/profile memory 60</code> - diferença de alocações (tracemalloc)\n"
+                "<code>/profile stop</code> - encerrar antes do tempo\n"
+                "<code>/profile slow</code> - últimos updates lentos")
+            return
+
+        try:
+            seconds = int(args[1]) if len(args) > 1 else 30
+        except ValueError:
+            self.send_message(user_id, "❌ Duração inválida. Exemplo: <code>/profile cpu 30</code>")
+            return
+        try:
+            profiler.start(command, seconds, on_done=lambda result: self._send_profile(user_id, result))
+        except ProfilerError as e:
+            self.send_message(user_id, f"❌ Não foi possível iniciar o perfil: {html.escape(str(e))}")
+            return
+        self.send_message(user_id, f"🧪 Perfil <b>{command}</b> iniciado por {seconds} s. O arquivo será enviado aqui.")
+
+    def _send_profile(self, user_id, result):
+        path = profiler.result_path(result['name'])
+        with open(path, 'rb') as f:
+            content = f.read()
+        caption = f"🧪 Perfil {result['mode']} ({result['seconds']:g} s)"
+        # Telegram refuses empty files
+        if content:
+            self.send_document_async(user_id, result['name'], content, caption)
+        summary = result['summary']
+        if len(summary) > 3500:
+            summary = summary[:3500] + '\n…'
+        self.send_message_async(user_id, f"{caption}\n<pre>{html.escape(summary)}</pre>")
 
     def handle_admin_edit_message(self, user_id, text):
         """Handle admin message editing commands"""
@@ -394,21 +1042,31 @@ Para editar as mensagens do bot de forma mais fácil e intuitiva, acesse a inter
                         anon_id = identifier
                         target_user_id = self.conversation_manager.get_user_id(anon_id)
                     else:
-                        # Search by display name
-                        for anon_id_key, user_data in self.conversation_manager.anon_to_user.items():
-                            if user_data.get('display_name') == identifier:
-                                anon_id = anon_id_key
-                                target_user_id = user_data['user_id']
-                                break
+                        # Search by display name; only an exact match is replied to, a
+                        # prefix (e.g. "Obs: ...") merely lists who the admin may have meant
+                        matches = self.conversation_manager.find_users_by_name(identifier)
+                        if len(matches) > 1:
+                            self._send_name_candidates(user_id, 'user_ambiguous', identifier, matches)
+                            return
+                        if not matches:
+                            suggestions = self.conversation_manager.suggest_users_by_name(identifier)
+                            if suggestions:
+                                self._send_name_candidates(user_id, 'user_suggestions', identifier, suggestions)
+                                return
+                        if matches:
+                            anon_id = matches[0]
+                            target_user_id = self.conversation_manager.get_user_id(anon_id)
 
                     if target_user_id and anon_id:
-                        # Send typing indicator to user while admin is typing
-                        self.send_typing_action(target_user_id)
-                        if self.send_reply_to_user(target_user_id, reply_message, anon_id):
-                            display_name = self.conversation_manager.get_display_name(anon_id)
-                            self.send_message(user_id, self.message_config.get_message('reply_sent', display_name=display_name))
-                        else:
-                            self.send_message(user_id, self.message_config.get_message('reply_failed', identifier=identifier))
+                        # Typing indicator first: the scheduler sends a chat's calls one at
+                        # a time in submission order, so it cannot arrive after the reply
+                        self.send_typing_action_async(target_user_id, PRIORITY_HIGH)
+                        display_name = self.conversation_manager.get_display_name(anon_id)
+                        self._after_delivery(
+                            self.send_reply_to_user_async(target_user_id, reply_message, anon_id),
+                            lambda: self.send_message_async(user_id, self.message_config.get_message('reply_sent', display_name=display_name)),
+                            lambda: self.send_message_async(user_id, self.message_config.get_message('reply_failed', identifier=identifier))
+                        )
                     else:
                         self.send_message(user_id, self.message_config.get_message('user_not_found', identifier=identifier))
                 else:
@@ -451,42 +1109,46 @@ Para editar as mensagens do bot de forma mais fácil e intuitiva, acesse a inter
             message=text
         )
 
-        if self.send_message(self.admin_chat_id, admin_message):
-            self.send_message(user_id, self.message_config.get_message('message_sent'))
-        else:
-            self.send_message(user_id, self.message_config.get_message('send_error'))
+        self._after_delivery(
+            self.send_message_async(self.admin_chat_id, admin_message),
+            lambda: self.send_message_async(user_id, self.message_config.get_message('message_sent')),
+            lambda: self.send_message_async(user_id, self.message_config.get_message('send_error'))
+        )
 
-    def send_reply_to_user(self, user_id, message, anon_id):
-        try:
-            message_data = {
-                'timestamp': datetime.now(),
-                'anon_id': anon_id,
-                'user_id': user_id,
-                'message': message,
-                'direction': 'outgoing'
-            }
+    def send_reply_to_user_async(self, user_id, message, anon_id):
+        message_data = {
+            'timestamp': datetime.now(),
+            'anon_id': anon_id,
+            'user_id': user_id,
+            'message': message,
+            'direction': 'outgoing'
+        }
+
+        self.conversation_manager.add_message(anon_id, message_data)
 
-            self.conversation_manager.add_message(anon_id, message_data)
+        user_message = message
 
-            user_message = message
+        return self.send_message_async(user_id, user_message, priority=PRIORITY_HIGH)
 
-            return self.send_message(user_id, user_message)
+    def send_reply_to_user(self, user_id, message, anon_id):
+        try:
+            future = self.send_reply_to_user_async(user_id, message, anon_id)
         except Exception as e:
             logger.error(f"Failed to send reply to user {user_id}: {e}")
             return False
+        return self._delivered(future, f"Failed to send reply to user {user_id}")
 
     def run(self):
-        logger.info("Starting bot polling...")
-        while True:
-            try:
-                updates = self.get_updates()
-                for update in updates:
-                    self.last_update_id = update['update_id']
-                    self.handle_update(update)
-                time.sleep(1)
-            except Exception as e:
-                logger.error(f"Error in bot loop: {e}")
-                time.sleep(5)
+        mode = self.config.UPDATE_MODE
+        if mode == 'webhook':
+            if not self.config.WEBHOOK_URL or not self.set_webhook(self.config.WEBHOOK_URL):
+                logger.warning("Webhook unavailable, falling back to long polling")
+                mode = 'polling'
+        if mode != 'webhook':
+            self.delete_webhook()
+            mode = 'polling'
+        self.update_mode = mode
+        self.engine.run(mode)
 
     def handle_admin_help(self, user_id):
         """Show admin help message"""
@@ -514,43 +1176,209 @@ Para editar as mensagens do bot de forma mais fácil e intuitiva, acesse a inter
 
         return self.send_message(user_id, message)
 
-# Global instances
-conversation_manager = SimpleConversationManager()
+class BotTenant:
+    """One hosted bot: its token, admin, message texts and conversation namespace
+
+    Tenants share the process, the Bot API transport and the outbound
+    scheduler; everything a bot's users can see or change is kept apart.
+    """
+
+    def __init__(self, bot_id, token, admin_chat_id, config=None):
+        config = config or get_config()
+        self.bot_id = bot_id
+        self.token = token
+        self.admin_chat_id = admin_chat_id
+        # The default bot keeps the original file names
+        self.namespace = None if bot_id == 'default' else bot_id
+        self.manager = SimpleConversationManager(storage=create_storage(config, self.namespace))
+        self.maintenance = ConversationMaintenance.from_config(self.manager, config, self.namespace)
+        self.bot = None
+        self.lease = None  # Set in multi-process mode (see start_multiprocess)
+
+    def create_bot(self, transport=None, scheduler=None):
+        config = get_config()
+        admin_chat_id = int(self.admin_chat_id) if self.admin_chat_id else self.admin_chat_id
+        message_config = MessageConfig(
+            namespaced_path('bot_messages.json', self.namespace),
+            save_delay=config.MESSAGES_SAVE_DELAY,
+            reload_interval=config.MESSAGES_RELOAD_INTERVAL
+        )
+        self.bot = SimpleTelegramBot(self.token, admin_chat_id, self.manager, transport, scheduler,
+                                     bot_id=self.bot_id, message_config=message_config)
+        return self.bot
+
+def load_tenants():
+    """bot_id -> BotTenant for every configured bot, in configuration order"""
+    try:
+        bots = get_config().get_bots()
+    except (OSError, ValueError) as e:
+        logger.error(f"Invalid bot configuration: {e}")
+        return {}
+    return {entry['id']: BotTenant(entry['id'], entry['token'], entry['admin_chat_id']) for entry in bots}
+
+# Global instances, filled in by use_tenants() when the process starts serving
+# (importing this module must not open databases or touch spilled data)
+tenants = {}
+default_tenant = None  # served by the unprefixed dashboard routes
+# The first bot's components, under the names used before multi-bot hosting
+conversation_manager = None
+maintenance = None
 bot = None
+leader_lease = None  # The first bot's lease in multi-process mode (see start_multiprocess)
+
+def use_tenants(hosted):
+    """Serve the given bot_id -> BotTenant mapping; the first one answers the unprefixed routes"""
+    global tenants, default_tenant, conversation_manager, maintenance
+    tenants = hosted
+    default_tenant = next(iter(tenants.values()), None)
+    conversation_manager = default_tenant.manager if default_tenant else None
+    maintenance = default_tenant.maintenance if default_tenant else None
+    return tenants
+
+def collect_bot_metrics():
+    """Gauges read from counters the bots already keep, only when /metrics is scraped"""
+    gauges = {
+        'bot_conversations': ('Conversations with a dashboard summary.', []),
+        'bot_resident_conversations': ('Conversations whose messages are held in memory.', []),
+        'bot_messages': ('Messages stored across all conversations.', []),
+        'bot_users': ('Registered users.', []),
+        'bot_blocked_users': ('Users blocked by the admin.', []),
+        'bot_updates_in_flight': ('Updates being handled right now.', []),
+        'bot_updates_pending': ('Updates queued behind earlier ones from the same chat.', []),
+    }
+    for bot_id, tenant in tenants.items():
+        labels = {'bot': bot_id}
+        manager = tenant.manager
+        gauges['bot_conversations'][1].append((labels, len(manager.active_conversations)))
+        gauges['bot_resident_conversations'][1].append((labels, manager.resident_count()))
+        gauges['bot_messages'][1].append((labels, manager.total_messages))
+        gauges['bot_users'][1].append((labels, len(manager.anon_to_user)))
+        gauges['bot_blocked_users'][1].append((labels, len(manager.blocked_users)))
+        if tenant.bot:
+            engine = tenant.bot.engine.get_stats()
+            gauges['bot_updates_in_flight'][1].append((labels, engine['in_flight']))
+            gauges['bot_updates_pending'][1].append((labels, engine['pending']))
+    families = [(name, 'gauge', documentation, samples) for name, (documentation, samples) in gauges.items()]
+
+    if bot:
+        # One scheduler serves every bot
+        stats = bot.scheduler.get_stats()
+        families.append(('bot_send_queue_depth', 'gauge', 'Sends waiting in the outbound scheduler, by lane.',
+                         [({'lane': lane}, depth) for lane, depth in stats['queue_depth'].items()]))
+        families.append(('bot_sends_in_flight', 'gauge', 'Sends being executed right now.',
+                         [({}, stats['in_flight'])]))
+        families.append(('bot_sends_total', 'counter', 'Scheduled sends by outcome; rate_limited counts 429 retries.',
+                         [({'result': result}, stats[result]) for result in ('sent', 'failed', 'rate_limited')]))
+    return families
+
+REGISTRY.register_collector(collect_bot_metrics)
 
 # Flask app
 app = Flask(__name__)
 app.secret_key = 'anonymous_bot_secret_key_2025'
-
-@app.route('/')
+app.json.sort_keys = False  # /api/conversations lists conversations newest first, keyed by anon_id
+
+def tenant_route(rule, **options):
+    """Register a dashboard view for the default bot at rule and for every bot under /bots/<bot_id>"""
+    def decorator(view):
+        app.add_url_rule(rule, view.__name__, view, defaults={'bot_id': None}, **options)
+        app.add_url_rule(f'/bots/<bot_id>{rule}', view.__name__, view, **options)
+        return view
+    return decorator
+
+@app.url_value_preprocessor
+def pull_tenant(endpoint, values):
+    """Resolve the bot a dashboard request is for into g.tenant"""
+    if not values or 'bot_id' not in values:
+        return
+    bot_id = values.pop('bot_id')
+    tenant = default_tenant if bot_id is None else tenants.get(bot_id)
+    if tenant is None:
+        abort(404)
+    g.bot_id = bot_id
+    g.tenant = tenant
+
+@app.url_defaults
+def add_bot_id(endpoint, values):
+    # Links rendered for one bot stay under that bot's prefix
+    if 'bot_id' not in values and g.get('bot_id') and app.url_map.is_endpoint_expecting(endpoint, 'bot_id'):
+        values['bot_id'] = g.bot_id
+
+@app.context_processor
+def inject_tenants():
+    current = g.get('tenant')
+    return {'bot_ids': list(tenants), 'current_bot_id': current.bot_id if current else None}
+
+@app.before_request
+def start_request_profile():
+    # During a cpu profile, dashboard requests are profiled alongside the
+    # update handlers; the event stream would hold its section open for good
+    if request.endpoint != 'api_events':
+        g.profile_section = profiler.section()
+        g.profile_section.__enter__()
+
+@app.teardown_request
+def end_request_profile(error=None):
+    section = g.pop('profile_section', None)
+    if section is not None:
+        section.__exit__(None, None, None)
+
+@tenant_route('/')
 def index():
-    summary = conversation_manager.get_conversation_summary()
-    active_conversations = conversation_manager.get_active_conversations()
-
-    sorted_conversations = dict(sorted(
-        active_conversations.items(),
-        key=lambda x: x[1]['last_activity'],
-        reverse=True
-    ))
+    summary = g.tenant.manager.get_conversation_summary()
+    page_size = get_config().DASHBOARD_PAGE_SIZE
+    page, next_cursor = g.tenant.manager.get_conversations_page(request.args.get('cursor'), page_size)
 
     return render_template('index.html', 
                          summary=summary, 
-                         conversations=sorted_conversations)
+                         conversations=dict(page),
+                         next_cursor=next_cursor,
+                         page_size=page_size,
+                         first_page=not request.args.get('cursor'))
 
-@app.route('/conversation/<anon_id>')
+@tenant_route('/conversation/<anon_id>')
 def view_conversation(anon_id):
-    conversation = conversation_manager.get_conversation(anon_id)
-    user_data = conversation_manager.anon_to_user.get(anon_id, {})
+    page_size = get_config().HISTORY_PAGE_SIZE
+    # ?at=<cursor> (from a search result) shows the page ending at that message
+    at = request.args.get('at', type=int)
+    page = g.tenant.manager.get_conversation_page(anon_id, before=at + 1 if at is not None else None, limit=page_size)
+    user_data = g.tenant.manager.anon_to_user.get(anon_id, {})
 
-    if not conversation and anon_id not in conversation_manager.anon_to_user:
+    if not page and anon_id not in g.tenant.manager.anon_to_user:
         return "Conversation not found", 404
 
+    # Only the newest page is rendered; the template fetches older ones on scroll
     return render_template('conversations.html', 
                          anon_id=anon_id, 
-                         conversation=conversation,
+                         conversation=[message for _, message in page],
+                         oldest_cursor=page[0][0] if page else None,
+                         newest_cursor=page[-1][0] if page else None,
+                         has_more=len(page) == page_size,
+                         is_blocked=g.tenant.manager.is_user_blocked(anon_id),
+                         focus_cursor=page[-1][0] if page and at is not None else None,
+                         page_size=page_size,
                          user_data=user_data)
 
-@app.route('/send_reply', methods=['POST'])
+@tenant_route('/api/conversation/<anon_id>/messages')
+def api_conversation_messages(anon_id):
+    before = request.args.get('before', type=int)
+    after = request.args.get('after', type=int)
+    limit = min(max(request.args.get('limit', get_config().HISTORY_PAGE_SIZE, type=int), 1), 500)
+
+    page = g.tenant.manager.get_conversation_page(anon_id, before=before, after=after, limit=limit)
+    if not page and anon_id not in g.tenant.manager.anon_to_user:
+        return jsonify({'success': False, 'error': 'Conversation not found'}), 404
+
+    messages = []
+    for cursor, message in page:
+        message_data = message.to_dict()
+        message_data['timestamp'] = message.timestamp.strftime('%Y-%m-%d %H:%M:%S')
+        message_data['cursor'] = cursor
+        messages.append(message_data)
+
+    return jsonify({'success': True, 'messages': messages, 'has_more': len(page) == limit})
+
+@tenant_route('/send_reply', methods=['POST'])
 def send_reply():
     anon_id = request.form.get('anon_id')
     message = request.form.get('message')
@@ -558,74 +1386,295 @@ def send_reply():
     if not anon_id or not message:
         return jsonify({'success': False, 'error': 'Missing anon_id or message'}), 400
 
-    user_id = conversation_manager.get_user_id(anon_id)
+    user_id = g.tenant.manager.get_user_id(anon_id)
     if not user_id:
         return jsonify({'success': False, 'error': 'User not found'}), 404
 
-    # Send typing indicator before sending reply
+    # Typing indicator first; queued ahead of the reply in the same chat, so sent first
+    bot = g.tenant.bot
     if bot:
-        bot.send_typing_action(user_id)
+        bot.send_typing_action_async(user_id, PRIORITY_HIGH)
 
     if bot and bot.send_reply_to_user(user_id, message, anon_id):
         return jsonify({'success': True})
     else:
         return jsonify({'success': False, 'error': 'Failed to send message'}), 500
 
-@app.route('/block_user', methods=['POST'])
+@tenant_route('/block_user', methods=['POST'])
 def block_user():
     anon_id = request.form.get('anon_id')
 
     if not anon_id:
         return jsonify({'success': False, 'error': 'Missing anon_id'}), 400
 
-    if conversation_manager.block_user(anon_id):
+    if g.tenant.manager.block_user(anon_id):
         return jsonify({'success': True})
     else:
         return jsonify({'success': False, 'error': 'Failed to block user'}), 500
 
-@app.route('/unblock_user', methods=['POST'])
+@tenant_route('/unblock_user', methods=['POST'])
 def unblock_user():
     anon_id = request.form.get('anon_id')
 
     if not anon_id:
         return jsonify({'success': False, 'error': 'Missing anon_id'}), 400
 
-    if conversation_manager.unblock_user(anon_id):
+    if g.tenant.manager.unblock_user(anon_id):
         return jsonify({'success': True})
     else:
         return jsonify({'success': False, 'error': 'Failed to unblock user'}), 500
 
-@app.route('/api/conversations')
+@tenant_route('/api/conversations')
 def api_conversations():
-    summary = conversation_manager.get_conversation_summary()
-    active_conversations = conversation_manager.get_active_conversations()
+    summary = g.tenant.manager.get_conversation_summary()
+    since = request.args.get('since', type=int)
+
+    if since is not None:
+        # Delta mode: rows changed after `since`, newest first, plus tombstones
+        changes = g.tenant.manager.get_changes_since(since)
+        if changes is not None:
+            rows, removed, version = changes
+            return jsonify({
+                'summary': summary,
+                'conversations': dict(rows),
+                'removed': removed,
+                'version': version,
+                'full': False
+            })
 
+    # Read the version first: anything that changes while the page is built
+    # is re-sent by the next ?since= request
+    version = g.tenant.manager.version
+    limit = min(request.args.get('limit', get_config().DASHBOARD_PAGE_SIZE, type=int), 500)
+    page, next_cursor = g.tenant.manager.get_conversations_page(request.args.get('cursor'), max(limit, 1))
+
+    # Keyed by anon_id as it always was; key order is the activity order
     return jsonify({
         'summary': summary,
-        'conversations': active_conversations
+        'conversations': dict(page),
+        'next_cursor': next_cursor,
+        'version': version,
+        'full': True
+    })
+
+@tenant_route('/api/search')
+def api_search():
+    """Ranked full-text search over every conversation, or one with ?anon_id="""
+    query = request.args.get('q', '').strip()
+    if not query:
+        return jsonify({'success': False, 'error': 'Missing q'}), 400
+    offset = max(request.args.get('offset', 0, type=int), 0)
+    limit = min(max(request.args.get('limit', 20, type=int), 1), 100)
+
+    results, total, truncated = g.tenant.manager.search_messages(
+        query, offset=offset, limit=limit, anon_id=request.args.get('anon_id'))
+    return jsonify({
+        'success': True,
+        'results': [{
+            'anon_id': anon_id,
+            'display_name': g.tenant.manager.get_display_name(anon_id),
+            'cursor': cursor,
+            'timestamp': message.timestamp.strftime('%Y-%m-%d %H:%M:%S'),
+            'direction': message['direction'],
+            'snippet': snippet(message['message'], query),
+            'score': round(score, 3)
+        } for anon_id, cursor, message, score in results],
+        'total': total,
+        'truncated': truncated,
+        'next_offset': offset + limit if offset + limit < total else None
     })
 
-@app.route('/message_editor')
+@tenant_route('/api/search_stats')
+def api_search_stats():
+    """Size of the full-text search index"""
+    if g.tenant.manager.search_index is None:
+        return jsonify({'success': False, 'error': 'Search disabled'}), 404
+    return jsonify({'success': True, 'stats': g.tenant.manager.search_index.get_stats()})
+
+@tenant_route('/api/events')
+def api_events():
+    """Server-Sent Events feed of new messages, new conversations and (un)blocks"""
+    # The generator runs after the request context is gone, so it must not touch g
+    broker = g.tenant.manager.events
+    subscription = broker.subscribe()
+
+    def stream():
+        try:
+            yield 'retry: 3000\n\n'
+            while True:
+                frame = subscription.next(timeout=15)
+                if subscription.overflowed:
+                    yield 'event: resync\ndata: {}\n\n'
+                    return
+                # A comment line keeps proxies from closing an idle stream and
+                # lets a write fail promptly once the tab is gone
+                yield frame if frame is not None else ': keepalive\n\n'
+        finally:
+            broker.unsubscribe(subscription)
+
+    return Response(stream(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@tenant_route('/api/events_stats')
+def api_events_stats():
+    return jsonify({'success': True, 'stats': g.tenant.manager.events.get_stats()})
+
+@app.route('/api/transport_stats')
+def api_transport_stats():
+    """Connection pool statistics for the Bot API transport, shared by every bot"""
+    if not bot:
+        return jsonify({'success': False, 'error': 'Bot not initialized'})
+    return jsonify({'success': True, 'stats': bot.transport.get_pool_stats()})
+
+@tenant_route('/api/engine_stats')
+def api_engine_stats():
+    """Concurrency statistics for the update engine"""
+    if not g.tenant.bot:
+        return jsonify({'success': False, 'error': 'Bot not initialized'})
+    return jsonify({'success': True, 'stats': g.tenant.bot.engine.get_stats()})
+
+@app.route('/api/scheduler_stats')
+def api_scheduler_stats():
+    """Queue depths and flood-control counters for outbound sends, shared by every bot"""
+    if not bot:
+        return jsonify({'success': False, 'error': 'Bot not initialized'})
+    return jsonify({'success': True, 'stats': bot.scheduler.get_stats()})
+
+@tenant_route('/api/maintenance_stats')
+def api_maintenance_stats():
+    """Result of the most recent conversation maintenance cycle"""
+    return jsonify({'success': True, 'stats': g.tenant.maintenance.last_cycle})
+
+@tenant_route('/api/leader_stats')
+def api_leader_stats():
+    """Which process consumes updates in multi-process mode"""
+    if g.tenant.lease is None:
+        return jsonify({'success': False, 'error': 'Single-process mode'}), 404
+    return jsonify({'success': True, 'stats': g.tenant.lease.get_stats()})
+
+@app.route('/metrics')
+def prometheus_metrics():
+    """Prometheus scrape target covering every hosted bot in this process"""
+    return Response(REGISTRY.render(), content_type=CONTENT_TYPE)
+
+def profile_access_error():
+    """Error response for a profiling request without the right PROFILE_TOKEN, or None"""
+    token = get_config().PROFILE_TOKEN
+    if not token:
+        return jsonify({'success': False, 'error': 'Profiling endpoints are disabled; set PROFILE_TOKEN'}), 404
+    supplied = request.headers.get('X-Profile-Token') or request.args.get('token', '')
+    if not hmac.compare_digest(supplied.encode('utf-8'), token.encode('utf-8')):
+        return jsonify({'success': False, 'error': 'Forbidden'}), 403
+    return None
+
+@app.route('/api/profile')
+def api_profile():
+    """The running profile, if any, and the finished ones available for download"""
+    error = profile_access_error()
+    if error:
+        return error
+    return jsonify({'success': True, 'stats': profiler.get_status()})
+
+@app.route('/api/profile/start', methods=['POST'])
+def api_profile_start():
+    """Profile the whole process for a while: {"mode": "cpu|sample|memory", "seconds": 30}"""
+    error = profile_access_error()
+    if error:
+        return error
+    data = request.get_json(silent=True) or {}
+    try:
+        seconds = int(data.get('seconds', 30))
+    except (TypeError, ValueError):
+        return jsonify({'success': False, 'error': 'seconds must be an integer'}), 400
+    try:
+        running = profiler.start(data.get('mode', 'cpu'), seconds)
+    except ProfilerError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    return jsonify({'success': True, 'profile': running})
+
+@app.route('/api/profile/stop', methods=['POST'])
+def api_profile_stop():
+    error = profile_access_error()
+    if error:
+        return error
+    stopped = profiler.stop()
+    if stopped is None:
+        return jsonify({'success': False, 'error': 'No profile running'}), 409
+    # Collected in the background; the file shows up in /api/profile
+    return jsonify({'success': True, 'profile': stopped}), 202
+
+@app.route('/api/profile/<name>')
+def api_profile_download(name):
+    error = profile_access_error()
+    if error:
+        return error
+    path = profiler.result_path(name)
+    if path is None or not os.path.exists(path):
+        return jsonify({'success': False, 'error': 'Profile not found'}), 404
+    return send_file(os.path.abspath(path), as_attachment=True, download_name=name)
+
+@app.route('/api/slow_updates')
+def api_slow_updates():
+    """Updates that took longer than SLOW_UPDATE_THRESHOLD, newest first, with their phase breakdown"""
+    error = profile_access_error()
+    if error:
+        return error
+    return jsonify({'success': True, 'stats': slow_updates.get_stats(), 'updates': slow_updates.get_recent()})
+
+@app.route('/telegram/webhook/<secret>', methods=['POST'])
+def telegram_webhook(secret):
+    """Receive updates pushed by Telegram in webhook mode; the secret names the bot"""
+    # Compared as bytes: compare_digest rejects non-ASCII str with a TypeError
+    supplied = secret.encode('utf-8')
+    bot = next((tenant.bot for tenant in tenants.values()
+                if tenant.bot and hmac.compare_digest(supplied, tenant.bot.get_webhook_secret().encode('utf-8'))), None)
+    if bot is None:
+        return jsonify({'success': False, 'error': 'Forbidden'}), 403
+    if bot.update_mode is None and bot.config.UPDATE_MODE == 'webhook':
+        # Not consuming here: still starting, or another process holds the
+        # leader lease (PROCESS_MODE=multi); a 503 makes Telegram redeliver,
+        # possibly to the leader
+        return jsonify({'success': False, 'error': 'Not consuming updates'}), 503
+    if bot.update_mode != 'webhook':
+        return jsonify({'success': False, 'error': 'Webhook mode disabled'}), 404
+
+    header = request.headers.get('X-Telegram-Bot-Api-Secret-Token', '')
+    if not hmac.compare_digest(header.encode('utf-8'), bot.get_webhook_secret().encode('utf-8')):
+        return jsonify({'success': False, 'error': 'Forbidden'}), 403
+
+    update = request.get_json(silent=True)
+    if not update or 'update_id' not in update:
+        return jsonify({'success': False, 'error': 'Invalid update'}), 400
+
+    if not bot.engine.submit(update):
+        # Not ready yet; a non-2xx makes Telegram redeliver later
+        return jsonify({'success': False, 'error': 'Bot not ready'}), 503
+    return jsonify({'success': True})
+
+@tenant_route('/message_editor')
 def message_editor():
     """Message editor interface"""
     return render_template('message_editor.html')
 
-@app.route('/api/messages')
+@tenant_route('/api/messages')
 def api_messages():
     """Get all messages for editing"""
+    bot = g.tenant.bot
     if bot and hasattr(bot, 'message_config'):
         messages = {}
         for key, data in bot.message_config.messages.items():
             messages[key] = {
                 'text': data['text'],
-                'description': data['description']
+                'description': data['description'],
+                'placeholders': bot.message_config.get_placeholders(key)
             }
         return jsonify({'success': True, 'messages': messages})
     return jsonify({'success': False, 'error': 'Bot not initialized'})
 
-@app.route('/api/update_message', methods=['POST'])
+@tenant_route('/api/update_message', methods=['POST'])
 def api_update_message():
     """Update a specific message"""
+    bot = g.tenant.bot
     if not bot or not hasattr(bot, 'message_config'):
         return jsonify({'success': False, 'error': 'Bot not initialized'})
 
@@ -636,14 +1685,20 @@ def api_update_message():
     if not key or not text:
         return jsonify({'success': False, 'error': 'Missing key or text'})
 
-    if bot.message_config.set_message(key, text):
+    try:
+        updated = bot.message_config.set_message(key, text)
+    except TemplateError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+
+    if updated:
         return jsonify({'success': True})
     else:
         return jsonify({'success': False, 'error': 'Failed to update message'})
 
-@app.route('/api/reset_message', methods=['POST'])
+@tenant_route('/api/reset_message', methods=['POST'])
 def api_reset_message():
     """Reset a message to default"""
+    bot = g.tenant.bot
     if not bot or not hasattr(bot, 'message_config'):
         return jsonify({'success': False, 'error': 'Bot not initialized'})
 
@@ -658,9 +1713,10 @@ def api_reset_message():
     else:
         return jsonify({'success': False, 'error': 'Failed to reset message'})
 
-@app.route('/api/reset_all_messages', methods=['POST'])
+@tenant_route('/api/reset_all_messages', methods=['POST'])
 def api_reset_all_messages():
     """Reset all messages to default"""
+    bot = g.tenant.bot
     if not bot or not hasattr(bot, 'message_config'):
         return jsonify({'success': False, 'error': 'Bot not initialized'})
 
@@ -669,16 +1725,63 @@ def api_reset_all_messages():
     else:
         return jsonify({'success': False, 'error': 'Failed to reset messages'})
 
-def run_bot():
+def create_bots():
+    """Build every tenant's bot on one shared transport and outbound scheduler"""
     global bot
-    bot_token = os.getenv('TELEGRAM_BOT_TOKEN')
-    admin_chat_id = os.getenv('ADMIN_CHAT_ID')
-
-    if admin_chat_id:
-        admin_chat_id = int(admin_chat_id)
-
-    bot = SimpleTelegramBot(bot_token, admin_chat_id, conversation_manager)
-    bot.run()
+    config = get_config()
+    transport = TelegramTransport.from_config(config)
+    scheduler = OutboundScheduler.from_config(config)
+    for tenant in tenants.values():
+        tenant.create_bot(transport, scheduler)
+    bot = default_tenant.bot if default_tenant else None
+
+def start_multiprocess():
+    """Join a group of processes sharing one SQLite database per bot
+
+    Every process serves the dashboard and can send replies; for each bot,
+    the holder of that bot's leader lease also consumes its updates, and
+    another process takes over within LEADER_LEASE_TTL seconds if it dies.
+    Call once per process, after any fork (e.g. from a gunicorn post_fork
+    hook). Returns False if the configuration cannot share state.
+    """
+    global leader_lease
+    from leader import LeaderLease
+
+    config = get_config()
+    if config.STORAGE_BACKEND != 'sqlite':
+        logger.error("PROCESS_MODE=multi requires STORAGE_BACKEND=sqlite")
+        return False
+
+    if not tenants and not use_tenants(load_tenants()):
+        return False  # load_tenants() already logged why
+    create_bots()
+    # Telegram answers 409 to overlapping getUpdates. A leader that cannot
+    # renew steps down at least ttl/3 before its lease lapses, so a shorter
+    # long poll is over by the time another process can take over.
+    poll_timeout = min(config.POLL_TIMEOUT, max(int(config.LEADER_LEASE_TTL / 3) - 1, 1))
+    for tenant in tenants.values():
+        tenant.manager.storage.start_refresh(tenant.manager, config.STATE_REFRESH_INTERVAL)
+        tenant.bot.poll_timeout = poll_timeout
+        consumer = {}
+
+        def elected(tenant_bot=tenant.bot, consumer=consumer):
+            consumer['thread'] = threading.Thread(
+                target=tenant_bot.run, name=f'update-consumer-{tenant_bot.bot_id}', daemon=True)
+            consumer['thread'].start()
+
+        def demoted(tenant_bot=tenant.bot, consumer=consumer):
+            # engine.run() returns once the in-flight getUpdates has, so waiting
+            # for it drains the poll before the lease is released
+            tenant_bot.engine.stop()
+            thread = consumer.pop('thread', None)
+            if thread is not None:
+                thread.join(tenant_bot.poll_timeout + 10)
+
+        # Each bot's lease lives in its own database, so the name can stay the same
+        tenant.lease = LeaderLease(tenant.manager.storage.path, ttl=config.LEADER_LEASE_TTL)
+        tenant.lease.start(on_elected=elected, on_demoted=demoted)
+    leader_lease = default_tenant.lease
+    return True
 
 def run_flask():
     # Start web interface
@@ -688,28 +1791,40 @@ def run_flask():
     app.run(host='0.0.0.0', port=port, debug=False, use_reloader=False)
 
 def main():
-    bot_token = os.getenv('TELEGRAM_BOT_TOKEN')
-    admin_chat_id = os.getenv('ADMIN_CHAT_ID')
+    if not get_config().BOTS_FILE:
+        bot_token = os.getenv('TELEGRAM_BOT_TOKEN')
+        admin_chat_id = os.getenv('ADMIN_CHAT_ID')
 
-    if not bot_token:
-        logger.error("TELEGRAM_BOT_TOKEN environment variable is required")
-        return
+        if not bot_token:
+            logger.error("TELEGRAM_BOT_TOKEN environment variable is required")
+            return
 
-    if not admin_chat_id:
-        logger.error("ADMIN_CHAT_ID environment variable is required")
-        return
+        if not admin_chat_id:
+            logger.error("ADMIN_CHAT_ID environment variable is required")
+            return
 
-    try:
-        admin_chat_id = int(admin_chat_id)
-    except ValueError:
-        logger.error("ADMIN_CHAT_ID must be a valid integer")
-        return
+        try:
+            admin_chat_id = int(admin_chat_id)
+        except ValueError:
+            logger.error("ADMIN_CHAT_ID must be a valid integer")
+            return
+
+    if not use_tenants(load_tenants()):
+        return  # load_tenants() already logged why
+
+    if get_config().PROCESS_MODE == 'multi':
+        if not start_multiprocess():
+            return
+    else:
+        create_bots()
+        for tenant in tenants.values():
+            tenant.maintenance.start()
 
-    # Start bot in a separate thread
-    bot_thread = threading.Thread(target=run_bot, daemon=True)
-    bot_thread.start()
+            # Start each bot in a separate thread
+            bot_thread = threading.Thread(target=tenant.bot.run, name=f'bot-{tenant.bot_id}', daemon=True)
+            bot_thread.start()
 
-    logger.info("Starting Anonymous Telegram Bot...")
+    logger.info(f"Starting Anonymous Telegram Bot ({len(tenants)} bot(s): {', '.join(tenants)})...")
     logger.info("Web interface available at http://0.0.0.0:5000")
 
     # Start Flask app (this will block)
@@ -0,0 +1,419 @@
+"""
+Conversation Storage
+Persistence backends for SimpleConversationManager
+"""
+
+import atexit
+import logging
+import sqlite3
+import threading
+import time
+from datetime import datetime
+from config import namespaced_path
+from message_record import MessageRecord, intern_sender
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    anon_id TEXT PRIMARY KEY,
+    user_id INTEGER NOT NULL,
+    username TEXT,
+    display_name TEXT,
+    registered_at REAL,
+    last_activity REAL
+);
+CREATE INDEX IF NOT EXISTS idx_users_user_id ON users (user_id);
+
+CREATE TABLE IF NOT EXISTS messages (
+    id INTEGER PRIMARY KEY,
+    anon_id TEXT NOT NULL,
+    timestamp REAL NOT NULL,
+    user_id INTEGER,
+    username TEXT,
+    display_name TEXT,
+    message TEXT NOT NULL,
+    direction TEXT NOT NULL,
+    photo_file_id TEXT,
+    caption TEXT,
+    seq INTEGER  -- position of the message in its conversation, from 0
+);
+CREATE INDEX IF NOT EXISTS idx_messages_anon_ts ON messages (anon_id, timestamp);
+CREATE INDEX IF NOT EXISTS idx_messages_anon_id ON messages (anon_id, id);
+CREATE INDEX IF NOT EXISTS idx_messages_user_id ON messages (user_id);
+
+CREATE TABLE IF NOT EXISTS blocked_users (
+    anon_id TEXT PRIMARY KEY
+);
+"""
+
+# Statements are module constants so sqlite3's per-connection statement
+# cache always hands back the already-prepared statement
+# seq is numbered inside the write transaction, so processes sharing the
+# database agree on it
+INSERT_MESSAGE = (
+    "INSERT INTO messages (anon_id, timestamp, user_id, username, display_name, "
+    "message, direction, photo_file_id, caption, seq) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, "
+    "(SELECT COALESCE(MAX(seq) + 1, 0) FROM messages WHERE anon_id = ?1))"
+)
+UPSERT_USER = (
+    "INSERT INTO users (anon_id, user_id, username, display_name, registered_at, last_activity) "
+    "VALUES (?, ?, ?, ?, ?, ?) ON CONFLICT(anon_id) DO UPDATE SET "
+    "username = excluded.username, display_name = excluded.display_name, "
+    "last_activity = excluded.last_activity"
+)
+INSERT_BLOCKED = "INSERT OR IGNORE INTO blocked_users (anon_id) VALUES (?)"
+DELETE_BLOCKED = "DELETE FROM blocked_users WHERE anon_id = ?"
+SELECT_CONVERSATION = (
+    "SELECT id, anon_id, timestamp, user_id, username, display_name, message, direction, "
+    "photo_file_id, caption FROM messages WHERE anon_id = ? ORDER BY timestamp, id"
+)
+# History pages are keyed by message id, which grows with insertion order
+SELECT_PAGE_BEFORE = (
+    "SELECT id, anon_id, timestamp, user_id, username, display_name, message, direction, "
+    "photo_file_id, caption FROM messages WHERE anon_id = ? AND id < ? ORDER BY id DESC LIMIT ?"
+)
+SELECT_PAGE_AFTER = (
+    "SELECT id, anon_id, timestamp, user_id, username, display_name, message, direction, "
+    "photo_file_id, caption FROM messages WHERE anon_id = ? AND id > ? ORDER BY id LIMIT ?"
+)
+# A conversation's messages from a position on (LIMIT -1: no limit), found
+# through idx_messages_anon_seq rather than by skipping the earlier ones
+SELECT_FROM_POSITION = (
+    "SELECT id, anon_id, timestamp, user_id, username, display_name, message, direction, "
+    "photo_file_id, caption FROM messages WHERE anon_id = ? AND seq >= ? ORDER BY seq LIMIT ?"
+)
+# Search index backfill, in insertion order
+SELECT_MESSAGE_TEXT = "SELECT anon_id, message, caption FROM messages ORDER BY id"
+# Shared-state refresh (multi-process mode): what other processes committed
+SELECT_USERS_SINCE = (
+    "SELECT anon_id, user_id, username, display_name, registered_at, last_activity "
+    "FROM users WHERE last_activity >= ?"
+)
+# Oldest first, so shared change versions (the ids) are logged in increasing order
+SELECT_TOUCHED_CONVERSATIONS = (
+    "SELECT anon_id, MAX(id) FROM messages WHERE id > ? GROUP BY anon_id ORDER BY 2"
+)
+COUNT_CONVERSATION = "SELECT COUNT(*) FROM messages WHERE anon_id = ?"
+SELECT_LAST_MESSAGES = (
+    "SELECT m.id, m.anon_id, m.timestamp, m.user_id, m.username, m.display_name, m.message, "
+    "m.direction, m.photo_file_id, m.caption, c.total FROM messages m JOIN ("
+    "SELECT anon_id, MAX(id) AS last_id, COUNT(*) AS total FROM messages GROUP BY anon_id"
+    ") c ON m.id = c.last_id"
+)
+
+
+MAX_MESSAGE_ID = 2 ** 63 - 1
+
+
+def _epoch(value):
+    return value.timestamp() if value is not None else None
+
+
+def _datetime(value):
+    return datetime.fromtimestamp(value) if value is not None else None
+
+
+def _row_to_message(row):
+    return MessageRecord(
+        int(row[2]),
+        intern_sender(row[1], row[3], row[4], row[5]),
+        row[6],
+        row[7],
+        row[8],
+        row[9]
+    )
+
+
+def _row_to_user(row):
+    anon_id, user_id, username, display_name, registered_at, last_activity = row
+    return anon_id, {
+        'user_id': user_id,
+        'username': username,
+        'display_name': display_name,
+        'registered_at': _datetime(registered_at),
+        'last_activity': _datetime(last_activity)
+    }
+
+
+class SQLiteStorage:
+    """SQLite (WAL) backend; message history lives on disk, not in the manager"""
+
+    holds_messages = True
+
+    def __init__(self, path, flush_interval=0.5, batch_size=500):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+
+        self._conn = self._connect()
+        self._conn.executescript(SCHEMA)
+        self._number_messages()
+        self._write_lock = threading.Lock()
+        self._local = threading.local()
+
+        self._buffer_lock = threading.Lock()
+        self._pending_messages = []
+        self._pending_users = {}
+        self._pending_blocks = {}
+
+        # Refresh watermarks: data_version of the refresh connection, the
+        # newest message id and user activity already reflected in the manager
+        self._data_version = None
+        self._last_message_id = 0
+        self._users_since = 0
+        self._refresher = None
+
+        self._wake = threading.Event()
+        self._closed = False
+        self._flusher = threading.Thread(target=self._flush_loop, name='sqlite-flush', daemon=True)
+        self._flusher.start()
+        atexit.register(self.close)
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, check_same_thread=False, cached_statements=128)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA busy_timeout=5000")
+        return conn
+
+    def _number_messages(self):
+        """Fill in seq for databases created before messages had one, then index it"""
+        # IMMEDIATE: a second process starting at the same time waits for ours
+        self._conn.execute("BEGIN IMMEDIATE")
+        try:
+            columns = {row[1] for row in self._conn.execute("PRAGMA table_info(messages)")}
+            if 'seq' not in columns:
+                self._conn.execute("ALTER TABLE messages ADD COLUMN seq INTEGER")
+                counts = {}
+                numbered = []
+                for message_id, anon_id in self._conn.execute("SELECT id, anon_id FROM messages ORDER BY id"):
+                    seq = counts.get(anon_id, 0)
+                    counts[anon_id] = seq + 1
+                    numbered.append((seq, message_id))
+                self._conn.executemany("UPDATE messages SET seq = ? WHERE id = ?", numbered)
+                logger.info(f"Numbered {len(numbered)} messages in {self.path}")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_messages_anon_seq ON messages (anon_id, seq)")
+            self._conn.commit()
+        except Exception:
+            self._conn.rollback()
+            raise
+
+    def _reader(self):
+        """One read connection per thread; WAL lets them run beside the writer"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._connect()
+            self._local.conn = conn
+        return conn
+
+    # Loading
+
+    def load(self, manager):
+        self.flush()
+        conn = self._reader()
+        for row in conn.execute(SELECT_USERS_SINCE, (0,)):
+            anon_id, user_data = _row_to_user(row)
+            manager.anon_to_user[anon_id] = user_data
+            manager.user_to_anon[user_data['user_id']] = anon_id
+            self._users_since = max(self._users_since, row[5] or 0)
+
+        manager.blocked_users = {row[0] for row in conn.execute("SELECT anon_id FROM blocked_users")}
+
+        for row in conn.execute(SELECT_LAST_MESSAGES):
+            manager.message_counts[row[1]] = row[10]
+            manager._update_active(row[1], _row_to_message(row))
+            self._last_message_id = max(self._last_message_id, row[0])
+
+        logger.info(f"Loaded {len(manager.anon_to_user)} users from {self.path}")
+
+    # Writes (buffered, committed in batches by the flush thread)
+
+    def save_user(self, anon_id, user_data):
+        row = (
+            anon_id,
+            user_data['user_id'],
+            user_data.get('username'),
+            user_data.get('display_name'),
+            _epoch(user_data.get('registered_at')),
+            _epoch(user_data.get('last_activity'))
+        )
+        with self._buffer_lock:
+            self._pending_users[anon_id] = row
+
+    def save_message(self, anon_id, message_data):
+        row = (
+            anon_id,
+            _epoch(message_data['timestamp']),
+            message_data.get('user_id'),
+            message_data.get('username'),
+            message_data.get('display_name'),
+            message_data['message'],
+            message_data['direction'],
+            message_data.get('photo_file_id'),
+            message_data.get('caption')
+        )
+        with self._buffer_lock:
+            self._pending_messages.append(row)
+            full = len(self._pending_messages) >= self.batch_size
+        if full:
+            self._wake.set()
+
+    def set_blocked(self, anon_id, blocked):
+        with self._buffer_lock:
+            self._pending_blocks[anon_id] = blocked
+
+    def _has_pending(self):
+        return bool(self._pending_messages or self._pending_users or self._pending_blocks)
+
+    def flush(self):
+        """Commit everything buffered so far in a single transaction"""
+        with self._write_lock:
+            with self._buffer_lock:
+                if not self._has_pending():
+                    return
+                messages, self._pending_messages = self._pending_messages, []
+                users, self._pending_users = self._pending_users, {}
+                blocks, self._pending_blocks = self._pending_blocks, {}
+
+            try:
+                with self._conn:
+                    if users:
+                        self._conn.executemany(UPSERT_USER, users.values())
+                    if messages:
+                        self._conn.executemany(INSERT_MESSAGE, messages)
+                    for anon_id, blocked in blocks.items():
+                        self._conn.execute(INSERT_BLOCKED if blocked else DELETE_BLOCKED, (anon_id,))
+            except Exception as e:
+                logger.error(f"Error flushing to {self.path}: {e}")
+                # Put the batch back in front of anything buffered meanwhile
+                with self._buffer_lock:
+                    self._pending_messages[:0] = messages
+                    for anon_id, row in users.items():
+                        self._pending_users.setdefault(anon_id, row)
+                    for anon_id, blocked in blocks.items():
+                        self._pending_blocks.setdefault(anon_id, blocked)
+
+    def _flush_loop(self):
+        while not self._closed:
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            self.flush()
+
+    # Reads
+
+    def get_messages(self, anon_id):
+        # Read-your-writes for the dashboard: commit what is still buffered
+        if self._has_pending():
+            self.flush()
+        return [_row_to_message(row) for row in self._reader().execute(SELECT_CONVERSATION, (anon_id,))]
+
+    def get_messages_page(self, anon_id, before=None, after=None, limit=50):
+        """(id, message) pairs older than before or newer than after, oldest first"""
+        if self._has_pending():
+            self.flush()
+        reader = self._reader()
+        if after is not None:
+            rows = reader.execute(SELECT_PAGE_AFTER, (anon_id, after, limit)).fetchall()
+        else:
+            cursor = before if before is not None else MAX_MESSAGE_ID
+            rows = reader.execute(SELECT_PAGE_BEFORE, (anon_id, cursor, limit)).fetchall()
+            rows.reverse()
+        return [(row[0], _row_to_message(row)) for row in rows]
+
+    def get_messages_from(self, anon_id, position, limit=-1):
+        """(id, message) pairs starting at the position-th message of the conversation"""
+        if self._has_pending():
+            self.flush()
+        rows = self._reader().execute(SELECT_FROM_POSITION, (anon_id, position, limit)).fetchall()
+        return [(row[0], _row_to_message(row)) for row in rows]
+
+    def iter_message_text(self):
+        """(anon_id, position, message, caption) for every stored message, oldest first"""
+        self.flush()
+        positions = {}
+        for anon_id, message, caption in self._reader().execute(SELECT_MESSAGE_TEXT):
+            position = positions.get(anon_id, 0)
+            positions[anon_id] = position + 1
+            yield anon_id, position, message, caption
+
+    # Shared state (several processes on one database file)
+
+    def refresh(self, manager):
+        """Apply rows other processes committed since the last call; True if anything changed
+
+        PRAGMA data_version only moves when another connection commits, so an
+        idle database costs one pragma per call. Updates are absolute values
+        (counts, latest rows), so seeing this process's own writes is harmless.
+        """
+        self.flush()
+        conn = self._reader()
+        data_version = conn.execute("PRAGMA data_version").fetchone()[0]
+        if data_version == self._data_version:
+            return False
+        self._data_version = data_version
+
+        for row in conn.execute(SELECT_USERS_SINCE, (self._users_since,)).fetchall():
+            anon_id, user_data = _row_to_user(row)
+            manager.apply_remote_user(anon_id, user_data)
+            self._users_since = max(self._users_since, row[5] or 0)
+
+        manager.apply_remote_blocked({row[0] for row in conn.execute("SELECT anon_id FROM blocked_users")})
+
+        for anon_id, last_id in conn.execute(SELECT_TOUCHED_CONVERSATIONS, (self._last_message_id,)).fetchall():
+            count = conn.execute(COUNT_CONVERSATION, (anon_id,)).fetchone()[0]
+            last_row = conn.execute(SELECT_PAGE_BEFORE, (anon_id, MAX_MESSAGE_ID, 1)).fetchone()
+            manager.apply_remote_message(anon_id, count, _row_to_message(last_row), last_id)
+            self._last_message_id = max(self._last_message_id, last_id)
+        return True
+
+    def start_refresh(self, manager, interval=1.0):
+        """Keep manager in step with other processes from a background thread
+
+        The manager's delta-sync versions become message ids, the same in
+        every process sharing this file.
+        """
+        manager.use_shared_versions(self._last_message_id)
+        def loop():
+            while not self._closed:
+                try:
+                    self.refresh(manager)
+                except Exception as e:
+                    logger.error(f"Error refreshing from {self.path}: {e}")
+                time.sleep(interval)
+
+        if self._refresher is None:
+            self._refresher = threading.Thread(target=loop, name='sqlite-refresh', daemon=True)
+            self._refresher.start()
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        self._wake.set()
+        self.flush()
+
+
+def create_storage(config, namespace=None):
+    """Build the storage backend selected by config.STORAGE_BACKEND
+
+    namespace keeps each hosted bot's data apart (see config.namespaced_path).
+    """
+    backend = config.STORAGE_BACKEND
+    if backend == 'sqlite':
+        return SQLiteStorage(
+            namespaced_path(config.SQLITE_PATH, namespace),
+            flush_interval=config.STORAGE_FLUSH_INTERVAL,
+            batch_size=config.STORAGE_BATCH_SIZE
+        )
+    if backend == 'journal':
+        from journal import JournalStorage
+        return JournalStorage(
+            namespaced_path(config.JOURNAL_DIR, namespace),
+            commit_interval=config.JOURNAL_COMMIT_INTERVAL,
+            snapshot_interval=config.SNAPSHOT_INTERVAL,
+            snapshot_records=config.SNAPSHOT_RECORDS
+        )
+    if backend != 'memory':
+        logger.warning(f"Unknown storage backend '{backend}', keeping conversations in memory")
+    return None
@@ -0,0 +1,125 @@
+"""
+Telegram Transport
+Shared keep-alive HTTP session for Bot API calls
+"""
+
+import logging
+import threading
+import time
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from metrics import REGISTRY
+
+logger = logging.getLogger(__name__)
+
+# Transient server-side failures worth retrying. 429 is deliberately absent:
+# flood control carries its own retry_after and must not be hammered blindly.
+RETRY_STATUSES = (500, 502, 503, 504)
+# Only these are retried on a 5xx. Telegram may have applied a POST
+# (sendMessage) before answering 502, so POSTs are retried only when the
+# connection could not be made, which urllib3 does for every method.
+IDEMPOTENT_METHODS = frozenset(['GET'])
+
+API_DURATION = REGISTRY.histogram(
+    'bot_api_request_duration_seconds', 'Bot API call latency by method, transport retries included.', ['method'])
+API_ERRORS = REGISTRY.counter(
+    'bot_api_errors_total', 'Bot API calls that failed, by method and error code or exception.', ['method', 'error'])
+
+
+class TelegramTransport:
+    def __init__(self, pool_size=16, connect_timeout=5.0, read_timeout=15.0,
+                 max_retries=3, backoff_factor=0.5):
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+
+        retry = Retry(
+            total=max_retries,
+            connect=max_retries,
+            read=0,  # a read failure may mean Telegram already acted on the call
+            status=max_retries,
+            backoff_factor=backoff_factor,
+            status_forcelist=RETRY_STATUSES,
+            allowed_methods=IDEMPOTENT_METHODS,
+            respect_retry_after_header=False,
+            raise_on_status=False
+        )
+        self.adapter = HTTPAdapter(
+            pool_connections=pool_size,
+            pool_maxsize=pool_size,
+            max_retries=retry,
+            pool_block=False
+        )
+        self.session = requests.Session()
+        self.session.mount('https://', self.adapter)
+        self.session.mount('http://', self.adapter)
+
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.errors = 0
+
+    @classmethod
+    def from_config(cls, config):
+        return cls(
+            pool_size=config.HTTP_POOL_SIZE,
+            connect_timeout=config.HTTP_CONNECT_TIMEOUT,
+            read_timeout=config.HTTP_READ_TIMEOUT,
+            max_retries=config.HTTP_MAX_RETRIES,
+            backoff_factor=config.HTTP_BACKOFF_FACTOR
+        )
+
+    def _timeout(self, read_timeout):
+        return (self.connect_timeout, read_timeout if read_timeout is not None else self.read_timeout)
+
+    def _request(self, http_method, url, read_timeout=None, **kwargs):
+        method = url.rsplit('/', 1)[-1]  # never label with the URL: it holds the token
+        with self._lock:
+            self.calls += 1
+        started = time.perf_counter()
+        try:
+            response = self.session.request(http_method, url, timeout=self._timeout(read_timeout), **kwargs)
+            result = response.json()
+        except Exception as e:
+            with self._lock:
+                self.errors += 1
+            API_ERRORS.labels(method, type(e).__name__).inc()
+            raise
+        finally:
+            API_DURATION.labels(method).observe(time.perf_counter() - started)
+        if isinstance(result, dict) and result.get('ok') is False:
+            API_ERRORS.labels(method, str(result.get('error_code', 'unknown'))).inc()
+        return result
+
+    def post(self, url, data=None, read_timeout=None, files=None):
+        """POST a Bot API method and return the decoded JSON body; files are sent as multipart"""
+        return self._request('POST', url, read_timeout=read_timeout, data=data, files=files)
+
+    def get(self, url, params=None, read_timeout=None):
+        """GET a Bot API method and return the decoded JSON body"""
+        return self._request('GET', url, read_timeout=read_timeout, params=params)
+
+    def get_pool_stats(self):
+        """Report connection reuse across all pooled hosts"""
+        connections = 0
+        requests_sent = 0
+        pools = self.adapter.poolmanager.pools
+        for key in list(pools.keys()):
+            pool = pools.get(key)
+            if pool is None:
+                continue
+            connections += pool.num_connections
+            requests_sent += pool.num_requests
+
+        reused = max(requests_sent - connections, 0)
+        return {
+            'calls': self.calls,
+            'errors': self.errors,
+            'http_requests': requests_sent,
+            'connections_opened': connections,
+            'connections_reused': reused,
+            'reuse_ratio': round(reused / requests_sent, 3) if requests_sent else 0.0,
+            'pools': len(pools)
+        }
+
+    def close(self):
+        self.session.close()
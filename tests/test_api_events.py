@@ -0,0 +1,47 @@
+"""
+Dashboard Event Stream Tests
+Subscriptions opened by /api/events are released when the client goes away
+"""
+
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import simple_bot  # noqa: E402
+from config import Config  # noqa: E402
+
+
+class EventStreamDisconnectTest(unittest.TestCase):
+
+    def setUp(self):
+        # A tenant of our own, so nothing touches the working directory's data
+        self._tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self._tmp.cleanup)
+
+        class TestConfig(Config):
+            STORAGE_BACKEND = 'memory'
+            SPILL_DIR = os.path.join(self._tmp.name, 'spill_data')
+
+        self.tenant = simple_bot.BotTenant('default', 'test-token', 1, config=TestConfig)
+        previous = simple_bot.tenants
+        simple_bot.use_tenants({'default': self.tenant})
+        self.addCleanup(simple_bot.use_tenants, previous)
+
+    def test_disconnect_releases_subscription(self):
+        broker = self.tenant.manager.events
+        response = simple_bot.app.test_client().get('/api/events', buffered=False)
+        self.assertEqual(next(iter(response.response)), b'retry: 3000\n\n')
+        self.assertEqual(broker.get_stats()['subscribers'], 1)
+
+        # What the WSGI server does once the tab is closed
+        response.close()
+
+        self.assertEqual(broker.get_stats()['subscribers'], 0)
+        self.assertFalse(broker.active())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,169 @@
+"""
+Update Engine
+Asyncio dispatcher that handles updates concurrently while keeping per-chat order
+"""
+
+import asyncio
+import logging
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+# Waits after a failed getUpdates: doubling from the first to the cap, back to
+# none after a successful poll. A bad token (401) or a webhook/leader handover
+# (409) fails instantly, so retrying without a wait would hammer the Bot API.
+POLL_RETRY_DELAY = 1.0
+POLL_RETRY_MAX_DELAY = 60.0
+
+
+class PollError(Exception):
+    """getUpdates failed; retry_after is Telegram's own wait (flood control), if it sent one"""
+
+    def __init__(self, message, retry_after=None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class UpdateEngine:
+    def __init__(self, bot, max_concurrent=32, max_pending_per_chat=100):
+        self.bot = bot
+        self.max_concurrent = max_concurrent
+        self.max_pending_per_chat = max_pending_per_chat
+        self.loop = None
+        self._main_task = None
+        self.executor = None
+        self._slots = None
+        self._chats = {}  # chat key -> asyncio.Queue of pending updates
+        self._recent_ids = set()  # webhook redeliveries are dropped by update_id
+        self._recent_order = deque()
+        self._recent_lock = threading.Lock()
+        self.in_flight = 0
+        self.handled = 0
+
+    @staticmethod
+    def _chat_key(update):
+        """Updates from the same sender are serialized; anything else runs freely"""
+        for value in update.values():
+            if isinstance(value, dict):
+                sender = value.get('from') or value.get('chat')
+                if sender and 'id' in sender:
+                    return sender['id']
+        return update.get('update_id')
+
+    def run(self, mode='polling'):
+        """Consume updates until stop() is called; can be run again afterwards"""
+        try:
+            asyncio.run(self._main(mode))
+        except asyncio.CancelledError:
+            logger.info("Update engine stopped")
+
+    def stop(self):
+        """Stop consuming updates (thread-safe); handlers already running finish"""
+        loop, task = self.loop, self._main_task
+        if loop is not None and task is not None:
+            loop.call_soon_threadsafe(task.cancel)
+
+    async def _main(self, mode):
+        self.loop = asyncio.get_running_loop()
+        self._main_task = asyncio.current_task()
+        self._chats = {}
+        self.executor = ThreadPoolExecutor(max_workers=self.max_concurrent, thread_name_prefix='update')
+        self._slots = asyncio.Semaphore(self.max_concurrent)
+        try:
+            if mode == 'webhook':
+                logger.info("Waiting for updates via webhook...")
+                await asyncio.Event().wait()  # updates arrive through submit()
+            else:
+                await self._poll_forever()
+        finally:
+            self.loop = None
+            self._main_task = None
+            self.executor.shutdown(wait=False)
+
+    async def _poll_forever(self):
+        logger.info("Starting bot polling...")
+        delay = 0.0
+        while True:
+            try:
+                # The long poll blocks, so it gets the loop's default executor
+                # and never competes with handlers for a slot
+                updates = await self.loop.run_in_executor(None, self.bot.get_updates)
+            except Exception as e:
+                delay = min(delay * 2, POLL_RETRY_MAX_DELAY) if delay else POLL_RETRY_DELAY
+                wait = max(delay, getattr(e, 'retry_after', None) or 0)
+                logger.error(f"Error getting updates: {e}; retrying in {wait:g}s")
+                await asyncio.sleep(wait)
+                continue
+
+            # Only a successful long poll goes straight back for more
+            delay = 0.0
+            try:
+                for update in updates:
+                    self.bot.last_update_id = update['update_id']
+                    await self.dispatch(update)
+            except Exception as e:
+                logger.error(f"Error in bot loop: {e}")
+                await asyncio.sleep(POLL_RETRY_DELAY)
+
+    def submit(self, update):
+        """Hand an update to the engine from another thread (webhook requests)"""
+        if self.loop is None:
+            return False
+
+        update_id = update.get('update_id')
+        with self._recent_lock:
+            if update_id in self._recent_ids:
+                return True
+            self._recent_ids.add(update_id)
+            self._recent_order.append(update_id)
+            if len(self._recent_order) > 1000:
+                self._recent_ids.discard(self._recent_order.popleft())
+
+        asyncio.run_coroutine_threadsafe(self.dispatch(update), self.loop)
+        return True
+
+    async def dispatch(self, update):
+        """Queue an update behind earlier updates from the same chat"""
+        key = self._chat_key(update)
+        queue = self._chats.get(key)
+        if queue is None:
+            queue = asyncio.Queue(maxsize=self.max_pending_per_chat)
+            self._chats[key] = queue
+            self.loop.create_task(self._chat_worker(key, queue))
+        # Blocks the poller only when a single chat floods past its cap
+        await queue.put(update)
+
+    async def _chat_worker(self, key, queue):
+        while True:
+            try:
+                update = queue.get_nowait()
+            except asyncio.QueueEmpty:
+                # No await between the empty check and removal, so dispatch()
+                # cannot slip an update into a queue nobody is draining
+                del self._chats[key]
+                return
+
+            async with self._slots:
+                self.in_flight += 1
+                try:
+                    await self.loop.run_in_executor(self.executor, self._handle, update)
+                finally:
+                    self.in_flight -= 1
+                    self.handled += 1
+
+    def _handle(self, update):
+        try:
+            self.bot.handle_update(update)
+        except Exception as e:
+            logger.error(f"Error handling update {update.get('update_id')}: {e}")
+
+    def get_stats(self):
+        return {
+            'in_flight': self.in_flight,
+            'active_chats': len(self._chats),
+            'pending': sum(q.qsize() for q in list(self._chats.values())),
+            'handled': self.handled,
+            'max_concurrent': self.max_concurrent
+        }